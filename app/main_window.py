@@ -18,6 +18,7 @@ from handlers.logging_handler import InitLogHandler, logger, setup_qt_logging
 from handlers.realtime_writer import RealtimeWriter, purge_raw_outputs
 from procedures.calculation import Calculation
 from procedures.calculation_signals import CalcSignals
+from procedures.rain.k_r_relation import k_r_table
 
 from app.form_dialog import FormDialog
 from app.selection_dialog import SelectionDialog
@@ -229,6 +230,9 @@ class MainWindow(QMainWindow):
         self.links = sql_man.load_metadata()
         logger.info("%d microwave link's definitions loaded from MariaDB.", len(self.links))
 
+        # precompute k-R relation coefficients of the links
+        k_r_table.build(self.links)
+
         # init link sets
         self.sets_man = LinksetsHandler(self.links)
         self.current_selection = {}   # link channel selection flag: 0=none, 1=A, 2=B, 3=both -> dict: <link_id>: flag
@@ -0,0 +1,61 @@
+"""
+Benchmark of the intersection engines used by the links segmentation: sweep line (SweepIntersector) and spatially
+indexed (IndexedIntersector). Both engines are run on synthetic networks of links between near sites.
+
+Usage (from the repository root): python benchmarks/bench_intersector.py [links_count ...]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lib.sweep_intersector.lib.SweepIntersector import SweepIntersector  # noqa: E402
+from procedures.utils.indexed_intersector import IndexedIntersector  # noqa: E402
+
+
+def network(links_count: int, seed: int = 0) -> list:
+    """Links between near sites (about 2 links per site), without duplicate links."""
+    rng = np.random.default_rng(seed)
+    sites_count = links_count // 2
+    sites = np.round(np.column_stack([12 + rng.random(sites_count) * 7, 48.5 + rng.random(sites_count) * 2.5]), 6)
+
+    segments = {}
+    for _ in range(links_count):
+        i = rng.integers(len(sites))
+        distances = np.hypot(*(sites - sites[i]).T)
+        distances[i] = np.inf
+        j = rng.choice(np.argsort(distances)[:8])
+        segment = ((float(sites[i][0]), float(sites[i][1])), (float(sites[j][0]), float(sites[j][1])))
+        segments.setdefault(frozenset(segment), segment)
+    return list(segments.values())
+
+
+def measure(engine, segments: list, repeats: int = 3) -> tuple[float, dict]:
+    """Best time of 'repeats' runs (in seconds) and the result of the last run."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = engine().findIntersections(segments)
+        best = min(best, time.perf_counter() - start)
+    return best, dict(result)
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [500, 1000, 2000, 5000]
+
+    print(f"{'links':>8} {'intersecting':>13} {'sweep [s]':>10} {'indexed [s]':>12} {'speedup':>8} {'equal':>6}")
+    for count in counts:
+        segments = network(count)
+        sweep_time, sweep_result = measure(SweepIntersector, segments)
+        indexed_time, indexed_result = measure(IndexedIntersector, segments)
+        print(
+            f"{len(segments):>8} {len(sweep_result):>13} {sweep_time:>10.3f} {indexed_time:>12.4f} "
+            f"{sweep_time / indexed_time:>7.1f}x {str(sweep_result == indexed_result):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
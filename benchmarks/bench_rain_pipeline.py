@@ -0,0 +1,151 @@
+"""
+Benchmark of the rain pipeline on the stacked (cml_id, channel_id, time) dataset of all links: rain rates
+(get_rain_rates) and overall rainfall field (generate_rainfields, including links segmentation). Rain rates of the
+stacked dataset are compared with a per-link loop (the same stages called on single-link datasets), which pays the fixed
+cost of every stage (xarray operations, pycomlink calls) for each link, while the stacked pipeline pays it only once.
+Start-up time of a worker process of the parallel executor (new interpreter importing the rain rate stages) is measured
+too, since it is paid by every worker of the process pool.
+
+Usage (from the repository root, requires configuration file config.ini):
+    python benchmarks/bench_rain_pipeline.py [links_count ...]
+"""
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from procedures.calculation_signals import CalcSignals  # noqa: E402
+from procedures.rain.rain_calculation import get_rain_rates  # noqa: E402
+from procedures.rain.rainfields_generation import generate_rainfields  # noqa: E402
+
+# two days of 10 minutes steps
+STEP = 10
+LENGTH = 2 * 24 * 6
+# number of links processed in the per-link loop (time per link is extrapolated)
+LOOP_SAMPLE = 50
+
+CALC_PARAMS = {
+    'step': STEP,
+    'is_cnn_enabled': False,
+    'is_external_filter_enabled': False,
+    'external_filter_params': None,
+    'rolling_values': int(2.5 * 60 / STEP),
+    'wet_dry_deviation': 0.8,
+    'baseline_samples': 5,
+    'interpol_res': 0.01,
+    'idw_power': 1,
+    'idw_near': 35,
+    'idw_dist': 0.4,
+    'output_step': 60,
+    'is_only_overall': True,
+    'is_output_total': False,
+    'waa_schleiss_val': 2.3,
+    'waa_schleiss_tau': 15,
+    'is_temp_compensated': False,
+    'correlation_threshold': 0.7,
+    'is_realtime': False,
+    'is_temp_filtered': False,
+    'is_window_centered': True,
+    'X_MIN': 12.0,
+    'X_MAX': 19.0,
+    'Y_MIN': 48.5,
+    'Y_MAX': 51.1,
+    'segment_size': 900,
+    'is_intersection_enabled': True,
+    'is_central_points_enabled': False,
+}
+
+
+def links_dataset(links_count: int, seed: int = 0) -> xr.Dataset:
+    """Synthetic stacked dataset of links, as returned by the data preprocessing."""
+    rng = np.random.default_rng(seed)
+    shape = (links_count, 2, LENGTH)
+
+    tsl = rng.normal(10, 1, shape)
+    rsl = rng.normal(-50, 1, shape)
+    # rain events: attenuation increasing in random periods
+    rain = np.maximum(rng.normal(0, 1, shape).cumsum(axis=-1) * 0.3 - 2, 0)
+    rsl -= rain
+    rsl[rng.random(shape) < 0.01] = 0
+
+    site_a = np.column_stack([rng.uniform(12.2, 18.8, links_count), rng.uniform(48.7, 50.9, links_count)])
+    site_b = site_a + rng.uniform(-0.08, 0.08, (links_count, 2))
+
+    dims = ("cml_id", "channel_id", "time")
+    return xr.Dataset(
+        data_vars={
+            "tsl": (dims, tsl),
+            "rsl": (dims, rsl),
+            "temperature_rx": (dims, rng.normal(20, 5, shape)),
+            "temperature_tx": (dims, rng.normal(20, 5, shape)),
+        },
+        coords={
+            "time": np.datetime64("2024-06-01") + np.arange(LENGTH) * np.timedelta64(STEP, "m"),
+            "channel_id": ["A(rx)_B(tx)", "B(rx)_A(tx)"],
+            "cml_id": np.arange(1, links_count + 1),
+            "site_a_latitude": ("cml_id", site_a[:, 1]),
+            "site_b_latitude": ("cml_id", site_b[:, 1]),
+            "site_a_longitude": ("cml_id", site_a[:, 0]),
+            "site_b_longitude": ("cml_id", site_b[:, 0]),
+            "frequency": (("cml_id", "channel_id"), rng.uniform(10, 40, (links_count, 2))),
+            "polarization": ("cml_id", rng.choice(["V", "H"], links_count)),
+            "length": ("cml_id", np.hypot(*(site_b - site_a).T) * 80),
+        }
+    )
+
+
+def interpreter_time(code: str, repeats: int = 3) -> float:
+    """Best time (in seconds) of running the code in a new Python interpreter, as in a spawned worker process."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 400, 1600]
+    signals = CalcSignals()
+
+    interpreter = interpreter_time("pass")
+    worker = interpreter_time("import procedures.rain.rain_stages")
+    print(f"worker start-up: {worker:.2f} s (interpreter {interpreter:.2f} s + imports {worker - interpreter:.2f} s)")
+
+    # compilation of numba kernels is not measured
+    get_rain_rates(signals, links_dataset(2), CALC_PARAMS, "bench", 0)
+
+    print(f"{'links':>6} {'per-link loop':>14} {'stacked':>9} {'stacked':>12} {'speedup':>8} {'rainfields':>11}")
+    print(f"{'':>6} {'[ms/link]':>14} {'[s]':>9} {'[ms/link]':>12} {'':>8} {'[s]':>11}")
+    for count in counts:
+        calc_data = links_dataset(count)
+
+        # the same stages called for a sample of single-link datasets
+        sample = min(count, LOOP_SAMPLE)
+        start = time.perf_counter()
+        for index in range(sample):
+            get_rain_rates(signals, calc_data.isel(cml_id=[index]), CALC_PARAMS, "bench", 0)
+        loop_per_link = (time.perf_counter() - start) / sample
+
+        start = time.perf_counter()
+        calc_data = get_rain_rates(signals, calc_data, CALC_PARAMS, "bench", 0)
+        stacked_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        generate_rainfields(signals, calc_data, CALC_PARAMS, [], 0, np.datetime64("NaT"), "bench", 0)
+        rainfields_time = time.perf_counter() - start
+
+        print(
+            f"{count:>6} {loop_per_link * 1000:>14.1f} {stacked_time:>9.3f} {stacked_time / count * 1000:>12.2f} "
+            f"{loop_per_link * count / stacked_time:>7.1f}x {rainfields_time:>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
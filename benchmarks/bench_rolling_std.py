@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of the rolling standard deviation used for wet/dry classification: cumulative sums based
+'rolling_std' vs xarray's 'rolling(time=window).std()', on TRSL-like data of shape (cml_id, channel_id, time).
+
+Usage (from the repository root): python benchmarks/bench_rolling_std.py [cmls_count] [length]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from procedures.utils.rolling_stats import rolling_std  # noqa: E402
+
+
+def measure(function, repeats: int = 3) -> tuple[float, np.ndarray]:
+    """Best time of 'repeats' runs (in seconds) and the result of the last run."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    cmls_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 1440
+
+    rng = np.random.default_rng(0)
+    values = 50 + rng.normal(0, 1, (cmls_count, 2, length))
+    values[rng.random(values.shape) < 0.01] = np.nan
+    trsl = xr.DataArray(values, dims=("cml_id", "channel_id", "time"))
+
+    print(f"TRSL of {cmls_count} CMLs x 2 channels x {length} samples")
+    print(f"{'window':>7} {'center':>7} {'xarray [s]':>11} {'rolling_std [s]':>16} {'speedup':>8} {'max diff':>9}")
+    for window in (5, 10, 30):
+        for center in (False, True):
+            xarray_time, expected = measure(lambda: trsl.rolling(time=window, center=center).std(skipna=False).values)
+            cumsum_time, result = measure(lambda: rolling_std(values, window=window, center=center))
+            print(
+                f"{window:>7} {str(center):>7} {xarray_time:>11.3f} {cumsum_time:>16.3f} "
+                f"{xarray_time / cumsum_time:>7.1f}x {np.nanmax(np.abs(result - expected)):>9.1e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
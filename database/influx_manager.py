@@ -1,14 +1,20 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from enum import Enum
 import math
 from threading import Thread
-from typing import Union
+import time
+from typing import Optional, Union
 
 from influxdb_client import InfluxDBClient, QueryApi, WriteApi
 from influxdb_client.domain.write_precision import WritePrecision
-from PyQt6.QtCore import QRunnable, pyqtSignal, QObject, QDateTime
+import numpy as np
+import pandas as pd
+from PyQt6.QtCore import QRunnable, pyqtSignal, QObject, QDateTime, Qt
 from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
 
+from database.models.units_data import UnitsData
+from database.raw_data_cache import RawDataCache
 from handlers import config_handler
 from handlers.logging_handler import logger
 
@@ -23,6 +29,77 @@ class BucketType(Enum):
     MAPPED = "mapped"
 
 
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def _align_up(dt: datetime, interval_secs: int) -> datetime:
+    """Round naive UTC datetime up to the nearest multiple of the interval (counted from Unix epoch)."""
+    dt_secs = (dt - UNIX_EPOCH).total_seconds()
+    return UNIX_EPOCH + timedelta(seconds=math.ceil(dt_secs / interval_secs) * interval_secs)
+
+
+# InfluxDB tag containing IP address of the unit, for each bucket type
+BUCKET_IP_TAGS: dict[BucketType, str] = {
+    BucketType.DEFAULT: "ip",
+    BucketType.MAPPED: "agent_host",
+}
+
+# raw InfluxDB field name -> default field name, for each bucket type
+BUCKET_FIELDS_MAPS: dict[BucketType, dict[str, str]] = {
+    BucketType.DEFAULT: {
+        "rx_power": "rx_power",
+        "tx_power": "tx_power",
+        "temperature": "temperature",
+    },
+    BucketType.MAPPED: {
+        "PrijimanaUroven": "rx_power",
+        "Signal": "rx_power",
+        "VysilaciVykon": "tx_power",
+        "Vysilany_Vykon": "tx_power",
+        "Teplota": "temperature",
+    },
+}
+
+
+class RealtimeBuffer:
+    """
+    Sliding buffer of raw units data of one realtime calculation. Data of the whole moving time window are queried
+    only once, next iterations query only the newest samples, which are appended to the buffer, while samples older
+    than the window are evicted.
+    """
+    def __init__(self):
+        self.data: Optional[UnitsData] = None
+        self.ips: list[str] = []
+        self.interval: int = 0
+        self.window_secs: int = 0
+        self.overlap_steps: int = int(config_handler.read_option("realtime", "fetch_overlap_steps"))
+
+    def is_usable(self, ips: list[str], interval: int, window_secs: int) -> bool:
+        """Check if buffered data can be extended, i.e. they are not empty and were queried with same parameters."""
+        return (
+            self.data is not None
+            and len(self.data.times) > 0
+            and self.ips == ips
+            and self.interval == interval
+            and self.window_secs == window_secs
+        )
+
+    def reset(self, ips: list[str], interval: int, window_secs: int, data: UnitsData):
+        """Replace buffered data with data of the whole window."""
+        self.data = data
+        self.ips = list(ips)
+        self.interval = interval
+        self.window_secs = window_secs
+
+    def append(self, increment: UnitsData, fetch_after_ns: int, window_start_ns: int):
+        """
+        Append newly queried data to the buffer. Buffered samples newer than 'fetch_after_ns' are replaced by the
+        increment and samples not newer than 'window_start_ns' are evicted.
+        """
+        kept = self.data.select_times(until=fetch_after_ns)
+        self.data = UnitsData.merge([kept, increment]).select_times(after=window_start_ns)
+
+
 class InfluxManager:
     """
     InfluxManager class used for communication with InfluxDB database.
@@ -40,8 +117,9 @@ class InfluxManager:
 
         data_border_format = "%Y-%m-%dT%H:%M:%SZ"
         data_border_string = config_handler.read_option("influx2", "old_new_data_border")
-        bucket_old_type = getattr(BucketType, config_handler.read_option("influx2", "old_data_type"), BucketType.DEFAULT)
-        bucket_new_type = getattr(BucketType, config_handler.read_option("influx2", "new_data_type"), BucketType.DEFAULT)
+        # legacy configs (lowercase 'default' values) keep the historical types: old bucket default, new bucket mapped
+        bucket_old_type = self._read_bucket_type("old_data_type", BucketType.DEFAULT)
+        bucket_new_type = self._read_bucket_type("new_data_type", BucketType.MAPPED)
 
         self.BUCKET_OLD_DATA: str = config_handler.read_option("influx2", "bucket_old_data")
         self.BUCKET_NEW_DATA: str = config_handler.read_option("influx2", "bucket_new_data")
@@ -50,110 +128,355 @@ class InfluxManager:
         self.BUCKET_NEW_TYPE: BucketType = bucket_new_type
         self.OLD_NEW_DATA_BORDER: datetime = datetime.strptime(data_border_string, data_border_format)
 
+        # parallel chunked querying parameters
+        self.QUERY_WORKERS: int = int(config_handler.read_option("influx2", "query_workers"))
+        self.QUERY_SHARD_UNITS: int = int(config_handler.read_option("influx2", "query_shard_units"))
+        self.QUERY_SLICE_HOURS: int = int(config_handler.read_option("influx2", "query_slice_hours"))
+        self.QUERY_RETRIES: int = int(config_handler.read_option("influx2", "query_retries"))
+
+        # persistent on-disk cache of queried raw data
+        self.raw_cache: RawDataCache = RawDataCache()
+
+    @staticmethod
+    def _read_bucket_type(option: str, legacy_type: BucketType) -> BucketType:
+        """
+        Read bucket type from config. Only enum member names ('DEFAULT' or 'MAPPED') select the type, any other value
+        (e.g. legacy 'default', which was never matched before) results in the historical type of the bucket.
+
+        :param option: name of the config option in 'influx2' section
+        :param legacy_type: historical type of the bucket
+        :return: type of the bucket
+        """
+        value = config_handler.read_option("influx2", option)
+        if value not in BucketType.__members__:
+            logger.info(
+                "Value '%s' of InfluxDB option '%s' is not DEFAULT or MAPPED, using historical bucket type %s.",
+                value, option, legacy_type.name
+            )
+            return legacy_type
+        return BucketType[value]
+
     def check_connection(self) -> bool:
         return self.client.ping()
 
-    def _raw_query_old_bucket(self, start_str: str, end_str: str, ips_str: str, interval_str: str) -> dict:
-        # TODO: needs to be refactored to use the same query for both old and new buckets using BucketType enum
-        # construct flux query
-        flux = f"from(bucket: \"{self.BUCKET_OLD_DATA}\")\n" + \
+    def _build_flux_query(
+            self,
+            bucket: str,
+            bucket_type: BucketType,
+            start_str: str,
+            end_str: str,
+            ips: list[str],
+            interval_str: str
+    ) -> str:
+        """
+        Construct single Flux query for all fields of the given units. Units and fields are filtered via 'contains()'
+        set membership and aggregated values are pivoted by Influx, so each unit comes back as one table with one row
+        per timestamp and one column per (raw) field.
+
+        :param bucket: name of the bucket to be queried
+        :param bucket_type: type of the bucket, defines IP tag and raw field names
+        :param start_str: start of the query interval (RFC 3339)
+        :param end_str: end of the query interval (RFC 3339)
+        :param ips: list of IP addresses of units to query
+        :param interval_str: aggregation window (Flux duration)
+        :return: Flux query string
+        """
+        ip_tag = BUCKET_IP_TAGS[bucket_type]
+        ips_set = ", ".join(f"\"{ip}\"" for ip in ips)
+        fields_set = ", ".join(f"\"{field}\"" for field in BUCKET_FIELDS_MAPS[bucket_type])
+
+        flux = f"ips = [{ips_set}]\n" + \
+               f"fields = [{fields_set}]\n\n" + \
+               f"from(bucket: \"{bucket}\")\n" + \
                f"  |> range(start: {start_str}, stop: {end_str})\n" + \
-               f"  |> filter(fn: (r) => r[\"_field\"] == \"rx_power\" or r[\"_field\"] == \"tx_power\" or" \
-               f" r[\"_field\"] == \"temperature\")\n" + \
-               f"  |> filter(fn: (r) => r[\"ip\"] =~ /{ips_str}/)\n" + \
+               "  |> filter(fn: (r) => contains(value: r[\"_field\"], set: fields))\n" + \
+               f"  |> filter(fn: (r) => contains(value: r[\"{ip_tag}\"], set: ips))\n" + \
                f"  |> aggregateWindow(every: {interval_str}, fn: mean, createEmpty: true)\n" + \
-               f"  |> yield(name: \"mean\")"
-
-        # query influxDB
-        results = self.qapi.query(flux)
-
-        data = {}
-        for table in results:
-            ip = table.records[0].values.get("ip")
-
-            # initialize new IP record in the result dictionary
-            if ip not in data:
-                data[ip] = {}
-                data[ip]["unit"] = table.records[0].get_measurement()
-
-            # collect data from the current table
-            for record in table.records:
-                if ip in data:
-                    if record.get_field() not in data[ip]:
-                        data[ip][record.get_field()] = {}
-
-                    # correct bad Tx Power and Temperature data in InfluxDB in case of missing zero values
-                    if (record.get_field() == "tx_power") and (record.get_value() is None):
-                        data[ip]["tx_power"][record.get_time()] = 0.0
-                    elif (record.get_field() == "temperature") and (record.get_value() is None):
-                        data[ip]["temperature"][record.get_time()] = 0.0
-                    elif (record.get_field() == "rx_power") and (record.get_value() is None):
-                        data[ip]["rx_power"][record.get_time()] = 0.0
-                    else:
-                        data[ip][record.get_field()][record.get_time()] = record.get_value()
+               f"  |> keep(columns: [\"_time\", \"_measurement\", \"_field\", \"_value\", \"{ip_tag}\"])\n" + \
+               "  |> pivot(rowKey: [\"_time\"], columnKey: [\"_field\"], valueColumn: \"_value\")\n" + \
+               "  |> yield(name: \"mean\")"
+
+        return flux
+
+    @staticmethod
+    def _frames_to_units_data(
+            frames: Union[pd.DataFrame, list[pd.DataFrame]],
+            ip_tag: str,
+            fields_map: dict[str, str]
+    ) -> UnitsData:
+        """
+        Convert pivoted result of 'query_data_frame' into columnar UnitsData with a shared time axis.
+        Result consists of one or more dataframes (one per table schema) with '_time', '_measurement' and IP tag
+        columns, plus one column per queried raw field present in the tables of the dataframe.
+
+        :param frames: dataframe or list of dataframes returned by InfluxDB query API
+        :param ip_tag: name of the tag column containing IP address of the unit
+        :param fields_map: mapping of raw field names to default field names
+        :return: UnitsData with queried data
+        """
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        frames = [frame for frame in frames if not frame.empty]
+
+        if len(frames) == 0:
+            return UnitsData(np.empty((0,), dtype=np.int64), [])
+
+        # shared time axis in ns since Unix epoch (UTC) and unit rows over all dataframes
+        frames_times = [
+            pd.to_datetime(frame["_time"], utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+            .view(np.int64) for frame in frames
+        ]
+        times = np.unique(np.concatenate(frames_times))
+        ip_rows, ips = pd.factorize(pd.concat([frame[ip_tag] for frame in frames], ignore_index=True))
+
+        data = UnitsData(times, ips.tolist())
+
+        offset = 0
+        for frame, frame_times in zip(frames, frames_times):
+            rows = ip_rows[offset:offset + len(frame)]
+            cols = np.searchsorted(times, frame_times)
+            offset += len(frame)
+
+            first_rows = frame.drop_duplicates(subset=ip_tag)
+            data.measurements.update(zip(first_rows[ip_tag], first_rows["_measurement"]))
+
+            # merge raw fields mapped to the same default field (first non-missing value is used)
+            fields: dict[str, np.ndarray] = {}
+            for raw_field, field in fields_map.items():
+                if raw_field not in frame.columns:
+                    continue
+                values = pd.to_numeric(frame[raw_field], errors="coerce").to_numpy(dtype=np.float64)
+                if field in fields:
+                    values = np.where(np.isnan(fields[field]), values, fields[field])
+                fields[field] = values
+
+            # correct bad Rx Power, Tx Power and Temperature data in InfluxDB in case of missing zero values
+            # => missing values are replaced with zeros inside UnitsData
+            for field, values in fields.items():
+                data.set_values(field, rows, cols, values)
 
         return data
 
-    def _raw_query_new_bucket(self, start_str: str, end_str: str, ips_str: str, interval_str: str) -> dict:
-        # TODO: needs to be refactored to use the same query for both old and new buckets using BucketType enum
-        # construct flux query
-        slux = f"from(bucket: \"{self.BUCKET_NEW_DATA}\")\n" + \
-               f"  |> range(start: {start_str}, stop: {end_str})\n" + \
-               f"  |> filter(fn: (r) => r[\"_field\"] == \"PrijimanaUroven\" or r[\"_field\"] == \"Signal\")\n" + \
-               f"  |> filter(fn: (r) => r[\"agent_host\"] =~ /{ips_str}/)\n" + \
-               f"  |> aggregateWindow(every: {interval_str}, fn: mean, createEmpty: true)\n" + \
-               f"  |> yield(name: \"mean\")"
+    def _raw_query_bucket(
+            self,
+            bucket: str,
+            bucket_type: BucketType,
+            start_str: str,
+            end_str: str,
+            ips: list[str],
+            interval_str: str
+    ) -> UnitsData:
+        flux = self._build_flux_query(bucket, bucket_type, start_str, end_str, ips, interval_str)
 
-        flux = f"from(bucket: \"{self.BUCKET_NEW_DATA}\")\n" + \
-               f"  |> range(start: {start_str}, stop: {end_str})\n" + \
-               f"  |> filter(fn: (r) => r[\"_field\"] == \"Teplota\" or" \
-               f" r[\"_field\"] == \"VysilaciVykon\" or r[\"_field\"] == \"Vysilany_Vykon\")\n" + \
-               f"  |> filter(fn: (r) => r[\"agent_host\"] =~ /{ips_str}/)\n" + \
-               f"  |> aggregateWindow(every: {interval_str}, fn: mean, createEmpty: true)\n" + \
-               f"  |> yield(name: \"mean\")"
+        # query influxDB, results are parsed in columnar way (no Python objects per record)
+        results = self.qapi.query_data_frame(flux)
 
-        # query influxDB
-        results_slux = self.qapi.query(slux)
-        results_flux = self.qapi.query(flux)
+        return self._frames_to_units_data(results, BUCKET_IP_TAGS[bucket_type], BUCKET_FIELDS_MAPS[bucket_type])
 
-        data = {}
+    def _split_time_window(self, start: datetime, end: datetime, interval: int) -> list[tuple[datetime, datetime]]:
+        """
+        Split [start, end) time window into slices of approx. 'query_slice_hours' length. Inner slice boundaries are
+        aligned to multiples of the interval, since aggregation windows in InfluxDB are aligned to Unix epoch, so the
+        slices produce continuous time axis without duplicate or truncated aggregation windows.
 
-        # map raw fields to the result dictionary
-        rename_map = {
-            "Teplota": "temperature",
-            "PrijimanaUroven": "rx_power",
-            "VysilaciVykon": "tx_power",
-            "Vysilany_Vykon": "tx_power",
-            "Signal": "rx_power"
-        }
+        :param start: start of the time window
+        :param end: end of the time window
+        :param interval: time interval in minutes
+        :return: list of (slice start, slice end) tuples
+        """
+        if self.QUERY_SLICE_HOURS <= 0:
+            return [(start, end)]
 
-        for results in (results_slux, results_flux):
-            for table in results:
-                ip = table.records[0].values.get("agent_host")
-
-                # initialize new IP record in the result dictionary
-                if ip not in data:
-                    data[ip] = {}
-                    data[ip]["unit"] = table.records[0].get_measurement()
-
-                # collect data from the current table
-                for record in table.records:
-                    if ip in data:
-                        field_name = rename_map.get(record.get_field(), record.get_field())
-                        if field_name not in data[ip]:
-                            data[ip][field_name] = {}
-
-                        # correct bad Tx Power and Temperature data in InfluxDB in case of missing zero values
-                        if (field_name == "tx_power") and (record.get_value() is None):
-                            data[ip]["tx_power"][record.get_time()] = 0.0
-                        elif (field_name == "temperature") and (record.get_value() is None):
-                            data[ip]["temperature"][record.get_time()] = 0.0
-                        elif (field_name == "rx_power") and (record.get_value() is None):
-                            data[ip]["rx_power"][record.get_time()] = 0.0
-                        else:
-                            data[ip][field_name][record.get_time()] = record.get_value()
+        interval_secs = interval * 60
+        slice_secs = max((self.QUERY_SLICE_HOURS * 3600) // interval_secs, 1) * interval_secs
 
-        return data
+        slices = []
+        slice_start = start
+        while True:
+            slice_end = _align_up(slice_start + timedelta(seconds=slice_secs), interval_secs)
+            if slice_end >= end:
+                slices.append((slice_start, end))
+                return slices
+            slices.append((slice_start, slice_end))
+            slice_start = slice_end
+
+    def _query_shard(
+            self,
+            bucket: str,
+            bucket_type: BucketType,
+            ips: list[str],
+            start: datetime,
+            end: datetime,
+            interval_str: str,
+            shard_number: int,
+            shards_count: int
+    ) -> UnitsData:
+        """
+        Query one shard (subset of units and time slice) of the whole query. Failed queries are repeated up to
+        'query_retries' attempts.
+        """
+        start_str = start.strftime("%Y-%m-%dT%H:%M:00.000Z")  # RFC 3339
+        end_str = end.strftime("%Y-%m-%dT%H:%M:00.000Z")  # RFC 3339
+
+        attempt = 0
+        while True:
+            attempt += 1
+            query_start = time.perf_counter()
+            try:
+                data = self._raw_query_bucket(bucket, bucket_type, start_str, end_str, ips, interval_str)
+                logger.debug(
+                    "[QUERY: InfluxDB] Shard %d/%d (%d units, %s - %s) done in %.2f s (attempt %d).",
+                    shard_number, shards_count, len(ips), start_str, end_str, time.perf_counter() - query_start,
+                    attempt
+                )
+                return data
+            except Exception as error:
+                if attempt >= self.QUERY_RETRIES:
+                    logger.error(
+                        "[QUERY: InfluxDB] Shard %d/%d (%d units, %s - %s) failed after %d attempts. Error: %s",
+                        shard_number, shards_count, len(ips), start_str, end_str, attempt, error
+                    )
+                    raise
+                logger.warning(
+                    "[QUERY: InfluxDB] Shard %d/%d (%d units, %s - %s) failed in %.2f s (attempt %d/%d): %s. "
+                    "Retrying...",
+                    shard_number, shards_count, len(ips), start_str, end_str, time.perf_counter() - query_start,
+                    attempt, self.QUERY_RETRIES, error
+                )
+
+    def _query_windows(
+            self,
+            windows: list[tuple[str, BucketType, datetime, datetime, list[str]]],
+            interval: int
+    ) -> list[UnitsData]:
+        """
+        Query the buckets in shards: the units are split into groups of 'query_shard_units' and each time window into
+        slices of 'query_slice_hours'. Shards of all windows are queried concurrently on a bounded thread pool and
+        their results are merged per window in deterministic (submission) order.
+
+        :param windows: list of (bucket name, bucket type, start, end, IPs of units) tuples of time windows to be
+                        queried (UTC)
+        :param interval: time interval in minutes
+        :return: list of UnitsData with merged data of each window
+        """
+        interval_str = f"{interval * 60}s"  # time in seconds
+
+        shards = []
+        windows_shards_counts = []
+        for bucket, bucket_type, start, end, ips in windows:
+            if self.QUERY_SHARD_UNITS > 0:
+                ips_shards = [ips[i:i + self.QUERY_SHARD_UNITS] for i in range(0, len(ips), self.QUERY_SHARD_UNITS)]
+            else:
+                ips_shards = [ips]
+
+            window_shards = [
+                (bucket, bucket_type, ips_shard, slice_start, slice_end)
+                for ips_shard in ips_shards
+                for slice_start, slice_end in self._split_time_window(start, end, interval)
+            ]
+            shards.extend(window_shards)
+            windows_shards_counts.append(len(window_shards))
+
+        if len(shards) == 1:
+            parts = [self._query_shard(*shards[0], interval_str, 1, 1)]
+        else:
+            logger.debug(
+                "[QUERY: InfluxDB] Querying %d time windows in %d shards using %d workers...",
+                len(windows), len(shards), self.QUERY_WORKERS
+            )
+
+            with ThreadPoolExecutor(max_workers=self.QUERY_WORKERS) as executor:
+                futures = [
+                    executor.submit(self._query_shard, *shard, interval_str, number, len(shards))
+                    for number, shard in enumerate(shards, start=1)
+                ]
+                try:
+                    parts = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        results = []
+        offset = 0
+        for shards_count in windows_shards_counts:
+            results.append(UnitsData.merge(parts[offset:offset + shards_count]))
+            offset += shards_count
+
+        return results
+
+    def _query_chunked(
+            self,
+            windows: list[tuple[str, BucketType, datetime, datetime]],
+            ips: list[str],
+            interval: int
+    ) -> UnitsData:
+        """
+        Query the buckets in shards (see '_query_windows') and merge the results into one UnitsData.
+
+        :param windows: list of (bucket name, bucket type, start, end) tuples of time windows to be queried (UTC)
+        :param ips: list of IP addresses of units to query
+        :param interval: time interval in minutes
+        :return: UnitsData with merged data of all shards
+        """
+        return UnitsData.merge(
+            self._query_windows([(bucket, bucket_type, start, end, ips) for bucket, bucket_type, start, end in windows],
+                                interval)
+        )
+
+    def _query_cached(
+            self,
+            windows: list[tuple[str, BucketType, datetime, datetime]],
+            ips: list[str],
+            interval: int
+    ) -> UnitsData:
+        """
+        Query the buckets using the raw data cache: whole cacheable chunks of the time windows are loaded from the
+        cache, only units missing in the cache are queried and the results are stored into the cache. Remaining parts
+        of the windows (unaligned edges and the newest data) are always queried.
+
+        :param windows: list of (bucket name, bucket type, start, end) tuples of time windows to be queried (UTC)
+        :param ips: list of IP addresses of units to query
+        :param interval: time interval in minutes
+        :return: UnitsData with merged data of cached and queried parts
+        """
+        parts = []
+        queries = []
+        # chunk start of each query, None = query is not cacheable
+        queries_chunks = []
+        hits, misses = 0, 0
+
+        for bucket, bucket_type, start, end in windows:
+            uncached, chunks = self.raw_cache.split_window(start, end, interval)
+
+            for part_start, part_end in uncached:
+                queries.append((bucket, bucket_type, part_start, part_end, ips))
+                queries_chunks.append(None)
+
+            for chunk_start, chunk_end in chunks:
+                cached, missing = self.raw_cache.load_chunk(bucket, bucket_type.value, ips, interval, chunk_start)
+                if cached is not None:
+                    parts.append(cached)
+                hits += len(ips) - len(missing)
+                misses += len(missing)
+
+                if len(missing) > 0:
+                    queries.append((bucket, bucket_type, chunk_start, chunk_end, missing))
+                    queries_chunks.append(chunk_start)
+
+        logger.debug(
+            "[CACHE: raw data] %d cache hits, %d cache misses (unit chunks), %d time windows to query.",
+            hits, misses, len(queries)
+        )
+
+        if len(queries) > 0:
+            results = self._query_windows(queries, interval)
+            for (bucket, bucket_type, _, _, query_ips), chunk_start, result in zip(queries, queries_chunks, results):
+                if chunk_start is not None:
+                    self.raw_cache.store_chunk(bucket, bucket_type.value, query_ips, interval, chunk_start, result)
+            parts.extend(results)
+
+        return UnitsData.merge(parts)
 
     def query_units(
             self,
@@ -161,49 +484,63 @@ class InfluxManager:
             start: QDateTime,
             end: QDateTime,
             interval: int
-    ) -> dict[str, Union[dict[str, dict[datetime, float]], str]]:
+    ) -> UnitsData:
         """
         Query InfluxDB for CMLs defined in 'ips' as list of their IP addresses (as identifiers = tags in InfluxDB).
         Query is done for the time interval defined by 'start' and 'end' QDateTime objects, with 'interval' in seconds.
+        If the time interval crosses the old/new data border, both buckets are queried and stitched together.
 
         :param ips: list of IP addresses of CMLs to query
         :param start: QDateTime object with start of the query interval
         :param end: QDateTime object with end of the query interval
         :param interval: time interval in minutes
-        :return: dictionary with queried data, with IP addresses as keys and fields with time series as values
+        :return: UnitsData with queried data of units, fields' time series are aligned to one shared time axis
         """
         # modify boundary times to be multiples of input time interval
         start.addSecs(((math.ceil((start.time().minute() + 0.1) / interval) * interval) - start.time().minute()) * 60)
         end.addSecs((-1 * (end.time().minute() % interval)) * 60)
 
-        # convert params to query substrings
-        start_str = start.toString("yyyy-MM-ddTHH:mm:00.000Z")  # RFC 3339
-        end_str = end.toString("yyyy-MM-ddTHH:mm:00.000Z")  # RFC 3339
-        interval_str = f"{interval * 60}s"  # time in seconds
-
-        ips_str = f"{ips[0]}"  # IP addresses in query format
-        for ip in ips[1:]:
-            ips_str += f"|{ip}"
+        # query times are handled as UTC times with minute precision (RFC 3339 query format)
+        start_dt = start.toPyDateTime().replace(second=0, microsecond=0)
+        end_dt = end.toPyDateTime().replace(second=0, microsecond=0)
 
-        if end.toPyDateTime() < self.OLD_NEW_DATA_BORDER:
-            return self._raw_query_old_bucket(start_str, end_str, ips_str, interval_str)
+        if end_dt < self.OLD_NEW_DATA_BORDER:
+            windows = [(self.BUCKET_OLD_DATA, self.BUCKET_OLD_TYPE, start_dt, end_dt)]
+        elif start_dt >= self.OLD_NEW_DATA_BORDER:
+            windows = [(self.BUCKET_NEW_DATA, self.BUCKET_NEW_TYPE, start_dt, end_dt)]
         else:
-            return self._raw_query_new_bucket(start_str, end_str, ips_str, interval_str)
+            # window straddles the border => split it into old and new bucket parts, border is aligned to the interval
+            # to keep the stitched time axis continuous
+            border_dt = _align_up(self.OLD_NEW_DATA_BORDER, interval * 60)
+            windows = [(self.BUCKET_OLD_DATA, self.BUCKET_OLD_TYPE, start_dt, min(border_dt, end_dt))]
+            if border_dt < end_dt:
+                windows.append((self.BUCKET_NEW_DATA, self.BUCKET_NEW_TYPE, border_dt, end_dt))
+            logger.debug(
+                "[QUERY: InfluxDB] Time window crosses the old/new data border, querying both buckets (border: %s).",
+                border_dt
+            )
+
+        if self.raw_cache.is_enabled:
+            return self._query_cached(windows, ips, interval)
+        return self._query_chunked(windows, ips, interval)
 
     def query_units_realtime(
             self,
             ips: list,
             realtime_window_str: str,
-            interval: int
-    ) -> dict[str, Union[dict[str, dict[datetime, float]], str]]:
+            interval: int,
+            buffer: Optional["RealtimeBuffer"] = None
+    ) -> UnitsData:
         """
         Query InfluxDB for CMLs defined in 'ips' as list of their IP addresses (as identifiers = tags in InfluxDB).
         Query is done for the time interval defined by 'combo_realtime' QComboBox object.
+        If 'buffer' is given, only samples newer than the buffered ones are queried and appended to the buffer.
 
         :param ips: list of IP addresses of CMLs to query
         :param realtime_window_str: A string describing selected moving time window
         :param interval: time interval in minutes
-        :return: dictionary with queried data, with IP addresses as keys and fields with time series as values
+        :param buffer: optional RealtimeBuffer of the calculation, holding the data from its previous runs
+        :return: UnitsData with queried data of units, fields' time series are aligned to one shared time axis
         """
         delta_map = {
             "Past 1 h": 1 * 3600,
@@ -215,11 +552,37 @@ class InfluxManager:
             "Past 7 d": 168 * 3600,
             "Past 30 d": 720 * 3600
         }
+        window_secs = delta_map.get(realtime_window_str)
 
         end = QDateTime.currentDateTimeUtc()
-        start = end.addSecs(-1 * delta_map.get(realtime_window_str))
+        start = end.addSecs(-1 * window_secs)
+
+        if buffer is None:
+            return self.query_units(ips, start, end, interval)
 
-        return self.query_units(ips, start, end, interval)
+        # times are handled in ns since Unix epoch, query times have minute precision
+        end_ns = (end.toSecsSinceEpoch() // 60) * 60 * 10 ** 9
+        window_start_ns = end_ns - window_secs * 10 ** 9
+
+        if not buffer.is_usable(ips, interval, window_secs):
+            # first run (or changed parameters) => query whole window
+            buffer.reset(ips, interval, window_secs, self.query_units(ips, start, end, interval))
+            logger.debug("[QUERY: InfluxDB] Realtime buffer filled with %d samples.", len(buffer.data.times))
+        else:
+            # next runs => query only new samples, with overlap of last few steps (values of last aggregation
+            # windows might have been incomplete during the last query)
+            interval_ns = interval * 60 * 10 ** 9
+            fetch_after_ns = (buffer.data.times[-1] // interval_ns - buffer.overlap_steps) * interval_ns
+            fetch_start = QDateTime.fromSecsSinceEpoch(int(fetch_after_ns // 10 ** 9), Qt.TimeSpec.UTC)
+
+            increment = self.query_units(ips, fetch_start, end, interval)
+            buffer.append(increment, fetch_after_ns, window_start_ns)
+            logger.debug(
+                "[QUERY: InfluxDB] Realtime buffer updated with %d samples, holding %d samples.",
+                len(increment.times), len(buffer.data.times)
+            )
+
+        return buffer.data
 
     def write_points(self, points, bucket):
         try:
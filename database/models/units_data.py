@@ -0,0 +1,115 @@
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+class UnitsData:
+    """
+    Columnar container of raw CML units data queried from InfluxDB.
+
+    All timeseries share one time axis 'times' (int64 nanoseconds since Unix epoch, UTC). Values of each field are
+    stored in a single 2D float64 array of shape (units, times), its rows are indexed by units' IP addresses.
+    Since some units are missing some fields (e.g. Tx power or temperature), field presence is tracked per unit.
+
+    For lookups, the container behaves like a read-only dictionary: 'ip in data', 'len(data)' and 'data[ip]', which
+    returns dictionary of present fields of the unit (field name -> 1D array of values aligned with 'times').
+    """
+    def __init__(self, times: np.ndarray, ips: list[str]):
+        self.times: np.ndarray = np.asarray(times, dtype=np.int64)
+        self.ips: list[str] = list(ips)
+        self.ip_index: dict[str, int] = {ip: row for row, ip in enumerate(self.ips)}
+
+        # field name -> 2D array (units, times) of values
+        self.values: dict[str, np.ndarray] = {}
+        # field name -> 1D bool array (units) of field presence
+        self.present: dict[str, np.ndarray] = {}
+        # IP address -> InfluxDB measurement of the unit
+        self.measurements: dict[str, str] = {}
+
+    @property
+    def time_axis(self) -> np.ndarray:
+        """Shared time axis as numpy datetime64[ns] array."""
+        return self.times.view("datetime64[ns]")
+
+    def set_values(self, field: str, rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        """
+        Scatter values of given field into its 2D array. Missing values (NaN) are stored as zeros.
+
+        :param field: field name
+        :param rows: unit (row) index of each value
+        :param cols: time (column) index of each value
+        :param values: values to be stored
+        """
+        if field not in self.values:
+            self.values[field] = np.zeros((len(self.ips), len(self.times)), dtype=np.float64)
+            self.present[field] = np.zeros((len(self.ips),), dtype=bool)
+
+        self.values[field][rows, cols] = np.nan_to_num(values, nan=0.0)
+        self.present[field][rows] = True
+
+    def select_times(self, after: Optional[int] = None, until: Optional[int] = None) -> "UnitsData":
+        """
+        Select part of the data with times in interval (after, until].
+
+        :param after: exclusive lower bound in ns since Unix epoch, None = unbounded
+        :param until: inclusive upper bound in ns since Unix epoch, None = unbounded
+        :return: new UnitsData with selected times (arrays are copied)
+        """
+        mask = np.ones(self.times.shape, dtype=bool)
+        if after is not None:
+            mask &= self.times > after
+        if until is not None:
+            mask &= self.times <= until
+
+        selected = UnitsData(self.times[mask], self.ips)
+        selected.measurements = dict(self.measurements)
+        for field, values in self.values.items():
+            selected.values[field] = values[:, mask]
+            selected.present[field] = self.present[field].copy()
+
+        return selected
+
+    def __len__(self) -> int:
+        return len(self.ips)
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self.ip_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ips)
+
+    def __getitem__(self, ip: str) -> dict[str, np.ndarray]:
+        row = self.ip_index[ip]
+        return {field: values[row] for field, values in self.values.items() if self.present[field][row]}
+
+    @staticmethod
+    def merge(parts: list["UnitsData"]) -> "UnitsData":
+        """
+        Merge several UnitsData (e.g. results of partial queries split by units or by time) into one UnitsData with
+        union of their units and time axes. In case of overlapping values, the later part takes precedence.
+
+        :param parts: list of UnitsData to be merged
+        :return: merged UnitsData
+        """
+        if len(parts) == 1:
+            return parts[0]
+
+        times = np.unique(np.concatenate([part.times for part in parts] + [np.empty((0,), dtype=np.int64)]))
+        ips = list(dict.fromkeys(ip for part in parts for ip in part.ips))
+
+        merged = UnitsData(times, ips)
+        for part in parts:
+            rows = np.array([merged.ip_index[ip] for ip in part.ips], dtype=np.intp)
+            cols = np.searchsorted(times, part.times)
+            merged.measurements.update(part.measurements)
+
+            for field, values in part.values.items():
+                present = part.present[field]
+                if field not in merged.values:
+                    merged.values[field] = np.zeros((len(ips), len(times)), dtype=np.float64)
+                    merged.present[field] = np.zeros((len(ips),), dtype=bool)
+
+                merged.values[field][np.ix_(rows[present], cols)] = values[present]
+                merged.present[field][rows[present]] = True
+
+        return merged
@@ -0,0 +1,267 @@
+"""Module containing persistent on-disk cache of raw CML units data queried from InfluxDB."""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import hashlib
+import os
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from database.models.units_data import UnitsData
+from handlers import config_handler
+from handlers.logging_handler import logger
+
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+class RawDataCache:
+    """
+    Content-addressed cache of aggregated raw units data. Data are cached in time chunks of 'chunk_hours' length, one
+    entry per (bucket, bucket type, step, chunk start) holding all cached units of the chunk. Each entry is stored in
+    columnar form as a single '.npz' file with the shared time axis, IP addresses and measurements of the units and one
+    2D array (units, times) of values and 1D array of presence per field, so whole chunk is loaded at once. Units
+    without any data in the chunk are cached too (as units without present fields), so they are not queried again.
+    Units queried later for the same chunk are merged into its entry.
+
+    Only whole chunks older than 'min_age_hours' are cached, since the newest data can still be completed in InfluxDB.
+    Total size of the cache is bounded by 'max_size_mb', least recently used entries are evicted first.
+    """
+    def __init__(self):
+        self.is_enabled: bool = config_handler.read_option("raw_cache", "enabled") == "True"
+        self.directory: str = config_handler.read_option("directories", "raw_cache")
+        self.max_size: int = int(config_handler.read_option("raw_cache", "max_size_mb")) * 1024 * 1024
+        self.chunk_secs: int = int(config_handler.read_option("raw_cache", "chunk_hours")) * 3600
+        self.min_age: timedelta = timedelta(hours=int(config_handler.read_option("raw_cache", "min_age_hours")))
+
+        # path of the entry -> size of the entry, ordered from the least recently used
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.size: int = 0
+        self.is_index_loaded: bool = False
+        self.lock = Lock()
+
+    def _load_index(self):
+        """
+        Build LRU index from cache directory, entries are ordered by their last access (modification) time.
+        Index is built lazily on the first cache access.
+        """
+        if self.is_index_loaded:
+            return
+        self.is_index_loaded = True
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        entries = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self.index[path] = size
+            self.size += size
+
+        logger.debug(
+            "[CACHE: raw data] Loaded %d cached entries, total size %.1f MB.", len(self.index), self.size / 1024 ** 2
+        )
+
+    def _entry_path(self, bucket: str, bucket_type: str, interval: int, chunk_start: datetime) -> str:
+        key = f"{bucket}|{bucket_type}|{interval}|{chunk_start.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.npz")
+
+    @staticmethod
+    def _read_entry(path: str) -> UnitsData:
+        """Read all cached units of the chunk entry, including units without data."""
+        with np.load(path) as npz:
+            entry = UnitsData(npz["times"], npz["ips"].tolist())
+            entry.measurements = dict(zip(entry.ips, npz["measurements"].tolist()))
+            for name in npz.files:
+                if name.startswith("values_"):
+                    field = name[7:]
+                    entry.values[field] = npz[name]
+                    entry.present[field] = npz[f"present_{field}"]
+        return entry
+
+    @staticmethod
+    def _write_entry(path: str, entry: UnitsData):
+        """Write all units of the chunk entry atomically (temp file + rename)."""
+        arrays = {
+            "times": entry.times,
+            "ips": np.array(entry.ips, dtype=str),
+            "measurements": np.array([entry.measurements.get(ip, "") for ip in entry.ips], dtype=str),
+        }
+        for field, values in entry.values.items():
+            arrays[f"values_{field}"] = values
+            arrays[f"present_{field}"] = entry.present[field]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, path)
+
+    def split_window(
+            self,
+            start: datetime,
+            end: datetime,
+            interval: int
+    ) -> (list[tuple[datetime, datetime]], list[tuple[datetime, datetime]]):
+        """
+        Split [start, end) time window into cacheable whole chunks and remaining uncacheable parts.
+
+        :param start: start of the time window (UTC)
+        :param end: end of the time window (UTC)
+        :param interval: time interval in minutes
+        :return: tuple of lists of (start, end) tuples: (uncacheable parts, cacheable chunks)
+        """
+        # chunk borders have to be aligned with aggregation windows
+        if self.chunk_secs % (interval * 60) != 0:
+            return [(start, end)], []
+
+        # newest data can still be incomplete, so they are not cached
+        cacheable_end = min(end, datetime.now(timezone.utc).replace(tzinfo=None) - self.min_age)
+
+        start_secs = (start - UNIX_EPOCH).total_seconds()
+        end_secs = (cacheable_end - UNIX_EPOCH).total_seconds()
+        first = UNIX_EPOCH + timedelta(seconds=-(-start_secs // self.chunk_secs) * self.chunk_secs)
+        last = UNIX_EPOCH + timedelta(seconds=(end_secs // self.chunk_secs) * self.chunk_secs)
+
+        if first >= last:
+            return [(start, end)], []
+
+        chunk = timedelta(seconds=self.chunk_secs)
+        chunks = [(first + chunk * i, first + chunk * (i + 1)) for i in range(int((last - first) / chunk))]
+
+        uncached = []
+        if start < first:
+            uncached.append((start, first))
+        if last < end:
+            uncached.append((last, end))
+
+        return uncached, chunks
+
+    def load_chunk(
+            self,
+            bucket: str,
+            bucket_type: str,
+            ips: list[str],
+            interval: int,
+            chunk_start: datetime
+    ) -> (Optional[UnitsData], list[str]):
+        """
+        Load cached data of units in given chunk.
+
+        :return: tuple of UnitsData with cached units (None if there are no cached units with data) and list of IPs
+                 of units, which are not cached
+        """
+        self._load_index()
+
+        path = self._entry_path(bucket, bucket_type, interval, chunk_start)
+        with self.lock:
+            is_cached = path in self.index
+            if is_cached:
+                self.index.move_to_end(path)
+        if not is_cached:
+            return None, list(ips)
+
+        try:
+            entry = self._read_entry(path)
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning("[CACHE: raw data] Cannot read cache entry %s, querying again: %s", path, error)
+            self._remove(path)
+            return None, list(ips)
+
+        missing = [ip for ip in ips if ip not in entry]
+
+        # units without any data are cached, but they are not included in the result
+        has_data = np.zeros((len(entry),), dtype=bool)
+        for present in entry.present.values():
+            has_data |= present
+        selected = [ip for ip in ips if ip in entry and has_data[entry.ip_index[ip]]]
+        if len(selected) == 0:
+            return None, missing
+
+        rows = np.array([entry.ip_index[ip] for ip in selected], dtype=np.intp)
+        data = UnitsData(entry.times, selected)
+        data.measurements = {ip: entry.measurements[ip] for ip in selected}
+        for field, values in entry.values.items():
+            present = entry.present[field][rows]
+            if present.any():
+                data.values[field] = values[rows]
+                data.present[field] = present
+
+        return data, missing
+
+    def store_chunk(
+            self,
+            bucket: str,
+            bucket_type: str,
+            ips: list[str],
+            interval: int,
+            chunk_start: datetime,
+            data: UnitsData
+    ):
+        """
+        Store queried data of units in given chunk, units are merged into the chunk's entry. Units without data are
+        stored as units without present fields.
+        """
+        self._load_index()
+
+        path = self._entry_path(bucket, bucket_type, interval, chunk_start)
+        with self.lock:
+            is_cached = path in self.index
+
+        # units cached before are kept, newly queried units take precedence
+        parts = []
+        if is_cached:
+            try:
+                parts.append(self._read_entry(path))
+            except (OSError, ValueError, KeyError) as error:
+                logger.warning("[CACHE: raw data] Cannot read cache entry %s, replacing it: %s", path, error)
+        parts.append(UnitsData(data.times, ips))
+        parts.append(data)
+
+        try:
+            self._write_entry(path, UnitsData.merge(parts))
+            size = os.path.getsize(path)
+        except OSError as error:
+            logger.warning("[CACHE: raw data] Cannot store cache entry %s: %s", path, error)
+            return
+
+        with self.lock:
+            self.size += size - self.index.pop(path, 0)
+            self.index[path] = size
+
+        self._evict()
+
+    def _remove(self, path: str):
+        with self.lock:
+            self.size -= self.index.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Evict least recently used entries until the cache fits into its size limit."""
+        evicted = 0
+        while True:
+            with self.lock:
+                if self.size <= self.max_size or len(self.index) == 0:
+                    break
+                path, size = self.index.popitem(last=False)
+                self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            evicted += 1
+
+        if evicted > 0:
+            logger.debug("[CACHE: raw data] Evicted %d least recently used entries.", evicted)
@@ -1,12 +1,13 @@
 import datetime
-from typing import Union
+from typing import Optional
 
 import numpy as np
 import xarray as xr
 from PyQt6.QtCore import QRunnable
 
-from database.influx_manager import InfluxManager
+from database.influx_manager import InfluxManager, RealtimeBuffer
 from database.models.mwlink import MwLink
+from database.models.units_data import UnitsData
 from handlers.logging_handler import logger
 from procedures.calculation_signals import CalcSignals
 from procedures.exceptions import ProcessingException, RaincalcException, RainfieldsGenException
@@ -42,6 +43,9 @@ class Calculation(QRunnable):
         self.rain_grids: list[np.ndarray] = []
         self.last_time: np.datetime64 = np.datetime64(datetime.datetime.min)
 
+        # buffer raw data for possible next iteration (in realtime, only the newest samples are queried)
+        self.realtime_buffer: Optional[RealtimeBuffer] = RealtimeBuffer() if cp['is_realtime'] else None
+
     def run(self):
         self.realtime_runs += 1
         if self.cp['is_realtime']:
@@ -53,21 +57,21 @@ class Calculation(QRunnable):
 
         try:
             # Gather data from InfluxDB
-            influx_data: dict[str, Union[dict[str, dict[datetime, float]], str]]
+            influx_data: UnitsData
             missing_links: list[int]
-            ips: list[str]
-            influx_data, missing_links, ips = data_loading.load_data_from_influxdb(
+            influx_data, missing_links = data_loading.load_data_from_influxdb(
                 influx_man=self.influx_man,
                 signals=self.signals,
                 cp=self.cp,
                 selected_links=self.selection,
                 links=self.links,
                 log_run_id=log_run_id,
-                results_id=self.results_id
+                results_id=self.results_id,
+                realtime_buffer=self.realtime_buffer
             )
 
-            # Merge influx data with metadata into datasets, resolve Tx power assignment to correct channel
-            calc_data: list[xr.Dataset] = data_preprocessing.convert_to_link_datasets(
+            # Merge influx data with metadata into one stacked dataset, resolve Tx power assignment to correct channel
+            calc_data: xr.Dataset = data_preprocessing.convert_to_links_dataset(
                 signals=self.signals,
                 selected_links=self.selection,
                 links=self.links,
@@ -82,11 +86,10 @@ class Calculation(QRunnable):
 
         try:
             # Obtain rain rates and store them in the calc_data
-            calc_data: list[xr.Dataset] = rain_calculation.get_rain_rates(
+            calc_data: xr.Dataset = rain_calculation.get_rain_rates(
                 signals=self.signals,
                 calc_data=calc_data,
                 cp=self.cp,
-                ips=ips,
                 log_run_id=log_run_id,
                 results_id=self.results_id
             )
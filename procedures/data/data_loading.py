@@ -1,9 +1,9 @@
-from datetime import datetime
 import traceback
-from typing import Union
+from typing import Optional
 
-from database.influx_manager import InfluxManager
+from database.influx_manager import InfluxManager, RealtimeBuffer
 from database.models.mwlink import MwLink
+from database.models.units_data import UnitsData
 from handlers.logging_handler import logger
 from procedures.calculation_signals import CalcSignals
 from procedures.exceptions import ProcessingException
@@ -43,8 +43,9 @@ def load_data_from_influxdb(
         selected_links: dict[int, int],
         links: dict[int, MwLink],
         log_run_id: str,
-        results_id: int
-) -> (dict[str, Union[dict[str, dict[datetime, float]], str]], list[int], list[str]):
+        results_id: int,
+        realtime_buffer: Optional[RealtimeBuffer] = None
+) -> (UnitsData, list[int]):
     try:
         ips = _get_ips_from_links_dict(selected_links, links)
 
@@ -54,7 +55,9 @@ def load_data_from_influxdb(
         # Realtime calculation is being done
         if cp['is_realtime']:
             logger.info("[%s] Realtime data procedure started.", log_run_id)
-            influx_data = influx_man.query_units_realtime(ips, cp['realtime_timewindow'], cp['step'])
+            influx_data = influx_man.query_units_realtime(
+                ips, cp['realtime_timewindow'], cp['step'], realtime_buffer
+            )
 
         # In other case, notify we are doing historic calculation
         else:
@@ -92,7 +95,7 @@ def load_data_from_influxdb(
 
         signals.progress_signal.emit({'prg_val': 18})
 
-        return influx_data, missing_links, ips
+        return influx_data, missing_links
 
     except BaseException as error:
         signals.error_signal.emit({"id": results_id})
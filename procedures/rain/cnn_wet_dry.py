@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lib.pycomlink.pycomlink.processing.wet_dry import cnn
+from lib.pycomlink.pycomlink.processing.wet_dry.cnn import CNN_OUTPUT_LEFT_NANS_LENGTH
+
+from handlers import config_handler
+from handlers.logging_handler import logger
+
+
+# length of the CNN input window (in samples), given by the input layer of pycomlink's model
+CNN_WINDOW_LENGTH = int(cnn.model.input_shape[1])
+# rolling median used for TRSL normalization (window and minimal periods in samples), same as in 'cnn.cnn_wet_dry'
+# (pycomlink does not export them, equivalence with 'cnn.cnn_wet_dry' is tested in tests/test_cnn_wet_dry.py)
+CNN_MEDIAN_WINDOW = 72 * 60
+CNN_MEDIAN_MIN_PERIODS = 2 * 60
+
+CNN_BATCH_SIZE = int(config_handler.read_option("cnn", "batch_size"))
+CNN_WORKERS = int(config_handler.read_option("cnn", "workers"))
+CNN_INTRA_OP_THREADS = int(config_handler.read_option("cnn", "intra_op_threads"))
+
+# TensorFlow threading is configured on the first use of the model, not on import of this module
+_is_threading_configured = False
+_threading_lock = Lock()
+
+
+def _set_intra_op_threads():
+    """Set number of TensorFlow intra-op threads once, if configured (0 = TensorFlow default)."""
+    global _is_threading_configured
+    with _threading_lock:
+        if _is_threading_configured:
+            return
+        _is_threading_configured = True
+
+        if CNN_INTRA_OP_THREADS <= 0:
+            return
+
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(CNN_INTRA_OP_THREADS)
+        except RuntimeError as error:
+            # threading can be configured only before TensorFlow runtime is initialized
+            logger.warning("[CNN] Cannot set number of intra-op threads: %s", error)
+
+
+def _predict(windows: np.ndarray) -> np.ndarray:
+    return np.ravel(np.asarray(cnn.model(windows, training=False)))
+
+
+def cnn_wet_dry_batched(trsl: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Determine wet periods of all CMLs using CNN model of pycomlink, equivalent to calling 'cnn.cnn_wet_dry' per CML.
+    TRSL of all CMLs is normalized and windowed at once and the windows of all CMLs are fed into the model in large
+    batches (optionally processed concurrently by 'workers' threads). Windows containing missing values are not
+    predicted, their output is NaN.
+
+    :param trsl: 3D array of TRSL values with shape (cml_id, channel_id, time), with 2 channels
+    :param threshold: CNN output threshold, output above the threshold is classified as wet
+    :return: 2D array with shape (cml_id, time) of wet (1.0) / dry (0.0) values, NaN where output is not available
+    """
+    cmls_count, channels_count, length = trsl.shape
+    wet = np.full((cmls_count, length), np.nan)
+
+    windows_count = length - CNN_WINDOW_LENGTH + 1
+    if cmls_count == 0 or windows_count <= 0:
+        return wet
+
+    # subtract rolling median of all timeseries at once (columns = CML channels)
+    series = pd.DataFrame(trsl.reshape((-1, length)).T)
+    normalized = series.sub(
+        series.rolling(CNN_MEDIAN_WINDOW, min_periods=CNN_MEDIAN_MIN_PERIODS, center=False).median()
+    ).to_numpy(dtype=np.float32).T.reshape((cmls_count, channels_count, length))
+
+    # windows of all CMLs with shape (cml_id, window, time, channel_id) are only views into normalized TRSL
+    windows = np.moveaxis(sliding_window_view(normalized, CNN_WINDOW_LENGTH, axis=-1), 1, -1)
+    # windows without missing values (count of NaNs in each window from cumulative count of NaNs along time)
+    nans_cumsum = np.zeros((cmls_count, channels_count, length + 1), dtype=np.int32)
+    np.cumsum(np.isnan(normalized), axis=-1, out=nans_cumsum[..., 1:])
+    window_nans = nans_cumsum[..., CNN_WINDOW_LENGTH:] - nans_cumsum[..., :windows_count]
+    is_complete = (window_nans == 0).all(axis=1)
+    cml_idx, window_idx = np.nonzero(is_complete)
+
+    # split complete windows into batches, windows are copied into contiguous arrays per batch only
+    batches = [
+        (cml_idx[start:start + CNN_BATCH_SIZE], window_idx[start:start + CNN_BATCH_SIZE])
+        for start in range(0, len(cml_idx), CNN_BATCH_SIZE)
+    ]
+
+    logger.debug(
+        "[CNN] Predicting %d windows of %d CMLs in %d batches using %d workers...",
+        len(cml_idx), cmls_count, len(batches), CNN_WORKERS
+    )
+
+    _set_intra_op_threads()
+
+    if CNN_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=CNN_WORKERS) as executor:
+            predictions = list(executor.map(lambda batch: _predict(windows[batch]), batches))
+    else:
+        predictions = [_predict(windows[batch]) for batch in batches]
+
+    if len(predictions) > 0:
+        # predictions are placed after CNN_OUTPUT_LEFT_NANS_LENGTH leading NaNs, as in 'cnn.cnn_wet_dry'
+        wet[cml_idx, window_idx + CNN_OUTPUT_LEFT_NANS_LENGTH] = (np.concatenate(predictions) > threshold)
+
+    return wet
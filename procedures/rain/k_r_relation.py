@@ -0,0 +1,96 @@
+from threading import Lock
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from lib.pycomlink.pycomlink.processing.k_R_relation import a_b
+
+if TYPE_CHECKING:
+    # type only, module is imported by worker processes of the parallel executor, which avoid database imports
+    from database.models.mwlink import MwLink
+
+
+class KRCoefficientTable:
+    """
+    Memoized table of ITU k-R relation coefficients (a, b) per (frequency, polarization) pair. CML fleet contains
+    only a small set of distinct pairs, so coefficients are computed only once per pair, instead of once per link and
+    calculation. Table is prefilled from links metadata, other pairs are added on their first use.
+    """
+    def __init__(self):
+        self.coefficients: dict[tuple[float, str], tuple[float, float]] = {}
+        self.lock = Lock()
+
+    def build(self, links: dict[int, "MwLink"]):
+        """
+        (Re)build the table from links metadata. Should be called whenever the metadata are (re)loaded.
+
+        :param links: dict of links metadata (frequencies are in MHz)
+        """
+        pairs = {(link.freq_a / 1000, link.polarization) for link in links.values()} | \
+                {(link.freq_b / 1000, link.polarization) for link in links.values()}
+
+        coefficients = {}
+        for f_GHz, pol in pairs:
+            try:
+                coefficients[(f_GHz, pol)] = self._compute(f_GHz, pol)
+            except ValueError:
+                # unsupported frequency or polarization, error is raised when (if) the pair is really used
+                pass
+
+        with self.lock:
+            self.coefficients = coefficients
+
+    @staticmethod
+    def _compute(f_GHz: float, pol: str) -> (float, float):
+        a, b = a_b(f_GHz, pol)
+        return float(a), float(b)
+
+    def get_coefficients(self, f_GHz: np.ndarray, pol: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Look up coefficients of all (frequency, polarization) pairs at once.
+
+        :param f_GHz: N-D array of frequencies in GHz
+        :param pol: array of polarizations, broadcastable to the shape of 'f_GHz'
+        :return: tuple of N-D arrays (a, b) with the shape of 'f_GHz'
+        """
+        f_GHz, pol = np.broadcast_arrays(np.asarray(f_GHz, dtype=float), np.asarray(pol))
+
+        a = np.empty(f_GHz.shape)
+        b = np.empty(f_GHz.shape)
+        for i, key in enumerate(zip(f_GHz.ravel().tolist(), pol.ravel().tolist())):
+            coefficients = self.coefficients.get(key)
+            if coefficients is None:
+                coefficients = self._compute(*key)
+                with self.lock:
+                    self.coefficients[key] = coefficients
+            a.flat[i], b.flat[i] = coefficients
+
+        return a, b
+
+
+def calc_R_from_A(A: np.ndarray, L_km: np.ndarray, a: np.ndarray, b: np.ndarray, R_min: float = 0.1) -> np.ndarray:
+    """
+    Calculate rain rate from rain attenuation using k-R relation, for all links at once. Same as pycomlink's
+    'calc_R_from_A': negative attenuation is clipped to zero, rain rates below 'R_min' are set to zero and missing
+    values are preserved.
+
+    :param A: N-D array of rain attenuation (in dB)
+    :param L_km: array of link lengths (in km), broadcastable to the shape of 'A'
+    :param a: array of k-R coefficients 'a', broadcastable to the shape of 'A'
+    :param b: array of k-R coefficients 'b', broadcastable to the shape of 'A'
+    :param R_min: minimal rain rate (in mm/h), lower rain rates are set to zero
+    :return: N-D array of rain rates (in mm/h)
+    """
+    A = np.array(A, dtype=float)
+    is_missing = np.isnan(A)
+    A[A < 0] = 0
+
+    R = (A / (a * L_km)) ** (1 / b)
+    R[is_missing] = np.nan
+    R[R < R_min] = 0
+
+    return R
+
+
+# global instance of KRCoefficientTable
+k_r_table = KRCoefficientTable()
@@ -1,41 +1,234 @@
+from collections import OrderedDict
+import hashlib
 import math
+from threading import Lock
+from typing import Optional
 
 import numpy as np
 import xarray as xr
 
 from lib.sweep_intersector.lib.SweepIntersector import SweepIntersector
 
+from handlers import config_handler
 from handlers.logging_handler import logger
+from procedures.utils.indexed_intersector import IndexedIntersector
+
+
+# segment points of one CML: (longitudes, latitudes, CML references)
+Segments = tuple[list[float], list[float], list[int]]
+
+# engine finding intersections of the CMLs: 'indexed' (spatially indexed) or 'sweep' (pure Python sweep line)
+INTERSECTION_ENGINE = config_handler.read_option("calculation", "intersection_engine")
+
+# maximum number of segmentation geometries (e.g. of different link sets or segmentation parameters) kept in the cache
+SEGMENTATION_CACHE_ENTRIES = 8
+
+
+class SegmentTable:
+    """
+    Compact table of segment points of all CMLs. Points of all CMLs are stored in contiguous arrays, points of the i-th
+    CML (along 'cml_id' dimension of the stacked dataset) are in the range [offsets[i], offsets[i + 1]).
+    """
+    def __init__(self, longs: np.ndarray, lats: np.ndarray, cml_references: np.ndarray, offsets: np.ndarray):
+        # longitudes and latitudes of the segment points
+        self.longs: np.ndarray = longs
+        self.lats: np.ndarray = lats
+        # IDs of the CMLs whose rain values are assigned to the segment points
+        self.cml_references: np.ndarray = cml_references
+        # start of each CML's points in the arrays above, with total count of points as the last item
+        self.offsets: np.ndarray = offsets
+
+    @classmethod
+    def from_arrays(
+            cls,
+            longs: np.ndarray,
+            lats: np.ndarray,
+            cml_references: np.ndarray,
+            counts: np.ndarray
+    ) -> "SegmentTable":
+        """
+        Build the table from concatenated segment points of all CMLs.
+
+        :param longs: longitudes of the segment points of all CMLs
+        :param lats: latitudes of the segment points of all CMLs
+        :param cml_references: CML references of the segment points of all CMLs
+        :param counts: number of segment points of each CML, in the order of 'cml_id' dimension of the stacked dataset
+        :return: new segment table
+        """
+        offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(
+            longs=np.asarray(longs, dtype=np.float32),
+            lats=np.asarray(lats, dtype=np.float32),
+            cml_references=np.asarray(cml_references, dtype=np.int32),
+            offsets=offsets
+        )
+
+    def __len__(self) -> int:
+        return len(self.cml_references)
+
+    def cml_points(self, index: int) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Get segment points of one CML.
+
+        :param index: index of the CML along 'cml_id' dimension of the stacked dataset
+        :return: tuple of (longitudes, latitudes, CML references) of the CML's segment points
+        """
+        points = slice(self.offsets[index], self.offsets[index + 1])
+        return self.longs[points], self.lats[points], self.cml_references[points]
+
+    def replaced(self, cml_ids: np.ndarray, segments: dict[int, Segments]) -> "SegmentTable":
+        """
+        Create new table with segment points of some CMLs replaced.
+
+        :param cml_ids: IDs of all CMLs, in the order of 'cml_id' dimension of the stacked dataset
+        :param segments: dictionary of CML ID -> new segment points of the CML
+        :return: new segment table
+        """
+        parts = [
+            tuple(np.asarray(values) for values in segments[int(cml_id)]) if int(cml_id) in segments
+            else self.cml_points(i)
+            for i, cml_id in enumerate(cml_ids)
+        ]
+        if not parts:
+            return self
+
+        return SegmentTable.from_arrays(
+            longs=np.concatenate([part[0] for part in parts]),
+            lats=np.concatenate([part[1] for part in parts]),
+            cml_references=np.concatenate([part[2] for part in parts]),
+            counts=[len(part[0]) for part in parts]
+        )
+
+
+class SegmentGeometry:
+    """
+    Geometric part of the CMLs segmentation, which does not depend on rain values.
+    """
+    def __init__(self, segment_table: SegmentTable, intersections: dict, intersecting_cml_ids: list[int]):
+        # segment points of all CMLs by central points or linear segments method
+        self.segment_table: SegmentTable = segment_table
+        # intersections of the CMLs found by the intersector (empty, if intersection algorithm is disabled)
+        self.intersections: dict = intersections
+        # IDs of the CMLs having intersections, their segment points are assigned by the intersection algorithm
+        self.intersecting_cml_ids: list[int] = intersecting_cml_ids
+
+
+class SegmentationCache:
+    """
+    In-memory LRU cache of segmentation geometries, keyed by hash of CMLs geometry and segmentation parameters. CMLs
+    geometry rarely changes, so the geometry can be reused across calculations and realtime iterations.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, SegmentGeometry] = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def get_key(
+            calc_data: xr.Dataset,
+            segment_size: int,
+            is_central_enabled: bool,
+            is_intersection_enabled: bool
+    ) -> str:
+        """
+        Get cache key of the segmentation geometry: hash of CML IDs, their coordinates and lengths, and parameters.
+        """
+        key = hashlib.sha1(f"{segment_size}|{is_central_enabled}|{is_intersection_enabled}".encode())
+        key.update(np.ascontiguousarray(calc_data.cml_id.values, dtype=np.int64).tobytes())
+        for coord in ("site_a_longitude", "site_a_latitude", "site_b_longitude", "site_b_latitude", "length"):
+            key.update(np.ascontiguousarray(calc_data[coord].values, dtype=np.float64).tobytes())
+        return key.hexdigest()
+
+    def get(self, key: str) -> Optional[SegmentGeometry]:
+        with self.lock:
+            geometry = self.entries.get(key)
+            if geometry is not None:
+                self.entries.move_to_end(key)
+            return geometry
+
+    def put(self, key: str, geometry: SegmentGeometry):
+        with self.lock:
+            self.entries[key] = geometry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# global instance of SegmentationCache
+segmentation_cache = SegmentationCache(SEGMENTATION_CACHE_ENTRIES)
 
 
 def process_segments(
-        calc_data: list[xr.Dataset],
+        calc_data: xr.Dataset,
         segment_size: int,
         is_central_enabled: bool,
         is_intersection_enabled: bool,
         log_run_id: str
-):
+) -> SegmentTable:
     """
     Process segmentation of CMLs based on the selected method (central points, linear segments, intersection algorithm).
+    Geometric part of the segmentation is cached, only assignment of the CML references by the intersection algorithm
+    (which depends on rain values) is done in each call.
 
     Central points = one point in the middle of the CML.
     Linear segments = divide the CML into segments of the same length.
     Intersection algorithm = divide the CML into segments based on intersections with other CMLs, if no intersection is
                              found for given CML, apply central points or linear segments method.
 
-    :param calc_data: List of CML datasets to be processed.
+    :param calc_data: Stacked dataset of CMLs to be processed.
+    :param segment_size: Size of the segment (in meters).
+    :param is_central_enabled: If True, central points method is selected.
+    :param is_intersection_enabled: If True, intersection algorithm is selected.
+    :param log_run_id: ID of the current calculation run.
+    :return: Segment table with segment points of all CMLs.
+    """
+    key = segmentation_cache.get_key(calc_data, segment_size, is_central_enabled, is_intersection_enabled)
+    geometry = segmentation_cache.get(key)
+    if geometry is None:
+        geometry = _process_geometry(calc_data, segment_size, is_central_enabled, is_intersection_enabled, log_run_id)
+        segmentation_cache.put(key, geometry)
+    else:
+        logger.debug("[%s] Links geometry not changed, using cached segmentation geometry.", log_run_id)
+
+    if not geometry.intersecting_cml_ids:
+        return geometry.segment_table
+
+    # intersecting links get only segment points assigned by the intersection algorithm
+    segments: dict[int, Segments] = {cml_id: ([], [], []) for cml_id in geometry.intersecting_cml_ids}
+
+    # divide links into segments based on intersection algorithm
+    logger.debug("[%s] Dividing intersecting links into segments based on intersection algorithm...", log_run_id)
+    segments.update(intersection_algorithm(calc_data, geometry.intersections))
+
+    return geometry.segment_table.replaced(calc_data.cml_id.data, segments)
+
+
+def _process_geometry(
+        calc_data: xr.Dataset,
+        segment_size: int,
+        is_central_enabled: bool,
+        is_intersection_enabled: bool,
+        log_run_id: str
+) -> SegmentGeometry:
+    """
+    Process geometric part of the segmentation: segment points of all CMLs by central points or linear segments method,
+    and intersections of the CMLs, if intersection algorithm is enabled.
+
+    :param calc_data: Stacked dataset of CMLs to be processed.
     :param segment_size: Size of the segment (in meters).
     :param is_central_enabled: If True, central points method is selected.
     :param is_intersection_enabled: If True, intersection algorithm is selected.
     :param log_run_id: ID of the current calculation run.
+    :return: Geometry of the segmentation.
     """
     if not is_intersection_enabled:
         if is_central_enabled:
             # apply central points for all links
             logger.debug("[%s] Intersection disabled, central points method is selected.", log_run_id)
             logger.debug("[%s] Calculating central points of all links...", log_run_id)
-            for cml in calc_data:
-                central_points(cml)
+            return SegmentGeometry(central_points(calc_data), {}, [])
         else:
             # divide all links into linear segments
             logger.debug("[%s] Intersection disabled, linear segments method is selected.", log_run_id)
@@ -44,127 +237,102 @@ def process_segments(
                 log_run_id,
                 segment_size
             )
-            for cml in calc_data:
-                linear_repeat(cml, segment_size)
+            return SegmentGeometry(linear_repeat(calc_data, segment_size), {}, [])
     else:
         # create list of CML border segment points (= CML coordinates) for intersection algorithm
-        cmls_segment_points: list[tuple[tuple[float, float], tuple[float, float]]] = []
-        for cml in calc_data:
-            cmls_segment_points.append(
-                (
-                    (float(cml.site_a_longitude.data), float(cml.site_a_latitude.data)),
-                    (float(cml.site_b_longitude.data), float(cml.site_b_latitude.data))
-                )
+        cmls_segment_points: list[tuple[tuple[float, float], tuple[float, float]]] = [
+            ((float(a_long), float(a_lat)), (float(b_long), float(b_lat)))
+            for a_long, a_lat, b_long, b_lat in zip(
+                calc_data.site_a_longitude.data,
+                calc_data.site_a_latitude.data,
+                calc_data.site_b_longitude.data,
+                calc_data.site_b_latitude.data
             )
+        ]
         # find intersections of cmls with other cmls
-        logger.debug("[%s] Intersection enabled, finding intersections...", log_run_id)
-        intersector = SweepIntersector()
+        logger.debug("[%s] Intersection enabled, finding intersections (%s engine)...", log_run_id, INTERSECTION_ENGINE)
+        intersector = IndexedIntersector() if INTERSECTION_ENGINE == "indexed" else SweepIntersector()
         intersections = intersector.findIntersections(cmls_segment_points)
         logger.debug("[%s] Found %d intersections.", log_run_id, len(intersections))
 
-        # for links with no intersections, just apply central points or divide them into segments
+        # for links with no intersections, just apply central points or divide them into segments (all links are
+        # processed at once, segment points of intersecting links are replaced by the intersection algorithm)
         if is_central_enabled:
             logger.debug("[%s] Calculating central points for no-intersecting links...", log_run_id)
+            segment_table = central_points(calc_data)
         else:
             logger.debug(
                 "[%s] Dividing no-intersecting links into linear segments with segment size of %d m...",
                 log_run_id,
                 segment_size
             )
+            segment_table = linear_repeat(calc_data, segment_size)
 
-        for cml in calc_data:
-            if (
-                (
-                    (float(cml.site_a_longitude.data), float(cml.site_a_latitude.data)),
-                    (float(cml.site_b_longitude.data), float(cml.site_b_latitude.data))
-                )
-            ) in intersections:
-                continue
-            else:
-                if is_central_enabled:
-                    central_points(cml)
-                else:
-                    linear_repeat(cml, segment_size)
+        intersecting_cml_ids = [
+            int(cml_id) for cml_id, points in zip(calc_data.cml_id.data, cmls_segment_points) if points in intersections
+        ]
 
-        # if there are intersections, divide links into segments based on intersection algorithm
-        if len(intersections) > 0:
-            logger.debug(
-                "[%s] Dividing intersecting links into segments based on intersection algorithm...",
-                log_run_id
-            )
-            intersection_algorithm(calc_data, intersections)
+        return SegmentGeometry(segment_table, intersections, intersecting_cml_ids)
 
 
-def central_points(cml: xr.Dataset):
+def central_points(calc_data: xr.Dataset) -> SegmentTable:
     """
-    Calculate central point of the CML and assign it as the only segment point.
+    Calculate central points of all CMLs and assign them as the only segment points.
 
-    :param cml: CML dataset to be processed.
+    :param calc_data: Stacked dataset of CMLs to be processed.
+    :return: Segment table with segment points of all CMLs.
     """
-    lat_center = (cml.site_a_latitude + cml.site_b_latitude) / 2
-    lon_center = (cml.site_a_longitude + cml.site_b_longitude) / 2
+    lat_centers = (calc_data.site_a_latitude.values + calc_data.site_b_latitude.values) / 2
+    lon_centers = (calc_data.site_a_longitude.values + calc_data.site_b_longitude.values) / 2
 
-    cml["segment_points"] = [1] # only one segment point = the central point
-    cml["long_array"] = ("segment_points", [lon_center])
-    cml["lat_array"] = ("segment_points", [lat_center])
-    cml["cml_reference"] = ("segment_points", [int(cml.cml_id.data)]) # reference to the same CML = use own rain values
+    # only one segment point = the central point, reference to the same CML = use own rain values
+    return SegmentTable.from_arrays(
+        longs=lon_centers,
+        lats=lat_centers,
+        cml_references=calc_data.cml_id.values,
+        counts=np.ones(calc_data.sizes["cml_id"], dtype=np.int32)
+    )
 
 
-def linear_repeat(cml: xr.Dataset, segment_size: int):
+def linear_repeat(calc_data: xr.Dataset, segment_size: int) -> SegmentTable:
     """
-    Divide the CML into segments of the same length.
+    Divide all CMLs into segments of the same length at once. Each CML with length 'd' is divided into
+    max(floor(d / segment_size), 1) segments, segment points are their borders (including the CML's sites).
 
-    :param cml: CML dataset to be processed.
+    :param calc_data: Stacked dataset of CMLs to be processed.
     :param segment_size: Size of the segment (in meters).
+    :return: Segment table with segment points of all CMLs.
     """
-    # putting coordinates into variables
-    site_a = {"x": cml.site_a_longitude, "y": cml.site_a_latitude}
-    site_b = {"x": cml.site_b_longitude, "y": cml.site_b_latitude}
+    site_a_longs = calc_data.site_a_longitude.values.astype(float)
+    site_a_lats = calc_data.site_a_latitude.values.astype(float)
+    site_b_longs = calc_data.site_b_longitude.values.astype(float)
+    site_b_lats = calc_data.site_b_latitude.values.astype(float)
 
-    distance = float(cml.length.data) * 1000
+    distances = calc_data.length.values.astype(float) * 1000
 
-    # dividing link into 'x'm intervals = segments
-    if distance >= segment_size:
-        number_of_segments = distance / segment_size
-    else:
-        number_of_segments = 1
-
-    # calculating gaps between each point in link
-    gap_long = (site_b["x"] - site_a["x"]) / np.floor(number_of_segments)
-    gap_lat = (site_b["y"] - site_a["y"]) / np.floor(number_of_segments)
-
-    # append into list_of_points series of digits representing number of points bordering segments
-    list_of_points = []
-    i = 1
-    while i <= np.floor(number_of_segments) + 1:
-        list_of_points.append(i)
-        i += 1
-    cml["segment_points"] = list_of_points
-
-    # append coordinates of each point into lat_coords & long_coords
-    long_coords = []
-    lat_coords = []
-    step = 0
-    while step <= number_of_segments:
-        next_long_point = site_a["x"] + gap_long * step
-        next_lat_point = site_a["y"] + gap_lat * step
-
-        long_coords.append(next_long_point)
-        lat_coords.append(next_lat_point)
-        step += 1
-
-    cml_data_id = []
-    rr = 1
-    while rr <= len(list_of_points):
-        cml_data_id.append(int(cml.cml_id.data))
-        rr += 1
-
-    cml["long_array"] = ("segment_points", long_coords)
-    cml["lat_array"] = ("segment_points", lat_coords)
-    cml["cml_reference"] = ("segment_points", cml_data_id) # reference to the same CML = use own rain values
-
-
-def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
+    # dividing links into 'x'm intervals = segments (links shorter than segment size, or with unknown length, have one)
+    with np.errstate(invalid="ignore"):
+        numbers_of_segments = np.floor(np.where(distances >= segment_size, distances / segment_size, 1))
+
+    # calculating gaps between each point in links
+    gaps_long = (site_b_longs - site_a_longs) / numbers_of_segments
+    gaps_lat = (site_b_lats - site_a_lats) / numbers_of_segments
+
+    # segment points of all links: i-th link has points a + gap * step, for step = 0 ... number of its segments
+    counts = numbers_of_segments.astype(np.int64) + 1
+    owners = np.repeat(np.arange(len(counts)), counts)
+    steps = np.arange(owners.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # reference to the same CML = use own rain values
+    return SegmentTable.from_arrays(
+        longs=site_a_longs[owners] + gaps_long[owners] * steps,
+        lats=site_a_lats[owners] + gaps_lat[owners] * steps,
+        cml_references=calc_data.cml_id.values[owners],
+        counts=counts
+    )
+
+
+def intersection_algorithm(calc_data: xr.Dataset, intersections: dict) -> dict[int, Segments]:
     """
     Divide the CMLs into segments based on intersections with other CMLs, and assing the CML reference to each segment
     point with the priority of lower rain rates during the comparison of the intersecting segments.
@@ -172,8 +340,9 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
     Original author: Radek Vomočil
     Source: https://github.com/radekvomocil/Telcorain-GIT/blob/master/procedures/links_to_segments.py
 
-    :param calc_data: List of CML datasets to be processed.
+    :param calc_data: Stacked dataset of CMLs to be processed.
     :param intersections: Dictionary of intersections between CMLs.
+    :return: Dictionary of CML ID -> segment points of the CML, for intersecting CMLs.
     """
     # TODO: Refactor (simplify) this function to make it more readable and maintainable, add missing type hints
     #  (currently refactored using mostly "heavy force" and ChatGPT)
@@ -226,19 +395,44 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
     """
 
     # -------------------------------------------------------------------------
-    # 1. HELPER FUNCTIONS
+    # 1. LOOKUP STRUCTURES
     # -------------------------------------------------------------------------
-    def cml_coords_match(ds: xr.Dataset, coord_first: tuple, coord_last: tuple) -> bool:
-        """
-        Returns True if dataset `ds` has site_a matching `coord_first` and site_b matching `coord_last`.
-        """
-        return (
-            ds.site_a_longitude.data == coord_first[0]
-            and ds.site_a_latitude.data == coord_first[1]
-            and ds.site_b_longitude.data == coord_last[0]
-            and ds.site_b_latitude.data == coord_last[1]
-        )
 
+    # CML IDs and mean rain rates of the CMLs, indexed along 'cml_id' dimension of calc_data
+    cml_ids = [int(cml_id) for cml_id in calc_data.cml_id.data]
+    r_means = calc_data.R.mean(dim=[dim for dim in calc_data.R.dims if dim != "cml_id"]).data.tolist()
+
+    # (site A, site B) coordinates -> indices of all CMLs with these coordinates
+    cmls_by_coords: dict[tuple, list[int]] = {}
+    for idx, (a_long, a_lat, b_long, b_lat) in enumerate(zip(
+        calc_data.site_a_longitude.data.tolist(),
+        calc_data.site_a_latitude.data.tolist(),
+        calc_data.site_b_longitude.data.tolist(),
+        calc_data.site_b_latitude.data.tolist()
+    )):
+        cmls_by_coords.setdefault(((a_long, a_lat), (b_long, b_lat)), []).append(idx)
+
+    # mean rain rate -> index of the first CML with this mean rain rate (NaN never matches)
+    cml_index_by_rain: dict[float, int] = {}
+    for idx, r_mean in enumerate(r_means):
+        if r_mean == r_mean:
+            cml_index_by_rain.setdefault(r_mean, idx)
+
+    # materialized lists of intersection points (including sites) of the intersecting CMLs
+    isec_lists: list[list[tuple[float, float]]] = list(intersections.values())
+
+    # intersection point -> mean rain rates of the CMLs passing through the point, in the order of 'isec_lists'
+    point_rain_values: dict[tuple[float, float], list[float]] = {}
+    for coords_list in isec_lists:
+        owners = cmls_by_coords.get((coords_list[0], coords_list[-1]))
+        if owners is None:
+            continue
+        for point in coords_list:
+            point_rain_values.setdefault(point, []).append(r_means[owners[0]])
+
+    # -------------------------------------------------------------------------
+    # 2. HELPER FUNCTIONS
+    # -------------------------------------------------------------------------
     def append_point_data(
         long_intersections,
         long_coordinates,
@@ -257,62 +451,24 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         number_of_intersections.append(num)
         references.append(cml_data)
 
-    def nested_cycle_operation(isecDic, calc_data_op, rain_values_side, side_coords):
-        """
-        Helper that searches across all intersections and calc_data for
-        any link matching the side_coords, then appends its R.mean() value.
-        """
-        for q in range(len(isecDic)):
-            coords_list = list(isecDic.values())[q]
-            for w in range(len(coords_list)):
-                if coords_list[w] == side_coords:
-                    # If found intersection matches side_coords,
-                    # check each dataset in calc_data_op
-                    for z in range(len(calc_data_op)):
-                        if cml_coords_match(
-                            calc_data_op[z],
-                            coords_list[0],      # first intersection
-                            coords_list[-1]      # last intersection
-                        ):
-                            rain_values_side.append(float(calc_data_op[z].R.mean().data))
-                            break
-                    # continue scanning for next q
-                else:
-                    continue
-
-    def compute_lowest_rain_values(calc_data_op, intersections_dict, r_index, j_index):
+    def compute_lowest_rain_values(coords_list, j_index):
         """
-        Compute the minimum rain values for each 'side' of a single path by calling nested_cycle_operation.
+        Compute the minimum rain values of the CMLs passing through each 'side' of a single path.
 
         Returns:
             (lowest_value_first, count_first_side, lowest_value_second, count_second_side)
         """
-        # First side
-        rain_values_first_side = []
-        nested_cycle_operation(
-            intersections_dict,
-            calc_data_op,
-            rain_values_first_side,
-            list(intersections_dict.values())[r_index][j_index]
-        )
-        lowest_value_first = min(rain_values_first_side)
-        count_first_side = len(rain_values_first_side)
-
-        # Second side
-        rain_values_second_side = []
-        nested_cycle_operation(
-            intersections_dict,
-            calc_data_op,
-            rain_values_second_side,
-            list(intersections_dict.values())[r_index][j_index + 1]
-        )
-        lowest_value_second = min(rain_values_second_side)
-        count_second_side = len(rain_values_second_side)
+        rain_values_first_side = point_rain_values.get(coords_list[j_index], [])
+        rain_values_second_side = point_rain_values.get(coords_list[j_index + 1], [])
 
-        return lowest_value_first, count_first_side, lowest_value_second, count_second_side
+        return (
+            min(rain_values_first_side),
+            len(rain_values_first_side),
+            min(rain_values_second_side),
+            len(rain_values_second_side)
+        )
 
     def find_and_append_cml_reference(
-        calc_data_op,
         side_coord,
         lowest_rain_val,
         long_intersections,
@@ -322,28 +478,25 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         cml_refs
     ):
         """
-        Loop over calc_data_op, find the dataset whose R.mean() matches 'lowest_rain_value',
-        and append the side_coord if not already in long_intersections. Break at the first match.
+        Find the first CML whose R.mean() matches 'lowest_rain_value', and append the side_coord with the reference to
+        this CML if not already in long_intersections.
         """
-        for idx in range(len(calc_data_op)):
-            if lowest_rain_val == float(calc_data_op[idx].R.mean().data):
-                # Avoid appending if the longitude is already there
-                if side_coord[0] in long_intersections:
-                    break
-                else:
-                    append_point_data(
-                        long_intersections,
-                        side_coord[0],
-                        lat_intersections,
-                        side_coord[1],
-                        find_num_of_intersections,
-                        segment_number,
-                        cml_refs,
-                        int(calc_data_op[idx].cml_id.data),
-                    )
-                    break
-            else:
-                continue
+        idx = cml_index_by_rain.get(lowest_rain_val)
+        if idx is None:
+            return
+
+        # Avoid appending if the longitude is already there
+        if side_coord[0] not in long_intersections:
+            append_point_data(
+                long_intersections,
+                side_coord[0],
+                lat_intersections,
+                side_coord[1],
+                find_num_of_intersections,
+                segment_number,
+                cml_refs,
+                cml_ids[idx],
+            )
 
     def compute_midpoint(coord1: tuple[float, float], coord2: tuple[float, float]) -> tuple[float, float]:
         """
@@ -355,7 +508,6 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         )
 
     def append_side_midpoint_side(
-        calc_data_op,
         first_side_coord,
         second_side_coord,
         lowest_r_first,
@@ -381,7 +533,6 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
 
         # 2) First side
         find_and_append_cml_reference(
-            calc_data_op,
             first_side_coord,
             lowest_r_first,
             long_coord_intersection,
@@ -403,7 +554,6 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         )
         # 4) Second side
         find_and_append_cml_reference(
-            calc_data_op,
             second_side_coord,
             lowest_r_second,
             long_coord_intersection,
@@ -414,23 +564,13 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         )
 
     # -------------------------------------------------------------------------
-    # 2. MAIN LOGIC
+    # 3. MAIN LOGIC
     # -------------------------------------------------------------------------
 
-    # (Optional) Pre-calculate distances for the first link in intersections
-    distances_example = []
-    if len(intersections) > 0 and len(list(intersections.values())[0]) > 1:
-        for o in range(len(list(intersections.values())[0]) - 1):
-            distance = math.dist(
-                list(intersections.values())[0][o],
-                list(intersections.values())[0][o + 1]
-            )
-            distances_example.append(distance)
-
-    # Store beginning-end coords of the longest lines
-    coords_of_longest_lines_of_links = []
+    # CML ID -> segment points of intersecting CMLs
+    segments: dict[int, Segments] = {}
 
-    for r in range(len(intersections)):
+    for coords_list in isec_lists:
         find_number_of_intersections = []
         segment_points_intersections = []
         long_coords_intersections = []
@@ -439,13 +579,7 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
         number = 1  # Start numbering segments from 1
 
         # Calculate distances for the current set of intersections
-        distances = []
-        for oo in range(len(list(intersections.values())[r]) - 1):
-            dist = math.dist(
-                list(intersections.values())[r][oo],
-                list(intersections.values())[r][oo + 1]
-            )
-            distances.append(dist)
+        distances = [math.dist(coords_list[oo], coords_list[oo + 1]) for oo in range(len(coords_list) - 1)]
 
         largest_line = max(distances) if distances else 0
 
@@ -455,22 +589,15 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
                 count_first,
                 lowest_rain_second,
                 count_second
-            ) = compute_lowest_rain_values(calc_data, intersections, r, j)
+            ) = compute_lowest_rain_values(coords_list, j)
 
             # The "longest" segment logic
             if largest_line == distances[j]:
-                coords_of_longest_lines_of_links.append(
-                    (
-                        list(intersections.values())[r][j],
-                        list(intersections.values())[r][j + 1],
-                    )
-                )
                 # If only one dataset on one side => 1 midpoint
                 if count_first == 1 or count_second == 1:
                     append_side_midpoint_side(
-                        calc_data,
-                        list(intersections.values())[r][j],      # first side
-                        list(intersections.values())[r][j + 1],  # second side
+                        coords_list[j],      # first side
+                        coords_list[j + 1],  # second side
                         lowest_rain_first,
                         lowest_rain_second,
                         long_coords_intersections,
@@ -481,27 +608,14 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
                     )
                 else:
                     # Multiple data on both sides => split into thirds
-                    first_third_long = (
-                        2 * list(intersections.values())[r][j][0]
-                        + list(intersections.values())[r][j+1][0]
-                    ) / 3
-                    first_third_lat = (
-                        2 * list(intersections.values())[r][j][1]
-                        + list(intersections.values())[r][j+1][1]
-                    ) / 3
-                    second_third_long = (
-                        list(intersections.values())[r][j][0]
-                        + 2 * list(intersections.values())[r][j+1][0]
-                    ) / 3
-                    second_third_lat = (
-                        list(intersections.values())[r][j][1]
-                        + 2 * list(intersections.values())[r][j+1][1]
-                    ) / 3
+                    first_third_long = (2 * coords_list[j][0] + coords_list[j + 1][0]) / 3
+                    first_third_lat = (2 * coords_list[j][1] + coords_list[j + 1][1]) / 3
+                    second_third_long = (coords_list[j][0] + 2 * coords_list[j + 1][0]) / 3
+                    second_third_lat = (coords_list[j][1] + 2 * coords_list[j + 1][1]) / 3
 
                     # First side
                     find_and_append_cml_reference(
-                        calc_data,
-                        list(intersections.values())[r][j],
+                        coords_list[j],
                         lowest_rain_first,
                         long_coords_intersections,
                         lat_coords_intersections,
@@ -534,8 +648,7 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
 
                     # Second side
                     find_and_append_cml_reference(
-                        calc_data,
-                        list(intersections.values())[r][j+1],
+                        coords_list[j + 1],
                         lowest_rain_second,
                         long_coords_intersections,
                         lat_coords_intersections,
@@ -548,51 +661,47 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
                 # The "shorter" segment logic
                 if count_first == 1 or count_second == 1:
                     # Just pick the side with the minimal of the two
-                    lowest_rain_value = min(lowest_rain_first, lowest_rain_second)
-                    for m in range(len(calc_data)):
-                        if lowest_rain_value == float(calc_data[m].R.mean().data):
-                            # If first side is already appended, append the second
-                            if list(intersections.values())[r][j][0] in long_coords_intersections:
-                                append_point_data(
-                                    long_coords_intersections,
-                                    list(intersections.values())[r][j+1][0],
-                                    lat_coords_intersections,
-                                    list(intersections.values())[r][j+1][1],
-                                    find_number_of_intersections,
-                                    number,
-                                    cml_references,
-                                    int(calc_data[m].cml_id.data),
-                                )
-                                break
-                            else:
-                                # Append both sides
-                                append_point_data(
-                                    long_coords_intersections,
-                                    list(intersections.values())[r][j][0],
-                                    lat_coords_intersections,
-                                    list(intersections.values())[r][j][1],
-                                    find_number_of_intersections,
-                                    number,
-                                    cml_references,
-                                    int(calc_data[m].cml_id.data),
-                                )
-                                append_point_data(
-                                    long_coords_intersections,
-                                    list(intersections.values())[r][j+1][0],
-                                    lat_coords_intersections,
-                                    list(intersections.values())[r][j+1][1],
-                                    find_number_of_intersections,
-                                    number,
-                                    cml_references,
-                                    int(calc_data[m].cml_id.data),
-                                )
-                                break
+                    m = cml_index_by_rain.get(min(lowest_rain_first, lowest_rain_second))
+                    if m is not None:
+                        # If first side is already appended, append the second
+                        if coords_list[j][0] in long_coords_intersections:
+                            append_point_data(
+                                long_coords_intersections,
+                                coords_list[j + 1][0],
+                                lat_coords_intersections,
+                                coords_list[j + 1][1],
+                                find_number_of_intersections,
+                                number,
+                                cml_references,
+                                cml_ids[m],
+                            )
+                        else:
+                            # Append both sides
+                            append_point_data(
+                                long_coords_intersections,
+                                coords_list[j][0],
+                                lat_coords_intersections,
+                                coords_list[j][1],
+                                find_number_of_intersections,
+                                number,
+                                cml_references,
+                                cml_ids[m],
+                            )
+                            append_point_data(
+                                long_coords_intersections,
+                                coords_list[j + 1][0],
+                                lat_coords_intersections,
+                                coords_list[j + 1][1],
+                                find_number_of_intersections,
+                                number,
+                                cml_references,
+                                cml_ids[m],
+                            )
                 else:
                     # multiple CMLs => place a midpoint
                     append_side_midpoint_side(
-                        calc_data,
-                        list(intersections.values())[r][j],      # first side
-                        list(intersections.values())[r][j + 1],  # second side
+                        coords_list[j],      # first side
+                        coords_list[j + 1],  # second side
                         lowest_rain_first,
                         lowest_rain_second,
                         long_coords_intersections,
@@ -618,12 +727,8 @@ def intersection_algorithm(calc_data: list[xr.Dataset], intersections: dict):
                 f"Inconsistent array lengths: {lengths}. All arrays must have the same length."
             )
 
-        # Store the resulting arrays back into the matching dataset
-        for spoj in range(len(calc_data)):
-            first_coord = list(intersections.values())[r][0]
-            last_coord  = list(intersections.values())[r][-1]
-            if cml_coords_match(calc_data[spoj], first_coord, last_coord):
-                calc_data[spoj]["segment_points"] = ("segment_points", segment_points_intersections)
-                calc_data[spoj]["long_array"] = ("segment_points", long_coords_intersections)
-                calc_data[spoj]["lat_array"] = ("segment_points", lat_coords_intersections)
-                calc_data[spoj]["cml_reference"] = ("segment_points", cml_references)
+        # Store the resulting arrays for the matching CMLs
+        for spoj in cmls_by_coords.get((coords_list[0], coords_list[-1]), []):
+            segments[cml_ids[spoj]] = (long_coords_intersections, lat_coords_intersections, cml_references)
+
+    return segments
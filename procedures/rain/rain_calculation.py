@@ -2,178 +2,198 @@ import traceback
 from typing import Any
 
 import numpy as np
-from xarray import Dataset
+from xarray import DataArray, Dataset
 
-import lib.pycomlink.pycomlink.processing as pycmlp
-from lib.pycomlink.pycomlink.processing.wet_dry import cnn
 from lib.pycomlink.pycomlink.processing.wet_dry.cnn import CNN_OUTPUT_LEFT_NANS_LENGTH
 
+from handlers import config_handler
 from handlers.logging_handler import logger
 from procedures.calculation_signals import CalcSignals
 from procedures.exceptions import RaincalcException
-from procedures.rain import temperature_compensation, temperature_correlation
-from procedures.utils.external_filter import determine_wet
+from procedures.rain import rain_parallel, temperature_compensation, temperature_correlation
+from procedures.rain.cnn_wet_dry import cnn_wet_dry_batched
+from procedures.rain.rain_stages import compute_rain_rates
+from procedures.utils.external_filter import determine_wet_batch, start_prefetch
+from procedures.utils.gap_filling import fill_gaps
+from procedures.utils.rolling_stats import rolling_std
+
+
+# compiled wet antenna attenuation kernel is used instead of pycomlink's per-link implementation
+IS_WAA_KERNEL_ENABLED = config_handler.read_option("calculation", "waa_kernel") == "True"
 
 
 def get_rain_rates(
         signals: CalcSignals,
-        calc_data: list[Dataset],
+        calc_data: Dataset,
         cp: dict[str, Any],
-        ips: list[str],
         log_run_id: str,
         results_id: int
-) -> list[Dataset]:
-    current_link = 0
-
+) -> Dataset:
+    """
+    Compute rain rates of all links in the stacked (cml_id, channel_id, time) dataset. Smoothing, TRSL, wet/dry
+    classification, baseline, WAA and k-R relation are applied on whole arrays at once.
+    """
     try:
         logger.info("[%s] Smoothing signal data...", log_run_id)
-        link_count = len(calc_data)
-        count = 0
 
-        # links stored in this list will be removed from the calculation in case of enabled correlation filtering
-        links_to_delete = []
+        times = calc_data.time.values
 
-        for link in calc_data:
-            # TODO: load upper tx power from options (here it's 40 dBm)
-            link['tsl'] = link.tsl.astype(float).where(link.tsl < 40.0)
-            link['tsl'] = link.tsl.astype(float).interpolate_na(dim='time', method='nearest', max_gap=None)
+        if cp['is_external_filter_enabled']:
+            # radar frames of the external filter are downloaded in background, while the signal data are processed
+            frames_prefetch = start_prefetch(
+                times[CNN_OUTPUT_LEFT_NANS_LENGTH:] if cp['is_cnn_enabled'] else times,
+                cp['external_filter_params']['url'],
+                not cp['is_realtime']
+            )
 
-            # TODO: load bottom rx power from options (here it's -70 dBm)
-            link['rsl'] = link.rsl.astype(float).where(link.rsl != 0.0).where(link.rsl > -70.0)
-            link['rsl'] = link.rsl.astype(float).interpolate_na(dim='time', method='nearest', max_gap=None)
+        # TODO: load upper tx power from options (here it's 40 dBm)
+        tsl = calc_data.tsl.values.astype(float)
+        tsl[~(tsl < 40.0)] = np.nan
+        calc_data['tsl'] = (calc_data.tsl.dims, fill_gaps(tsl, method='nearest', x=times))
 
-            link['trsl'] = link.tsl - link.rsl
+        # TODO: load bottom rx power from options (here it's -70 dBm)
+        rsl = calc_data.rsl.values.astype(float)
+        rsl[~((rsl != 0.0) & (rsl > -70.0))] = np.nan
+        calc_data['rsl'] = (calc_data.rsl.dims, fill_gaps(rsl, method='nearest', x=times))
 
-            link['temperature_rx'] = link.temperature_rx.astype(float).interpolate_na(
-                dim='time', method='linear', max_gap=None
-            )
+        calc_data['trsl'] = calc_data.tsl - calc_data.rsl
 
-            link['temperature_tx'] = link.temperature_tx.astype(float).interpolate_na(
-                dim='time', method='linear', max_gap=None
-            )
+        calc_data['temperature_rx'] = (
+            calc_data.temperature_rx.dims,
+            fill_gaps(calc_data.temperature_rx.values, method='linear', x=times)
+        )
 
-            signals.progress_signal.emit({'prg_val': round((current_link / link_count) * 15) + 35})
-            current_link += 1
-            count += 1
+        calc_data['temperature_tx'] = (
+            calc_data.temperature_tx.dims,
+            fill_gaps(calc_data.temperature_tx.values, method='linear', x=times)
+        )
 
-            """
-            # temperature_correlation  - remove links if the correlation exceeds the specified threshold
-            # temperature_compensation - as correlation, but also replaces the original trsl with the corrected one,
-                                         according to the custom temperature compensation algorithm
-            """
+        signals.progress_signal.emit({'prg_val': 45})
 
+        """
+        # temperature_correlation  - remove links if the correlation exceeds the specified threshold
+        # temperature_compensation - as correlation, but also replaces the original trsl with the corrected one,
+                                     according to the custom temperature compensation algorithm
+        """
+        if cp['is_temp_filtered'] or cp['is_temp_compensated']:
             if cp['is_temp_filtered']:
                 logger.info("[%s] Remove-link procedure started.", log_run_id)
-                temperature_correlation.pearson_correlation(
-                    count=count,
-                    ips=ips,
-                    curr_link=current_link,
-                    link_todelete=links_to_delete,
-                    link=link,
+            if cp['is_temp_compensated']:
+                logger.info("[%s] Compensation algorithm procedure started.", log_run_id)
+
+            # correlations and regression slopes of TRSL and temperature of all links and channels at once
+            correlations, slopes = temperature_correlation.correlation_and_slope(
+                calc_data.temperature_tx.transpose('cml_id', 'channel_id', 'time').values,
+                calc_data.trsl.transpose('cml_id', 'channel_id', 'time').values
+            )
+
+            # only links marked in this mask will be kept in the calculation in case of enabled correlation filtering
+            links_to_keep = np.ones(calc_data.sizes['cml_id'], dtype=bool)
+
+            if cp['is_temp_filtered']:
+                links_to_keep = ~temperature_correlation.pearson_correlation(
+                    correlations=correlations,
+                    cml_ids=calc_data.cml_id.values,
+                    ips_a=calc_data.ip_a.values,
+                    ips_b=calc_data.ip_b.values,
                     spin_correlation=cp['correlation_threshold']
                 )
 
             if cp['is_temp_compensated']:
-                logger.info("[%s] Compensation algorithm procedure started.", log_run_id)
-                temperature_compensation.compensation(
-                    count=count,
-                    ips=ips,
-                    curr_link=current_link,
-                    link=link,
+                trsl = temperature_compensation.compensation(
+                    trsl=calc_data.trsl.transpose('cml_id', 'channel_id', 'time').values,
+                    temperature_tx=calc_data.temperature_tx.transpose('cml_id', 'channel_id', 'time').values,
+                    correlations=correlations,
+                    slopes=slopes,
+                    cml_ids=calc_data.cml_id.values,
+                    ips_a=calc_data.ip_a.values,
+                    ips_b=calc_data.ip_b.values,
                     spin_correlation=cp['correlation_threshold']
                 )
+                calc_data['trsl'] = (('cml_id', 'channel_id', 'time'), trsl)
 
-            """
-            'current_link += 1' serves to accurately list the 'count' and ip address of CML unit
-             when the 'temperature_compensation.py' or 'temperature_correlation.py' is called
-            """
-            current_link += 1
+            # Run the removal of high correlation links in case of enabled filtering, dataset is rebuilt only once
+            if not links_to_keep.all():
+                logger.info(
+                    "[%s] Removing %d of %d links due to high correlation with temperature.",
+                    log_run_id, np.count_nonzero(~links_to_keep), len(links_to_keep)
+                )
+                calc_data = calc_data.isel(cml_id=links_to_keep)
 
-        # Run the removal of high correlation links in case of enabled filtering
-        for link in links_to_delete:
-            calc_data.remove(link)
+        signals.progress_signal.emit({'prg_val': 50})
 
-        # process each link -> get intensity R value for each link:
+        # get intensity R value for all links
         logger.info("[%s] Computing rain values...", log_run_id)
-        current_link = 0
-
-        for link in calc_data:
-            if cp['is_cnn_enabled']:
-                # determine wet periods using CNN
-                link['wet'] = (('time',), np.zeros([link.time.size]))
-
-                cnn_out = cnn.cnn_wet_dry(
-                    trsl_channel_1=link.isel(channel_id=0).trsl.values,
-                    trsl_channel_2=link.isel(channel_id=1).trsl.values,
-                    threshold=0.82,
-                    batch_size=128
-                )
-
-                link['wet'] = (('time',), np.where(np.isnan(cnn_out), link['wet'], cnn_out))
-            else:
-                # determine wet periods using rolling standard deviation
-                link['wet'] = link.trsl.rolling(
-                    time=cp['rolling_values'],
-                    center=cp['is_window_centered']
-                ).std(skipna=False) > cp['wet_dry_deviation']
 
         if cp['is_cnn_enabled']:
+            # determine wet periods using CNN, all links are processed in batches at once
+            cnn_out = cnn_wet_dry_batched(
+                trsl=calc_data.trsl.transpose('cml_id', 'channel_id', 'time').values,
+                threshold=0.82
+            )
+            calc_data['wet'] = (('cml_id', 'time'), np.where(np.isnan(cnn_out), 0.0, cnn_out))
+
             # remove first CNN_OUTPUT_LEFT_NANS_LENGTH time values from dataset since they are NaNs
-            calc_data = [link.isel(time=slice(CNN_OUTPUT_LEFT_NANS_LENGTH, None)) for link in calc_data]
+            calc_data = calc_data.isel(time=slice(CNN_OUTPUT_LEFT_NANS_LENGTH, None))
+        else:
+            # determine wet periods using rolling standard deviation, all links and channels at once
+            trsl = calc_data.trsl.transpose(..., 'time')
+            calc_data['wet'] = (
+                trsl.dims,
+                rolling_std(trsl.values, window=cp['rolling_values'], center=cp['is_window_centered'])
+                > cp['wet_dry_deviation']
+            )
+
+        signals.progress_signal.emit({'prg_val': 65})
 
         if cp['is_external_filter_enabled']:
             efp = cp['external_filter_params']
-            for link in calc_data:
-                # central points of the links are sent into external filter
-                link['lat_center'] = (link.site_a_latitude + link.site_b_latitude) / 2
-                link['lon_center'] = (link.site_a_longitude + link.site_b_longitude) / 2
-
-                for t in range(len(link.time)):
-                    time = link.time[t].values
-                    external_wet = determine_wet(
-                        time,
-                        link.lon_center,
-                        link.lat_center,
-                        efp['radius'] + link.length / 2,
-                        efp['pixel_threshold'],
-                        efp['IMG_X_MIN'],
-                        efp['IMG_X_MAX'],
-                        efp['IMG_Y_MIN'],
-                        efp['IMG_Y_MAX'],
-                        efp['url'],
-                        efp['default_return'],
-                        not cp['is_realtime']
-                    )
-                    internal_wet = link.wet[t].values
-                    link.wet[t] = external_wet and internal_wet
-                    logger.debug(
-                        "[%s] [EXTERNAL FILTER] CML: %d, time: %s, EXWET: %s && INTWET: %s = %s",
-                        log_run_id, link.cml_id.values, time, external_wet, internal_wet, link.wet[t].values
-                    )
-
-        for link in calc_data:
-            # calculate ratio of wet periods
-            link['wet_fraction'] = (link.wet == 1).sum() / len(link.time)
-
-            # determine signal baseline
-            link['baseline'] = pycmlp.baseline.baseline_constant(trsl=link.trsl, wet=link.wet,
-                                                                 n_average_last_dry=cp['baseline_samples'])
-
-            # calculate wet antenna attenuation
-            link['waa'] = pycmlp.wet_antenna.waa_schleiss_2013(rsl=link.trsl, baseline=link.baseline, wet=link.wet,
-                                                               waa_max=cp['waa_schleiss_val'],
-                                                               delta_t=60 / ((60 / cp['step']) * 60),
-                                                               tau=cp['waa_schleiss_tau'])
-
-            # calculate final rain attenuation
-            link['A'] = link.trsl - link.baseline - link.waa
-
-            # calculate rain intensity
-            link['R'] = pycmlp.k_R_relation.calc_R_from_A(A=link.A, L_km=float(link.length),
-                                                          f_GHz=link.frequency, pol=link.polarization)
-
-            signals.progress_signal.emit({'prg_val': round((current_link / link_count) * 40) + 50})
-            current_link += 1
+
+            # central points of the links are sent into external filter
+            calc_data['lat_center'] = (calc_data.site_a_latitude + calc_data.site_b_latitude) / 2
+            calc_data['lon_center'] = (calc_data.site_a_longitude + calc_data.site_b_longitude) / 2
+
+            logger.debug(
+                "[%s] [EXTERNAL FILTER] %d radar frames prefetched.", log_run_id, frames_prefetch.result()
+            )
+
+            # external filter states of all links and times at once, shape (cml_id, time)
+            external_wet = determine_wet_batch(
+                calc_data.time.values,
+                calc_data.lon_center.values,
+                calc_data.lat_center.values,
+                efp['radius'] + calc_data.length.values / 2,
+                efp['pixel_threshold'],
+                efp['IMG_X_MIN'],
+                efp['IMG_X_MAX'],
+                efp['IMG_Y_MIN'],
+                efp['IMG_Y_MAX'],
+                efp['url'],
+                efp['default_return'],
+                not cp['is_realtime']
+            )
+
+            # wet can have channel_id dimension (in case of rolling std), external filter is applied along time axis
+            internal_wet_count = np.count_nonzero(calc_data.wet.values)
+            calc_data['wet'] = calc_data.wet.where(DataArray(external_wet, dims=('cml_id', 'time')), False)
+            logger.debug(
+                "[%s] [EXTERNAL FILTER] %d of %d internally wet samples confirmed by external filter.",
+                log_run_id, np.count_nonzero(calc_data.wet.values), internal_wet_count
+            )
+
+        # calculate ratio of wet periods
+        calc_data['wet_fraction'] = (calc_data.wet == 1).sum(
+            dim=[dim for dim in calc_data.wet.dims if dim != 'cml_id']
+        ) / calc_data.sizes['time']
+
+        # baseline, wet antenna attenuation, rain attenuation and rain intensity are independent for each link,
+        # they can be computed in chunks of links by worker processes
+        if rain_parallel.is_enabled():
+            calc_data = rain_parallel.compute_rain_rates_parallel(calc_data, cp, IS_WAA_KERNEL_ENABLED, log_run_id)
+        else:
+            calc_data = compute_rain_rates(calc_data, cp, IS_WAA_KERNEL_ENABLED)
+
+        signals.progress_signal.emit({'prg_val': 90})
 
         return calc_data
 
@@ -182,9 +202,9 @@ def get_rain_rates(
 
         logger.error(
             "[%s] An unexpected error occurred during rain calculation: %s %s.\n"
-            "Last processed microwave link dataset:\n%s\n"
+            "Processed microwave links dataset:\n%s\n"
             "Calculation thread terminated.",
-            log_run_id, type(error), error, calc_data[current_link]
+            log_run_id, type(error), error, calc_data
         )
 
         traceback.print_exc()
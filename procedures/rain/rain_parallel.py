@@ -0,0 +1,134 @@
+"""Module containing optional process pool executor of the rain rate stages."""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import Lock
+from typing import Any, Optional
+
+import numpy as np
+from xarray import Dataset
+
+from handlers import config_handler
+from handlers.logging_handler import logger
+from procedures.rain.rain_stages import compute_rain_rates_chunk, RAIN_RATE_VARS
+
+
+# number of worker processes (0 or 1 = rain rates are computed in the calculation thread)
+WORKERS = int(config_handler.read_option("calculation", "workers"))
+# number of links in one chunk processed by one worker task
+CHUNK_LINKS = int(config_handler.read_option("calculation", "chunk_links"))
+
+# persistent process pool, created on the first use and shared by all calculations
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = Lock()
+
+
+def is_enabled() -> bool:
+    return WORKERS > 1
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn context: forking of the multithreaded Qt application is not safe
+            _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _to_shared(array: np.ndarray, blocks: list[shared_memory.SharedMemory]) -> (np.ndarray, tuple):
+    """
+    Allocate shared memory block for the array and copy the array into it.
+
+    :param array: array to be shared
+    :param blocks: list of allocated blocks, new block is appended (for later release)
+    :return: tuple of (array view into the shared memory, shared buffer description)
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return shared, (block.name, array.shape, array.dtype.str)
+
+
+def compute_rain_rates_parallel(
+        calc_data: Dataset,
+        cp: dict[str, Any],
+        is_waa_kernel_enabled: bool,
+        log_run_id: str
+) -> Dataset:
+    """
+    Compute rain rate stages (baseline, WAA, A, R) in chunks of links in worker processes. Input and output arrays are
+    passed via shared memory, results are merged in the order of the links.
+
+    :param calc_data: dataset with 'trsl' and 'wet' variables and link coordinates (length, frequency, polarization)
+    :param cp: calculation parameters
+    :param is_waa_kernel_enabled: if True, compiled WAA kernel is used instead of pycomlink's implementation
+    :param log_run_id: ID of the calculation run for logging
+    :return: the same dataset with added 'baseline', 'waa', 'A' and 'R' variables
+    """
+    dims = ("cml_id", "channel_id", "time")
+    trsl = calc_data.trsl.transpose(*dims).values
+    wet = calc_data.wet.transpose("cml_id", ..., "time")
+    cmls_count = trsl.shape[0]
+
+    chunk_size = CHUNK_LINKS if CHUNK_LINKS > 0 else max(-(-cmls_count // WORKERS), 1)
+    chunks = [(start, min(start + chunk_size, cmls_count)) for start in range(0, cmls_count, chunk_size)]
+
+    logger.debug(
+        "[%s] Computing rain rates of %d links in %d chunks using %d worker processes...",
+        log_run_id, cmls_count, len(chunks), WORKERS
+    )
+
+    cp_stages = {key: cp[key] for key in ("baseline_samples", "waa_schleiss_val", "step", "waa_schleiss_tau")}
+    length = calc_data.length.values
+    frequency = calc_data.frequency.transpose("cml_id", "channel_id").values
+    polarization = calc_data.polarization.values
+
+    blocks: list[shared_memory.SharedMemory] = []
+    out = None
+    try:
+        _, trsl_buffer = _to_shared(trsl, blocks)
+        _, wet_buffer = _to_shared(wet.values, blocks)
+        out, out_buffer = _to_shared(np.full((len(RAIN_RATE_VARS),) + trsl.shape, np.nan), blocks)
+
+        executor = _get_executor()
+        futures = [
+            executor.submit(
+                compute_rain_rates_chunk, trsl_buffer, wet_buffer, wet.dims, out_buffer, start, stop,
+                length[start:stop], frequency[start:stop], polarization[start:stop], cp_stages,
+                is_waa_kernel_enabled
+            )
+            for start, stop in chunks
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except BrokenProcessPool:
+            # worker process died, pool cannot be used anymore
+            _reset_executor()
+            raise
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        for i, var in enumerate(RAIN_RATE_VARS):
+            calc_data[var] = (dims, out[i].copy())
+    finally:
+        # views into shared memory have to be released before closing the blocks
+        del out
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return calc_data
@@ -0,0 +1,137 @@
+"""
+Module containing rain rate stages of the calculation, which are independent for each link. Module is imported by
+worker processes of the parallel executor, so it does not import Qt, database or config modules. Only pycomlink's
+baseline and wet antenna submodules are used, but importing them runs pycomlink's package imports (including its wet/dry
+and validation modules), which take most of a worker's start-up time (see benchmarks/bench_rain_pipeline.py).
+"""
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+from xarray import Dataset
+
+from lib.pycomlink.pycomlink.processing import baseline as pycml_baseline
+from lib.pycomlink.pycomlink.processing import wet_antenna as pycml_wet_antenna
+
+from procedures.rain import wet_antenna
+from procedures.rain.k_r_relation import calc_R_from_A, k_r_table
+
+
+# shared memory buffer description: (name of the shared memory block, shape, dtype)
+SharedBuffer = tuple[str, tuple[int, ...], str]
+
+# variables computed by the rain rate stages, in order of the output buffer
+RAIN_RATE_VARS = ("baseline", "waa", "A", "R")
+
+
+def compute_rain_rates(calc_data: Dataset, cp: dict[str, Any], is_waa_kernel_enabled: bool = False) -> Dataset:
+    """
+    Compute signal baseline, wet antenna attenuation, rain attenuation and rain intensity. Links are processed
+    independently, so the dataset can contain any subset (chunk) of links.
+
+    :param calc_data: dataset with 'trsl' and 'wet' variables and link coordinates (length, frequency, polarization)
+    :param cp: calculation parameters
+    :param is_waa_kernel_enabled: if True, compiled WAA kernel is used instead of pycomlink's implementation
+    :return: the same dataset with added 'baseline', 'waa', 'A' and 'R' variables
+    """
+    # determine signal baseline
+    calc_data['baseline'] = pycml_baseline.baseline_constant(trsl=calc_data.trsl, wet=calc_data.wet,
+                                                             n_average_last_dry=cp['baseline_samples'])
+
+    # calculate wet antenna attenuation
+    if is_waa_kernel_enabled:
+        # all links and channels at once, wet/dry states are broadcast to channels (if they are per link only)
+        attenuation = (calc_data.trsl - calc_data.baseline).transpose(..., 'time')
+        calc_data['waa'] = (attenuation.dims, wet_antenna.waa_schleiss_2013(
+            A=attenuation.values,
+            wet=calc_data.wet.broadcast_like(attenuation).transpose(*attenuation.dims).values,
+            waa_max=cp['waa_schleiss_val'],
+            delta_t=60 / ((60 / cp['step']) * 60),
+            tau=cp['waa_schleiss_tau']
+        ))
+    else:
+        calc_data['waa'] = pycml_wet_antenna.waa_schleiss_2013(rsl=calc_data.trsl, baseline=calc_data.baseline,
+                                                               wet=calc_data.wet, waa_max=cp['waa_schleiss_val'],
+                                                               delta_t=60 / ((60 / cp['step']) * 60),
+                                                               tau=cp['waa_schleiss_tau'])
+
+    # calculate final rain attenuation
+    calc_data['A'] = calc_data.trsl - calc_data.baseline - calc_data.waa
+
+    # calculate rain intensity, k-R coefficients are looked up for all links and channels at once
+    attenuation = calc_data.A.transpose('cml_id', 'channel_id', 'time')
+    a, b = k_r_table.get_coefficients(
+        calc_data.frequency.transpose('cml_id', 'channel_id').values,
+        calc_data.polarization.values[:, np.newaxis]
+    )
+    calc_data['R'] = (attenuation.dims, calc_R_from_A(
+        A=attenuation.values,
+        L_km=calc_data.length.values[:, np.newaxis, np.newaxis],
+        a=a[..., np.newaxis],
+        b=b[..., np.newaxis]
+    ))
+
+    return calc_data
+
+
+def compute_rain_rates_chunk(
+        trsl_buffer: SharedBuffer,
+        wet_buffer: SharedBuffer,
+        wet_dims: tuple[str, ...],
+        out_buffer: SharedBuffer,
+        start: int,
+        stop: int,
+        length: np.ndarray,
+        frequency: np.ndarray,
+        polarization: np.ndarray,
+        cp: dict[str, Any],
+        is_waa_kernel_enabled: bool
+) -> (int, int):
+    """
+    Compute rain rates of the chunk of links [start, stop) in worker process. Inputs are read from shared memory
+    buffers and outputs are written into the chunk's slice of the shared output buffer, so results of all chunks are
+    merged in the order of the links, regardless of the order of chunks' completion.
+
+    :param trsl_buffer: shared buffer of TRSL with shape (cml_id, channel_id, time)
+    :param wet_buffer: shared buffer of wet/dry states with dimensions 'wet_dims'
+    :param wet_dims: dimensions of the wet/dry states, (cml_id, time) or (cml_id, channel_id, time)
+    :param out_buffer: shared output buffer with shape (len(RAIN_RATE_VARS), cml_id, channel_id, time)
+    :param start: index of the first link of the chunk
+    :param stop: index after the last link of the chunk
+    :param length: lengths of the chunk's links
+    :param frequency: frequencies of the chunk's links with shape (cml_id, channel_id)
+    :param polarization: polarizations of the chunk's links
+    :param cp: calculation parameters
+    :param is_waa_kernel_enabled: if True, compiled WAA kernel is used instead of pycomlink's implementation
+    :return: tuple (start, stop) of the processed chunk
+    """
+    blocks = [shared_memory.SharedMemory(name=buffer[0]) for buffer in (trsl_buffer, wet_buffer, out_buffer)]
+    try:
+        trsl, wet, out = [
+            np.ndarray(buffer[1], dtype=buffer[2], buffer=block.buf)
+            for buffer, block in zip((trsl_buffer, wet_buffer, out_buffer), blocks)
+        ]
+
+        chunk = Dataset(
+            data_vars={
+                "trsl": (("cml_id", "channel_id", "time"), trsl[start:stop]),
+                "wet": (wet_dims, wet[start:stop]),
+            },
+            coords={
+                "length": ("cml_id", length),
+                "frequency": (("cml_id", "channel_id"), frequency),
+                "polarization": ("cml_id", polarization),
+            },
+        )
+        chunk = compute_rain_rates(chunk, cp, is_waa_kernel_enabled)
+
+        for i, var in enumerate(RAIN_RATE_VARS):
+            out[i, start:stop] = chunk[var].transpose("cml_id", "channel_id", "time").values
+
+        # views into shared memory have to be released before closing the blocks
+        del trsl, wet, out, chunk
+    finally:
+        for block in blocks:
+            block.close()
+
+    return start, stop
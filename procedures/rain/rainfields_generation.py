@@ -14,7 +14,7 @@ from procedures.rain.links_segmentation import process_segments
 
 def generate_rainfields(
         signals: CalcSignals,
-        calc_data: list[xr.Dataset],
+        calc_data: xr.Dataset,
         cp: dict[str, Any],
         rain_grids: list[np.ndarray],
         realtime_runs: int,
@@ -28,7 +28,7 @@ def generate_rainfields(
         # *************************************************************************************************
 
         logger.info("[%s] Processing links segmentation...", log_run_id)
-        process_segments(
+        segment_table = process_segments(
             calc_data=calc_data,
             segment_size=cp["segment_size"],
             is_central_enabled=cp["is_central_points_enabled"],
@@ -42,8 +42,6 @@ def generate_rainfields(
 
         logger.info("[%s] Resampling rain values for rainfall overall map...", log_run_id)
 
-        # combine CMLs into one dataset
-        calc_data = xr.concat(calc_data, dim='cml_id')
         # calculate 1h means via resample
         rain_values_1h = calc_data.R.resample(time='1H', label='right').mean()
         # sum of all 1h means = total
@@ -65,16 +63,10 @@ def generate_rainfields(
         y_coords = np.arange(cp['Y_MIN'], cp['Y_MAX'], cp['interpol_res'])
         x_grid, y_grid = np.meshgrid(x_coords, y_coords)
 
-        # flatten coordinates of the CMLs into 1D arrays
-        lats_1dim = calc_data.lat_array.values.flatten()
-        lats_1dim = lats_1dim[~np.isnan(lats_1dim)] # remove NaN values
-        longs_1dim = calc_data.long_array.values.flatten()
-        longs_1dim = longs_1dim[~np.isnan(longs_1dim)] # remove NaN values
-
-        # get segments CML references
-        seg_references = calc_data['cml_reference'].values.flatten() # flatten the 'cml_reference' to a 1D array
-        seg_valid_mask = ~np.isnan(seg_references) # create a boolean mask where 'cml_reference' is not NaN
-        seg_valid_refs = seg_references[seg_valid_mask].astype(int) # apply the mask to get only valid references
+        # coordinates and CML references of the segment points of all CMLs
+        longs_1dim = segment_table.longs.astype(float)
+        lats_1dim = segment_table.lats.astype(float)
+        seg_valid_refs = segment_table.cml_references
 
         # assign rain values to the segments according to their CML references
         rain_vals = rain_values_total.sel(cml_id=seg_valid_refs).values # select all corresponding rain values at once
@@ -1,60 +1,49 @@
 import numpy as np
-import pandas as pd
 
 from handlers.logging_handler import logger
-
-def compensation(count, ips, curr_link, link, spin_correlation):
-
-    # spin_correlation is the set value of the correlation from which the compensation algorithm is performed
-
-    # Defining variables to work with
-    trsl_orig = np.array(link['trsl'])
-    temperature_tx = np.array(link['temperature_tx'])
+from procedures.rain.temperature_correlation import is_correlated
+
+
+def compensation(
+        trsl: np.ndarray,
+        temperature_tx: np.ndarray,
+        correlations: np.ndarray,
+        slopes: np.ndarray,
+        cml_ids: np.ndarray,
+        ips_a: np.ndarray,
+        ips_b: np.ndarray,
+        spin_correlation: float
+) -> np.ndarray:
+    """
+    Compensate TRSL of links with high correlation of TRSL and transmitter temperature, all links at once. Above the
+    fixed temperature, TRSL is corrected by the slope of linear regression of TRSL on temperature.
+
+    :param trsl: 3D array of TRSL with shape (cml_id, channel_id, time)
+    :param temperature_tx: 3D array of transmitter temperatures with shape (cml_id, channel_id, time)
+    :param correlations: 2D array of correlations of TRSL and temperature_tx with shape (cml_id, channel_id)
+    :param slopes: 2D array of regression slopes of TRSL on temperature_tx with shape (cml_id, channel_id)
+    :param cml_ids: IDs of the links
+    :param ips_a: IPs of the units A of the links
+    :param ips_b: IPs of the units B of the links
+    :param spin_correlation: set value of the correlation from which the compensation algorithm is performed
+    :return: 3D array of compensated TRSL with shape (cml_id, channel_id, time)
+    """
     fixed_temperature = 21
 
-    b_trsl_array = trsl_orig[0]
-    b_temptx_array = temperature_tx[0]
-
-    a_trsl_array = trsl_orig[1]
-    a_temptx_array = temperature_tx[1]
-
-    # Calculation of the Pearson correlation index for side A
-    pcctrsl_a = pd.Series(b_trsl_array).corr(pd.Series(b_temptx_array))
-    # logger.debug(
-    #     "Correlation 'A(rx)_B(tx)' for link %d IP: %s %.3f",
-    #     count, ips[curr_link - 1], pcctrsl_a
-    # )
-
-    # Calculation of the Pearson correlation index for side B
-    pcctrsl_b = pd.Series(a_trsl_array).corr(pd.Series(a_temptx_array))
-    # logger.debug(
-    #     "Correlation 'B(rx)_A(tx)' for link %d IP: %s %.3f",
-    #     count, ips[curr_link], pcctrsl_b
-    # )
-
-    if not (np.isnan(pcctrsl_a) or np.isnan(pcctrsl_b)):
-        if ((pcctrsl_a >= spin_correlation) or (pcctrsl_a <= -spin_correlation)) \
-                or ((pcctrsl_b >= spin_correlation) or (pcctrsl_b <= -spin_correlation)):
-            logger.debug(
-                "Temperature compensated link - Number: %d for IP_A: %s and IP_B: %s; "
-                "Correlation: IP_A %.3f and IP_B %.3f",
-                count, ips[curr_link - 1], ips[curr_link], pcctrsl_a, pcctrsl_b
-            )
-            coeficient_ab, bb = np.polyfit(b_temptx_array, b_trsl_array, 1)
-
-            trsl_corig_b = trsl_orig[0] - coeficient_ab * (temperature_tx[0] - fixed_temperature)
-            trsl_compensated_b = np.where(temperature_tx[0] < fixed_temperature, trsl_orig[0], trsl_corig_b)
-
-            trsl_orig[0] = trsl_compensated_b
+    to_compensate = is_correlated(correlations, spin_correlation)
 
-            coeficient_ba, bb = np.polyfit(a_temptx_array, a_trsl_array, 1)
+    for i in np.flatnonzero(to_compensate):
+        logger.debug(
+            "Temperature compensated link - ID: %d for IP_A: %s and IP_B: %s; "
+            "Correlation: IP_A %.3f and IP_B %.3f",
+            cml_ids[i], ips_a[i], ips_b[i], *correlations[i]
+        )
 
-            trsl_corig_a = trsl_orig[1] - coeficient_ba * (temperature_tx[1] - fixed_temperature)
-            trsl_compensated_a = np.where(temperature_tx[1] < fixed_temperature, trsl_orig[1], trsl_corig_a)
+    trsl_compensated = np.array(trsl, dtype=float)
+    trsl_orig = trsl_compensated[to_compensate]
+    temperature = np.asarray(temperature_tx)[to_compensate]
 
-            trsl_orig[1] = trsl_compensated_a
+    trsl_corrected = trsl_orig - slopes[to_compensate][..., np.newaxis] * (temperature - fixed_temperature)
+    trsl_compensated[to_compensate] = np.where(temperature < fixed_temperature, trsl_orig, trsl_corrected)
 
-            # Saving corrected values to link['trsl']
-            link['trsl'] = (["channel_id", "time"], trsl_orig)
-    else:
-        pass
+    return trsl_compensated
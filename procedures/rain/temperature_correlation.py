@@ -1,45 +1,86 @@
 import numpy as np
-import pandas as pd
 
 from handlers.logging_handler import logger
 
 
-def pearson_correlation(count, ips, curr_link, link_todelete, link, spin_correlation):
+def correlation_and_slope(x: np.ndarray, y: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Compute Pearson correlation coefficients and slopes of linear regression of 'y' on 'x' along the last axis, for
+    all timeseries at once. Only pairs with both values present are used (same as pandas' 'Series.corr'), the slope is
+    the same as the slope of 'np.polyfit(x, y, 1)' fitted on these pairs.
 
-    # spin_correlation is the set value of the correlation from which the compensation algorithm is performed
+    :param x: N-D array of values, the last axis is the time axis
+    :param y: N-D array of values with the same shape as 'x'
+    :return: tuple of (N-1)-D arrays (correlation coefficients, slopes), NaN where not defined
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
 
-    # Defining variables to work with
-    trsl = link['trsl']
-    temperature_tx = np.array(link['temperature_tx'])
+    is_valid = ~(np.isnan(x) | np.isnan(y))
+    count = is_valid.sum(axis=-1)
 
-    b_trsl_array = trsl[0]
-    b_temptx_array = temperature_tx[0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(is_valid, x, 0.0).sum(axis=-1) / count
+        mean_y = np.where(is_valid, y, 0.0).sum(axis=-1) / count
 
-    a_trsl_array = trsl[1]
-    a_temptx_array = temperature_tx[1]
+        # deviations from the means, missing pairs do not contribute
+        dev_x = np.where(is_valid, x - mean_x[..., np.newaxis], 0.0)
+        dev_y = np.where(is_valid, y - mean_y[..., np.newaxis], 0.0)
 
-    # Calculation of the Pearson correlation index for side A
-    pcctrsl_a = pd.Series(b_trsl_array).corr(pd.Series(b_temptx_array))
-    logger.debug(
-        "Correlation 'A(rx)_B(tx)' for link %d IP: %s %.3f",
-        count, ips[curr_link - 1], pcctrsl_a
-    )
+        covariance = (dev_x * dev_y).sum(axis=-1)
+        variance_x = (dev_x * dev_x).sum(axis=-1)
+        variance_y = (dev_y * dev_y).sum(axis=-1)
 
-    # Calculation of the Pearson correlation index for side B
-    pcctrsl_b = pd.Series(a_trsl_array).corr(pd.Series(a_temptx_array))
-    logger.debug(
-        "Correlation 'B(rx)_A(tx)' for link %d IP: %s %.3f",
-        count, ips[curr_link], pcctrsl_b
-    )
+        correlation = np.clip(covariance / np.sqrt(variance_x * variance_y), -1.0, 1.0)
+        slope = covariance / variance_x
 
-    if not (np.isnan(pcctrsl_a) or np.isnan(pcctrsl_b)):
-        if ((pcctrsl_a >= spin_correlation) or (pcctrsl_a <= -spin_correlation)) \
-                or ((pcctrsl_b >= spin_correlation) or (pcctrsl_b <= -spin_correlation)):
+    correlation[(count < 2) | (variance_x == 0) | (variance_y == 0)] = np.nan
+    slope[(count < 2) | (variance_x == 0)] = np.nan
+
+    return correlation, slope
+
+
+def is_correlated(correlations: np.ndarray, spin_correlation: float) -> np.ndarray:
+    """
+    Find links with high correlation of TRSL and temperature. Correlations of both channels have to be defined and
+    at least one of them has to exceed the threshold.
+
+    :param correlations: 2D array of correlations with shape (cml_id, channel_id)
+    :param spin_correlation: correlation threshold
+    :return: 1D bool array, True for highly correlated links
+    """
+    is_defined = ~np.isnan(correlations).any(axis=1)
+    return is_defined & ((correlations >= spin_correlation) | (correlations <= -spin_correlation)).any(axis=1)
+
+
+def pearson_correlation(
+        correlations: np.ndarray,
+        cml_ids: np.ndarray,
+        ips_a: np.ndarray,
+        ips_b: np.ndarray,
+        spin_correlation: float
+) -> np.ndarray:
+    """
+    Determine links to be removed due to high correlation of TRSL and transmitter temperature.
+
+    :param correlations: 2D array of correlations of TRSL and temperature_tx with shape (cml_id, channel_id)
+    :param cml_ids: IDs of the links
+    :param ips_a: IPs of the units A of the links
+    :param ips_b: IPs of the units B of the links
+    :param spin_correlation: set value of the correlation from which the link is removed
+    :return: 1D bool array, True for links to be removed
+    """
+    to_delete = is_correlated(correlations, spin_correlation)
+
+    for cml_id, ip_a, ip_b, (pcctrsl_a, pcctrsl_b), is_deleted in zip(cml_ids, ips_a, ips_b, correlations, to_delete):
+        logger.debug("Correlation 'A(rx)_B(tx)' for link ID: %d IP: %s %.3f", cml_id, ip_a, pcctrsl_a)
+        logger.debug("Correlation 'B(rx)_A(tx)' for link ID: %d IP: %s %.3f", cml_id, ip_b, pcctrsl_b)
+
+        if is_deleted:
             logger.debug(
-                "Removed link due to high correlation - Number: %d for IP_A: %s and IP_B: %s;"
+                "Removed link due to high correlation - ID: %d for IP_A: %s and IP_B: %s; "
                 "Correlation: IP_A %.3f and IP_B %.3f",
-                count, ips[curr_link - 1], ips[curr_link], pcctrsl_a, pcctrsl_b
+                cml_id, ip_a, ip_b, pcctrsl_a, pcctrsl_b
             )
-            link_todelete.append(link)
-    else:
-        pass
+
+    return to_delete
@@ -0,0 +1,49 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _waa_schleiss_2013_kernel(A, wet, waa_max, delta_t, tau):
+    rows, length = A.shape
+    waa = np.zeros((rows, length), dtype=np.float64)
+
+    for row in range(rows):
+        for i in range(1, length):
+            # same evaluation as Python's min() in pycomlink: candidate is taken only if it is smaller (NaNs are
+            # never taken, unless they are the first argument)
+            value = A[row, i]
+            if waa_max < value:
+                value = waa_max
+            if wet[row, i] == 1.0:
+                recurrent = waa[row, i - 1] + (waa_max - waa[row, i - 1]) * 3 * delta_t / tau
+                if recurrent < value:
+                    value = recurrent
+            waa[row, i] = value
+
+    return waa
+
+
+def waa_schleiss_2013(A: np.ndarray, wet: np.ndarray, waa_max: float, delta_t: float, tau: float) -> np.ndarray:
+    """
+    Compiled version of pycomlink's 'waa_schleiss_2013' wet antenna attenuation model, evaluated over all timeseries
+    (e.g. CML channels) at once. Results are identical to pycomlink's implementation evaluated per timeseries.
+
+    :param A: N-D array of attenuation (rsl - baseline), the last axis is the time axis
+    :param wet: N-D array of wet (True or 1) / dry states with the same shape as 'A'
+    :param waa_max: maximum value of wet antenna attenuation
+    :param delta_t: time step of the timeseries
+    :param tau: time constant of the wet antenna attenuation increase (in the same unit as 'delta_t')
+    :return: N-D array of wet antenna attenuation with the same shape as 'A'
+    """
+    A = np.asarray(A, dtype=np.float64)
+    length = A.shape[-1]
+
+    waa = _waa_schleiss_2013_kernel(
+        np.ascontiguousarray(A.reshape((-1, length))),
+        np.ascontiguousarray(np.asarray(wet, dtype=np.float64).reshape((-1, length))),
+        float(waa_max),
+        float(delta_t),
+        float(tau)
+    )
+
+    return waa.reshape(A.shape)
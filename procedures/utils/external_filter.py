@@ -1,14 +1,17 @@
-import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
-import os
 from PIL import Image
+from threading import Lock
 from typing import cast, Iterable, Optional
 
 import numpy as np
 import requests
-from scipy.ndimage import label
+from requests.adapters import HTTPAdapter
+from scipy.ndimage import distance_transform_edt, label
 
 from handlers import config_handler
+from handlers.logging_handler import logger
+from procedures.utils.filter_cache import DecodedFrame, frame_cache, frame_store
 
 
 BLACK_INDEX = [0]  # Upper text color
@@ -19,123 +22,283 @@ GREY_INDEX = [242]  # Unknown area color
 MAX_HISTORY_LOOKUPS = int(config_handler.read_option("external_filter", "max_history_lookups"))
 # Prefix of the image filenames
 FILENAME_PREFIX = config_handler.read_option("external_filter", "file_prefix")
-# Directory where cached images will be stored
-CACHE_DIR = config_handler.read_option("directories", "ext_filter_cache")
+# Number of concurrent image downloads when prefetching frames
+PREFETCH_WORKERS = int(config_handler.read_option("external_filter", "prefetch_workers"))
+# Timeout of the image download (in seconds)
+FETCH_TIMEOUT = float(config_handler.read_option("external_filter", "fetch_timeout"))
+
+# HTTP session with connection pool shared by all image downloads, created on the first download
+_session: Optional[requests.Session] = None
+_session_lock = Lock()
+# executors of the prefetch: coordinating thread (one prefetch at a time) and pool of download threads
+_prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ext_filter_prefetch")
+_download_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="ext_filter_download")
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PREFETCH_WORKERS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _get_frame_url(dt64: np.datetime64, img_url: str, url_prefix: str) -> str:
+    date_str = dt64.astype("datetime64[D]").astype(str)
+    year, month, day = date_str.split("-")
 
+    return f"{url_prefix}/{year}/{str(int(month))}/{str(int(day))}/{img_url}"
 
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
 
+def _fetch_image(url: str) -> Optional[bytes]:
+    """
+    Download the image.
 
-def _get_cache_path(dt64: np.datetime64, img_url: str) -> str:
+    :return: raw image data, or None if the image is not available on the server
+    :raises requests.RequestException: if the download fails (connection error, timeout)
     """
-    Generate a unique file path for caching the image.
+    response: requests.Response = _get_session().get(url, timeout=FETCH_TIMEOUT)
+    if response.status_code == 200:
+        return response.content
+    elif response.status_code == 404:
+        return None
+    else:
+        response.raise_for_status()
+        return None
+
+
+def _timestamp_to_filename(ts: np.datetime64) -> str:
+    """Format the numpy datetime64 timestamp into image filename format."""
+    return f"{FILENAME_PREFIX}{ts.astype('datetime64[m]').astype(str).replace('T', '_').replace(':', '-')}.png"
+
+
+def _decode_image(img_bytes: bytes) -> (np.ndarray, Optional[int]):
     """
-    # Convert date to string format
-    date_str = dt64.astype("datetime64[D]").astype(str)
-    # Create a hash of the image URL
-    url_hash = hashlib.md5(img_url.encode("utf-8")).hexdigest()
-    # Combine date and hash to form a unique filename
-    filename = f"{date_str}_{url_hash}.img"
-    return os.path.join(CACHE_DIR, filename)
+    Decode the image into palette indices.
 
+    :param img_bytes: raw image data
+    :return: tuple of (2D array of palette indices, palette index of transparent color or None)
+    """
+    img = Image.open(BytesIO(img_bytes)).convert("P")
+    transparency = img.info.get("transparency", None)
+    pixels = np.array(cast(Iterable, img))
 
-def _fetch_image(dt64: np.datetime64, img_url: str, url_prefix: str) -> Optional[bytes]:
-    date_str = dt64.astype("datetime64[D]").astype(str)
-    year, month, day = date_str.split("-")
+    # per-color alpha values (bytes) do not match any palette index
+    return pixels, transparency if isinstance(transparency, int) else None
 
-    url = f"{url_prefix}/{year}/{str(int(month))}/{str(int(day))}/{img_url}"
 
-    # Check if the image is already cached
-    cache_path = _get_cache_path(dt64, url)
-    if os.path.exists(cache_path):
-        with open(cache_path, "rb") as file:
-            return file.read()
+def _label_frame(pixels: np.ndarray, transparency: Optional[int]) -> DecodedFrame:
+    """
+    Label clusters of colored pixels. Cluster sizes are computed for all clusters at once.
 
-    # If not cached, fetch the image
-    response: requests.Response = requests.get(url)
-    if response.status_code == 200:
-        image_data: bytes = response.content
-        # Cache the image
-        with open(cache_path, "wb") as file:
-            file.write(image_data)
-        return image_data
-    else:
+    :param pixels: 2D array of palette indices
+    :param transparency: palette index of transparent color, None if there is no transparent color
+    :return: decoded frame
+    """
+    excluded_indices = [*BLACK_INDEX, *RED_INDEX, *GREY_INDEX, transparency]
+    mask = np.isin(pixels, excluded_indices, invert=True).astype(int)
+
+    labeled_array, num_features = label(mask)
+
+    # sizes of all clusters at once, label 0 = background
+    cluster_sizes = np.bincount(labeled_array.ravel(), minlength=num_features + 1)
+
+    return DecodedFrame(pixels, labeled_array, cluster_sizes)
+
+
+def _decode_frame(img_bytes: bytes) -> DecodedFrame:
+    return _label_frame(*_decode_image(img_bytes))
+
+
+def _load_frame(frame_timestamp: np.datetime64, url_prefix: str) -> Optional[DecodedFrame]:
+    """
+    Get decoded frame from in-memory cache. If it is not cached, load it from disk store, or download it, if it is
+    not stored. Frames known to be missing are not requested again until their negative cache entry expires.
+
+    :return: decoded frame, or None if the image is not available
+    """
+    frame = frame_cache.get(url_prefix, frame_timestamp)
+    if frame is not None:
+        return frame
+
+    url = _get_frame_url(frame_timestamp, _timestamp_to_filename(frame_timestamp), url_prefix)
+    is_known, stored, transparency = frame_store.load(url)
+
+    if not is_known:
+        try:
+            img_raw = _fetch_image(url)
+        except requests.RequestException as error:
+            # failed download is not recorded as missing frame, it can be requested again
+            logger.warning("[EXTERNAL FILTER] Cannot fetch frame %s: %s", frame_timestamp, error)
+            return None
+
+        if img_raw is None:
+            frame_store.store_missing(url, frame_timestamp)
+            return None
+
+        pixels, transparency = _decode_image(img_raw)
+        frame_store.store(url, frame_timestamp, img_raw, pixels, transparency)
+    elif stored is None:
         return None
+    elif isinstance(stored, bytes):
+        pixels, transparency = _decode_image(stored)
+    else:
+        pixels = stored
 
+    frame = _label_frame(pixels, transparency)
+    frame_cache.put(url_prefix, frame_timestamp, frame)
+    return frame
 
-def _detect_active_pixels(
-        img_bytes: bytes,
-        point_x: float,
-        point_y: float,
-        radius_km: float,
-        pixel_threshold: int,
+
+def _to_frame_timestamps(sample_timestamps: np.ndarray) -> np.ndarray:
+    """Round timestamps down to the nearest frame timestamp (multiple of 10 minutes)."""
+    minutes_since_epoch = np.asarray(sample_timestamps).astype("datetime64[m]").astype(np.int64)
+    return ((minutes_since_epoch // 10) * 10).astype("datetime64[m]")
+
+
+def prefetch_frames(sample_timestamps: np.ndarray, url_prefix: str, forward_look: bool = False) -> int:
+    """
+    Download and decode all frames required by 'determine_wet_batch' for given timestamps concurrently, over pooled
+    HTTP connections. Frames are stored in the frame cache, missing frames are recorded as missing. History lookups
+    are resolved in rounds: older frames are fetched only for frame timestamps, whose newer frames are missing.
+
+    :param sample_timestamps: 1D array of numpy datetime64 timestamps
+    :param url_prefix: URL prefix of the radar images
+    :param forward_look: if True, next frames are prefetched too
+    :return: number of available frames
+    """
+    delta_10 = np.timedelta64(10, "m")
+    unique_timestamps = np.unique(_to_frame_timestamps(sample_timestamps))
+
+    def load_all(timestamps: np.ndarray) -> dict[np.datetime64, bool]:
+        timestamps = list(timestamps)
+        loaded = _download_executor.map(lambda ts: _load_frame(ts, url_prefix) is not None, timestamps)
+        return dict(zip(timestamps, loaded))
+
+    # forward look always checks the frame following the original frame timestamp
+    to_load = np.union1d(unique_timestamps, unique_timestamps + delta_10) if forward_look else unique_timestamps
+    available = load_all(to_load)
+
+    pending = np.array([ts for ts in unique_timestamps if not available[ts]], dtype="datetime64[m]")
+    for history_lookup in range(1, MAX_HISTORY_LOOKUPS):
+        if len(pending) == 0:
+            break
+        older_timestamps = pending - delta_10 * history_lookup
+        available.update(load_all(np.setdiff1d(older_timestamps, list(available.keys()))))
+        pending = pending[[not available[ts] for ts in older_timestamps]]
+
+    return sum(available.values())
+
+
+def start_prefetch(sample_timestamps: np.ndarray, url_prefix: str, forward_look: bool = False) -> Future:
+    """
+    Start 'prefetch_frames' in background, so downloads can overlap with other processing.
+
+    :return: future of the prefetch, resulting in number of available frames
+    """
+    return _prefetch_executor.submit(prefetch_frames, sample_timestamps, url_prefix, forward_look)
+
+
+def _get_active_pixels_mask(frame: DecodedFrame, pixel_threshold: int) -> np.ndarray:
+    """
+    Find pixels belonging to clusters of colored pixels with size of at least 'pixel_threshold'.
+
+    :param frame: decoded frame
+    :param pixel_threshold: minimal size of the cluster (in pixels)
+    :return: 2D bool array (image rows, image columns), True for pixels of large enough clusters
+    """
+    is_large_cluster = frame.cluster_sizes >= pixel_threshold
+    is_large_cluster[0] = False
+
+    return is_large_cluster[frame.labels]
+
+
+def _points_to_pixels(
+        active_mask: np.ndarray,
+        points_x: np.ndarray,
+        points_y: np.ndarray,
+        radiuses_km: np.ndarray,
         img_x_min: float,
         img_x_max: float,
         img_y_min: float,
         img_y_max: float
-) -> bool:
+) -> (np.ndarray, np.ndarray, np.ndarray):
     """
-    Check if there are colored pixels in cluster in the specified area around the given point in the map.
+    Map geographical coordinates of the points and their search radiuses to image pixel coordinates.
 
-    :param img_bytes:
-    :param point_x:
-    :param point_y:
-    :param radius_km:
-    :param pixel_threshold:
-    :param img_x_min:
-    :param img_x_max:
-    :param img_y_min:
-    :param img_y_max:
-    :return:
+    :return: tuple of int arrays (points' pixel x coordinates, points' pixel y coordinates, radiuses in pixels)
     """
-    img = Image.open(BytesIO(img_bytes)).convert("P")
-    transparency = img.info.get("transparency", None)
-    pixels = np.array(cast(Iterable, img))
+    height, width = active_mask.shape
 
     # Correctly map geographical coordinates to image coordinates
-    scale_x = pixels.shape[1] / (img_x_max - img_x_min)
+    scale_x = width / (img_x_max - img_x_min)
     # Y-axis is flipped because image coordinates start from top-left corner
-    scale_y = pixels.shape[0] / (img_y_max - img_y_min)
+    scale_y = height / (img_y_max - img_y_min)
 
     # Adjusting for correct mapping of longitude and latitude to image coordinates
-    point_px_x = int((point_x - img_x_min) * scale_x)
+    points_px_x = np.trunc((np.asarray(points_x, dtype=float) - img_x_min) * scale_x).astype(int)
     # Y-axis coordinate needs to be inverted because higher latitudes are lower on the image
-    point_px_y = pixels.shape[0] - int((point_y - img_y_min) * scale_y)
+    points_px_y = height - np.trunc((np.asarray(points_y, dtype=float) - img_y_min) * scale_y).astype(int)
 
     diagonal_km_per_pixel = np.sqrt(((img_x_max - img_x_min) * 111) ** 2 +
-                                    ((img_y_max - img_y_min) * 111) ** 2) / np.sqrt(
-        pixels.shape[0] ** 2 + pixels.shape[1] ** 2)
-    radius_px = int(radius_km / diagonal_km_per_pixel)
-
-    excluded_indices = [*BLACK_INDEX, *RED_INDEX, *GREY_INDEX, transparency]
-    mask = np.isin(pixels, excluded_indices, invert=True).astype(int)
+                                    ((img_y_max - img_y_min) * 111) ** 2) / np.sqrt(height ** 2 + width ** 2)
+    radiuses_px = np.trunc(np.asarray(radiuses_km, dtype=float) / diagonal_km_per_pixel).astype(int)
 
-    labeled_array, num_features = label(mask)
-
-    # Creating a search area mask based on the correct coordinates
-    search_area_mask = np.zeros_like(pixels, dtype=bool)
-    for y in range(pixels.shape[0]):
-        for x in range(pixels.shape[1]):
-            if (x - point_px_x) ** 2 + (y - point_px_y) ** 2 <= radius_px ** 2:
-                search_area_mask[y, x] = True
-
-    labels_in_radius = np.unique(labeled_array[search_area_mask])
-    labels_in_radius = labels_in_radius[labels_in_radius != 0]
+    return points_px_x, points_px_y, radiuses_px
 
-    for label_number in labels_in_radius:
-        cluster_size = np.sum(labeled_array == label_number)
-        if cluster_size >= pixel_threshold:
-            return True
 
-    return False
+def _detect_active_pixels_batch(
+        active_mask: np.ndarray,
+        points_px_x: np.ndarray,
+        points_px_y: np.ndarray,
+        radiuses_px: np.ndarray
+) -> np.ndarray:
+    """
+    Check for all points at once, if there are pixels of large enough clusters within the radius around the point.
 
+    For points inside the image, distance of each pixel to the nearest active pixel is computed once per image
+    (Euclidean distance transform), so the check is only a lookup. Points outside the image are checked by disk masks
+    evaluated on the bounding boxes of their search areas.
 
-def determine_wet(
-        sample_timestamp: np.datetime64,
-        point_x: float,
-        point_y: float,
-        radius_km: float,
+    :param active_mask: 2D bool array of active pixels (see '_get_active_pixels_mask')
+    :param points_px_x: int array of points' pixel x coordinates
+    :param points_px_y: int array of points' pixel y coordinates
+    :param radiuses_px: int array of search radiuses in pixels
+    :return: bool array, True for points with active pixels in their search area
+    """
+    height, width = active_mask.shape
+    is_active = np.zeros(points_px_x.shape, dtype=bool)
+    if not active_mask.any():
+        return is_active
+
+    is_inside = (points_px_x >= 0) & (points_px_x < width) & (points_px_y >= 0) & (points_px_y < height)
+    if is_inside.any():
+        # distances are square roots of integers, small tolerance covers rounding of exact integer roots
+        distances = distance_transform_edt(~active_mask)
+        is_active[is_inside] = \
+            distances[points_px_y[is_inside], points_px_x[is_inside]] <= radiuses_px[is_inside] + 1e-9
+
+    for i in np.flatnonzero(~is_inside & (radiuses_px >= 0)):
+        x, y, r = points_px_x[i], points_px_y[i], radiuses_px[i]
+        x_from, x_to = max(x - r, 0), min(x + r + 1, width)
+        y_from, y_to = max(y - r, 0), min(y + r + 1, height)
+        if x_from >= x_to or y_from >= y_to:
+            continue
+        ys, xs = np.ogrid[y_from:y_to, x_from:x_to]
+        disk = (xs - x) ** 2 + (ys - y) ** 2 <= r ** 2
+        is_active[i] = np.any(active_mask[y_from:y_to, x_from:x_to] & disk)
+
+    return is_active
+
+
+def determine_wet_batch(
+        sample_timestamps: np.ndarray,
+        points_x: np.ndarray,
+        points_y: np.ndarray,
+        radiuses_km: np.ndarray,
         pixel_threshold: int,
         img_x_min: float,
         img_x_max: float,
@@ -144,49 +307,76 @@ def determine_wet(
         url_prefix: str,
         default_return: bool = True,
         forward_look: bool = False
-) -> bool:
-    def timestamp_to_filename(ts: np.datetime64):
-        """Helper function to format the numpy datetime64 timestamp into image filename format."""
-        return f"{FILENAME_PREFIX}{ts.astype('datetime64[m]').astype(str).replace('T', '_').replace(':', '-')}.png"
-
+) -> np.ndarray:
+    """
+    Determine wet/dry states of all points (e.g. CML centers) for all timestamps at once. Each radar frame
+    is fetched, decoded and labeled only once and evaluated for all points together. History and forward lookups are
+    resolved once per frame timestamp (10 minutes), shared by all samples within the frame.
+
+    :param sample_timestamps: 1D array of numpy datetime64 timestamps
+    :param points_x: 1D array of points' longitudes
+    :param points_y: 1D array of points' latitudes
+    :param radiuses_km: 1D array of search radiuses around the points (in km)
+    :param pixel_threshold: minimal size of the cluster (in pixels)
+    :param img_x_min: longitude of the left image border
+    :param img_x_max: longitude of the right image border
+    :param img_y_min: latitude of the bottom image border
+    :param img_y_max: latitude of the top image border
+    :param url_prefix: URL prefix of the radar images
+    :param default_return: wet state used if no image is available
+    :param forward_look: if True, the next frame is also checked (wet if any of them is wet)
+    :return: 2D bool array with shape (points, timestamps)
+    """
+    points_count = len(points_x)
     delta_10 = np.timedelta64(10, "m")
 
+    # frame timestamp -> states of all points (None = image not available), each frame is processed only once
+    frames_states: dict[np.datetime64, Optional[np.ndarray]] = {}
+
+    def get_frame_states(frame_timestamp: np.datetime64) -> Optional[np.ndarray]:
+        if frame_timestamp not in frames_states:
+            frame = _load_frame(frame_timestamp, url_prefix)
+            if frame is None:
+                frames_states[frame_timestamp] = None
+            else:
+                active_mask = _get_active_pixels_mask(frame, pixel_threshold)
+                points_px = _points_to_pixels(
+                    active_mask, points_x, points_y, radiuses_km, img_x_min, img_x_max, img_y_min, img_y_max
+                )
+                frames_states[frame_timestamp] = _detect_active_pixels_batch(active_mask, *points_px)
+        return frames_states[frame_timestamp]
+
     # Convert to minutes and round down to the nearest multiple of 10
-    minutes_since_epoch = sample_timestamp.astype("datetime64[m]").astype(int)
-    rounded_minutes_since_epoch = (minutes_since_epoch // 10) * 10
-    lower_timestamp = np.datetime64("1970-01-01T00:00:00") + np.timedelta64(int(rounded_minutes_since_epoch), "m")
-
-    history_lookup = 1
-    img_raw = _fetch_image(lower_timestamp, timestamp_to_filename(lower_timestamp), url_prefix)
-
-    while img_raw is None and history_lookup < MAX_HISTORY_LOOKUPS:
-        lower_timestamp -= delta_10
-        history_lookup += 1
-        img_raw = _fetch_image(lower_timestamp, timestamp_to_filename(lower_timestamp), url_prefix)
-
-    if img_raw is not None:
-        prev_wet_state = _detect_active_pixels(
-            img_raw, point_x, point_y, radius_km, pixel_threshold, img_x_min, img_x_max, img_y_min, img_y_max
-        )
-    else:
-        prev_wet_state = default_return
+    lower_timestamps = _to_frame_timestamps(sample_timestamps)
+    unique_timestamps, timestamps_idx = np.unique(lower_timestamps, return_inverse=True)
 
-    if forward_look:
-        higher_timestamp = lower_timestamp + (delta_10 * history_lookup)
-        img_raw = _fetch_image(higher_timestamp, timestamp_to_filename(higher_timestamp), url_prefix)
+    wet = np.zeros((points_count, len(unique_timestamps)), dtype=bool)
+    for i, lower_timestamp in enumerate(unique_timestamps):
+        history_lookup = 1
+        states = get_frame_states(lower_timestamp)
 
-        if img_raw is not None:
-            next_wet_state = _detect_active_pixels(
-                img_raw, point_x, point_y, radius_km, pixel_threshold, img_x_min, img_x_max, img_y_min, img_y_max
-            )
+        while states is None and history_lookup < MAX_HISTORY_LOOKUPS:
+            lower_timestamp -= delta_10
+            history_lookup += 1
+            states = get_frame_states(lower_timestamp)
+
+        prev_wet_states = states if states is not None else np.full((points_count,), default_return)
+
+        if forward_look:
+            higher_timestamp = lower_timestamp + (delta_10 * history_lookup)
+            states = get_frame_states(higher_timestamp)
+            next_wet_states = states if states is not None else np.full((points_count,), default_return)
+
+            wet[:, i] = prev_wet_states | next_wet_states
         else:
-            next_wet_state = default_return
+            wet[:, i] = prev_wet_states
 
-        del img_raw
-        return prev_wet_state or next_wet_state
-    else:
-        del img_raw
-        return prev_wet_state
+    logger.debug(
+        "[EXTERNAL FILTER] %d frames evaluated. Frame cache: %d hits, %d misses, %d frames cached (%.1f MB).",
+        len(frames_states), *frame_cache.get_stats()
+    )
+
+    return wet[:, timestamps_idx.ravel()]
 
 
 def __get_color_indices(img_path):
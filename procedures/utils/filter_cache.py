@@ -0,0 +1,310 @@
+"""Module containing in-memory and on-disk caches of radar frames used by the external filter."""
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import os
+import sqlite3
+from threading import Lock
+import time
+from typing import Optional, Union
+
+import numpy as np
+
+from handlers import config_handler
+from handlers.logging_handler import logger
+
+
+# frames missing longer than this after their timestamp are not expected to be published anymore
+MISSING_FRAME_FINAL_AGE = timedelta(hours=1)
+
+# states of the frames in the disk store index
+FRAME_STORED = 1
+FRAME_MISSING = 0
+
+
+class DecodedFrame:
+    """
+    Decoded and labeled radar frame of the external filter.
+    """
+    def __init__(self, pixels: np.ndarray, labels: np.ndarray, cluster_sizes: np.ndarray):
+        # 2D array of palette indices of the pixels
+        self.pixels: np.ndarray = pixels
+        # 2D array of cluster labels of the pixels (0 = background)
+        self.labels: np.ndarray = labels
+        # sizes of the clusters in pixels, indexed by label
+        self.cluster_sizes: np.ndarray = cluster_sizes
+
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes + self.labels.nbytes + self.cluster_sizes.nbytes
+
+
+class FrameCache:
+    """
+    Bounded in-memory LRU cache of decoded radar frames, keyed by frame URL prefix and timestamp. Total size of the
+    cached frames is limited to 'memory_cache_mb', least recently used frames are evicted first.
+    """
+    def __init__(self, max_size_mb: int):
+        self.max_size: int = max_size_mb * 1024 * 1024
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self.frames: OrderedDict[tuple[str, np.datetime64], DecodedFrame] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, url_prefix: str, timestamp: np.datetime64) -> Optional[DecodedFrame]:
+        key = (url_prefix, timestamp.astype("datetime64[m]"))
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, url_prefix: str, timestamp: np.datetime64, frame: DecodedFrame):
+        key = (url_prefix, timestamp.astype("datetime64[m]"))
+        with self.lock:
+            if key in self.frames:
+                self.size -= self.frames.pop(key).nbytes
+
+            # frames larger than the whole cache are not cached at all
+            if frame.nbytes > self.max_size:
+                return
+
+            self.frames[key] = frame
+            self.size += frame.nbytes
+
+            while self.size > self.max_size:
+                _, evicted = self.frames.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def get_stats(self) -> (int, int, int, float):
+        """
+        :return: tuple of (hits count, misses count, cached frames count, cache size in MB)
+        """
+        with self.lock:
+            return self.hits, self.misses, len(self.frames), self.size / 1024 ** 2
+
+
+class FrameStore:
+    """
+    On-disk store of radar frames, keyed by full frame URL. Frames are stored either as downloaded images ('png'
+    format), or as pre-decoded arrays of palette indices ('npy' format), which are read without image decoding.
+
+    Frames are indexed in SQLite database with per-frame metadata (frame timestamp, format, size, transparency index,
+    time of the last check and access). Frames missing on the server are indexed too (negative caching): frames
+    missing shortly after their timestamp are requested again after 'missing_retry_minutes', since they can still be
+    published, older missing frames after 'missing_ttl_hours'. Total size of stored frames is bounded by
+    'disk_cache_max_size_mb', least recently used frames are evicted first.
+    """
+    def __init__(self):
+        self.directory: str = config_handler.read_option("directories", "ext_filter_cache")
+        self.max_size: int = int(config_handler.read_option("external_filter", "disk_cache_max_size_mb")) * 1024 ** 2
+        self.format: str = config_handler.read_option("external_filter", "disk_cache_format")
+        self.missing_retry_secs: float = \
+            float(config_handler.read_option("external_filter", "missing_retry_minutes")) * 60
+        self.missing_ttl_secs: float = float(config_handler.read_option("external_filter", "missing_ttl_hours")) * 3600
+
+        if self.format not in ("png", "npy"):
+            raise ValueError(f"Unsupported external filter disk cache format: {self.format}")
+
+        self.db: Optional[sqlite3.Connection] = None
+        self.size: int = 0
+        self.lock = Lock()
+
+    def _open(self):
+        """
+        Open (or create) the index database, called lazily on the first access (under the lock).
+        """
+        if self.db is not None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "key TEXT PRIMARY KEY, path TEXT, frame_time INTEGER NOT NULL, state INTEGER NOT NULL, format TEXT, "
+            "size INTEGER NOT NULL DEFAULT 0, transparency INTEGER, checked REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS frames_accessed ON frames (state, accessed)")
+        self.db.commit()
+
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM frames WHERE state = ?", (FRAME_STORED,)
+        ).fetchone()[0]
+
+        # images cached by older versions (named by date and URL hash) are not indexed, they are removed
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".img"):
+                self._remove_file(entry.path)
+
+        logger.debug(
+            "[CACHE: filter frames] Opened disk store with %d indexed frames, total size %.1f MB.",
+            self.db.execute("SELECT COUNT(*) FROM frames").fetchone()[0], self.size / 1024 ** 2
+        )
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{self.format}")
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def load(self, url: str) -> (bool, Optional[Union[bytes, np.ndarray]], Optional[int]):
+        """
+        Load the frame from the store.
+
+        :param url: full URL of the frame
+        :return: tuple of (True if state of the frame is known, stored frame - image bytes or 2D array of palette
+                 indices, None if the frame is missing or unknown, transparency index of the pre-decoded frame)
+        """
+        key = self._key(url)
+        now = time.time()
+        with self.lock:
+            self._open()
+            row = self.db.execute(
+                "SELECT path, frame_time, state, format, transparency, checked FROM frames WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None, None
+
+            path, frame_time, state, file_format, transparency, checked = row
+            if state == FRAME_MISSING:
+                is_final = checked - frame_time > MISSING_FRAME_FINAL_AGE.total_seconds()
+                is_expired = now - checked > (self.missing_ttl_secs if is_final else self.missing_retry_secs)
+                return not is_expired, None, None
+
+            self.db.execute("UPDATE frames SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+
+        try:
+            if file_format == "npy":
+                return True, np.load(path, allow_pickle=False), transparency
+            with open(path, "rb") as file:
+                return True, file.read(), None
+        except (OSError, ValueError) as error:
+            logger.warning("[CACHE: filter frames] Cannot read stored frame %s, fetching again: %s", path, error)
+            self._remove(key)
+            return False, None, None
+
+    def store(
+            self,
+            url: str,
+            frame_timestamp: np.datetime64,
+            img_bytes: bytes,
+            pixels: np.ndarray,
+            transparency: Optional[int]
+    ):
+        """
+        Store downloaded frame in configured format.
+
+        :param url: full URL of the frame
+        :param frame_timestamp: timestamp of the frame
+        :param img_bytes: downloaded image
+        :param pixels: decoded 2D array of palette indices
+        :param transparency: palette index of transparent color, None if there is no transparent color
+        """
+        key = self._key(url)
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as file:
+                if self.format == "npy":
+                    np.save(file, pixels, allow_pickle=False)
+                else:
+                    file.write(img_bytes)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as error:
+            logger.warning("[CACHE: filter frames] Cannot store frame %s: %s", path, error)
+            return
+
+        self._index(key, path, frame_timestamp, FRAME_STORED, size, transparency if self.format == "npy" else None)
+        self._evict()
+
+    def store_missing(self, url: str, frame_timestamp: np.datetime64):
+        """
+        Record the frame as missing on the server.
+
+        :param url: full URL of the frame
+        :param frame_timestamp: timestamp of the frame
+        """
+        self._index(self._key(url), None, frame_timestamp, FRAME_MISSING, 0, None)
+
+    def _index(
+            self,
+            key: str,
+            path: Optional[str],
+            frame_timestamp: np.datetime64,
+            state: int,
+            size: int,
+            transparency: Optional[int]
+    ):
+        now = time.time()
+        frame_time = int(frame_timestamp.astype("datetime64[s]").astype(np.int64))
+        with self.lock:
+            self._open()
+            previous = self.db.execute("SELECT path, size FROM frames WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self.size -= previous[1]
+                if previous[0] is not None and previous[0] != path:
+                    self._remove_file(previous[0])
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO frames (key, path, frame_time, state, format, size, transparency, checked, "
+                "accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, frame_time, state, self.format if path is not None else None, size, transparency, now, now)
+            )
+            self.db.commit()
+            self.size += size
+
+    def _remove(self, key: str):
+        with self.lock:
+            self._open()
+            row = self.db.execute("SELECT path, size FROM frames WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self.db.execute("DELETE FROM frames WHERE key = ?", (key,))
+            self.db.commit()
+            self.size -= row[1]
+        if row[0] is not None:
+            self._remove_file(row[0])
+
+    def _evict(self):
+        """Evict least recently used frames until the store fits into its size limit."""
+        with self.lock:
+            if self.size <= self.max_size:
+                return
+
+            evicted = []
+            for key, path, size in self.db.execute(
+                    "SELECT key, path, size FROM frames WHERE state = ? ORDER BY accessed", (FRAME_STORED,)
+            ).fetchall():
+                if self.size <= self.max_size:
+                    break
+                evicted.append((key, path))
+                self.size -= size
+
+            self.db.executemany("DELETE FROM frames WHERE key = ?", [(key,) for key, _ in evicted])
+            self.db.commit()
+
+        for _, path in evicted:
+            self._remove_file(path)
+
+        logger.debug("[CACHE: filter frames] Evicted %d least recently used frames.", len(evicted))
+
+
+# global instances of FrameCache and FrameStore, shared by all calculations (historic and realtime)
+frame_cache = FrameCache(int(config_handler.read_option("external_filter", "memory_cache_mb")))
+frame_store = FrameStore()
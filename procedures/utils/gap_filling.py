@@ -0,0 +1,63 @@
+from typing import Optional
+
+import numpy as np
+
+
+def fill_gaps(values: np.ndarray, method: str, x: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Fill missing values (NaNs) along the last axis of N-D array, all timeseries at once. Only inner gaps are filled,
+    leading and trailing NaNs are kept (same as xarray's 'interpolate_na' with 'max_gap=None').
+
+    For each position, indices of the previous and the next valid values are found by forward/backward propagation
+    of valid indices (cumulative max/min), values of the gaps are then picked ('nearest') or interpolated ('linear')
+    from them.
+
+    :param values: N-D array of values, the last axis is the time axis
+    :param method: 'nearest' (in case of tie, previous value is used) or 'linear'
+    :param x: optional 1D array of coordinates along the last axis (numbers or datetime64), default = equidistant
+    :return: new float array with filled gaps
+    """
+    if method not in ("nearest", "linear"):
+        raise ValueError(f"Unsupported gap filling method: {method}")
+
+    values = np.asarray(values, dtype=float)
+    length = values.shape[-1]
+    if length == 0:
+        return values.copy()
+
+    if x is None:
+        x = np.arange(length, dtype=float)
+    else:
+        # coordinates relative to the first one (keeps precision of datetime64 coordinates converted to floats)
+        x = np.asarray(x)
+        x = (x - x[0]).astype(float)
+
+    # work on 2D view (timeseries, time), int32 indices to save memory bandwidth
+    values_2d = values.reshape((-1, length))
+    indices = np.arange(length, dtype=np.int32)
+    is_missing = np.isnan(values_2d)
+
+    # index of the previous (or current) valid value, -1 = none
+    prev_idx = np.where(is_missing, np.int32(-1), indices)
+    np.maximum.accumulate(prev_idx, axis=-1, out=prev_idx)
+    # index of the next (or current) valid value, 'length' = none
+    next_idx = np.where(is_missing, np.int32(length), indices)[:, ::-1]
+    next_idx = np.minimum.accumulate(next_idx, axis=-1)[:, ::-1]
+
+    # only inner gaps (missing values with valid values on both sides) are filled
+    rows, cols = np.nonzero(is_missing & (prev_idx >= 0) & (next_idx < length))
+    prev_cols = prev_idx[rows, cols]
+    next_cols = next_idx[rows, cols]
+
+    filled = values_2d.copy()
+    prev_values = values_2d[rows, prev_cols]
+    next_values = values_2d[rows, next_cols]
+    if method == "nearest":
+        filled[rows, cols] = np.where(
+            (x[cols] - x[prev_cols]) <= (x[next_cols] - x[cols]), prev_values, next_values
+        )
+    else:
+        slope = (next_values - prev_values) / (x[next_cols] - x[prev_cols])
+        filled[rows, cols] = slope * (x[cols] - x[prev_cols]) + prev_values
+
+    return filled.reshape(values.shape)
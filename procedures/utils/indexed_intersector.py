@@ -0,0 +1,171 @@
+"""Module containing spatially indexed alternative of the sweep line intersector of line segments."""
+from typing import Optional
+
+import numpy as np
+
+from lib.sweep_intersector.lib.Point import Point
+from lib.sweep_intersector.lib.SweepIntersector import SweepIntersector
+
+# segment given by its start and end point: ((x, y), (x, y))
+SegmentCoords = tuple[tuple[float, float], tuple[float, float]]
+
+
+class IndexedIntersector:
+    """
+    Finder of all pairwise intersections of line segments, with the same 'findIntersections' contract and semantics as
+    the pure Python 'SweepIntersector':
+        - points closer than Point.EPS2 in both coordinates are considered equal,
+        - zero-length and parallel (including collinear) segments have no intersections,
+        - common endpoints of two segments are not intersections,
+        - end point (the lexicographically larger one) of one segment lying on the other segment is intersection of
+          the other segment only, start point of one segment lying on the other segment is not intersection at all,
+        - coordinates of intersection points are computed by the same floating point operations.
+
+    Candidate pairs are pruned using index of segments sorted by their x-coordinates (only segments with overlapping
+    bounding boxes are tested), the candidates are then tested and intersected all at once using vectorized operations.
+    """
+    def findIntersections(self, origSegList: list[SegmentCoords]) -> dict[SegmentCoords, list[tuple[float, float]]]:
+        """
+        Compute all intersections between segments of the list 'origSegList'.
+
+        :param origSegList: list of segments (vs, ve), where vs is the start and ve the end point, given as (x, y)
+        :return: dictionary of segments having intersections: (vs, ve) -> list of intersection points ordered from vs
+                 to ve, including vs and ve, in the order of the segments in 'origSegList'
+        """
+        if not origSegList:
+            return {}
+
+        coords = np.array(origSegList, dtype=float).reshape((-1, 4))
+
+        # orient the segments from the (lexicographically) smaller point to the larger one, as sweep line does
+        is_reversed = _compare_points(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]) > 0
+        x1 = np.where(is_reversed, coords[:, 2], coords[:, 0])
+        y1 = np.where(is_reversed, coords[:, 3], coords[:, 1])
+        x2 = np.where(is_reversed, coords[:, 0], coords[:, 2])
+        y2 = np.where(is_reversed, coords[:, 1], coords[:, 3])
+
+        # ignore zero-length segments
+        valid = np.flatnonzero(_compare_points(x1, y1, x2, y2) != 0)
+
+        pairs = self._candidate_pairs(x1[valid], y1[valid], x2[valid], y2[valid])
+        if pairs is None:
+            return {}
+        first, second = valid[pairs[0]], valid[pairs[1]]
+
+        dx, dy = x2 - x1, y2 - y1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            is_vertical = x2 == x1
+            slope = np.where(is_vertical, np.inf, dy / np.where(is_vertical, 1.0, dx))
+            y_shift = np.where(is_vertical, -np.inf, y1 - slope * x1)
+
+        # parallel segments do not intersect
+        keep = slope[first] != slope[second]
+        first, second = first[keep], second[keep]
+
+        # closed segments intersect, if endpoints of each segment are not on the same side of the other segment
+        def orientation(seg: np.ndarray, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+            a = dy[seg] * (x1[seg] - px)
+            b = dx[seg] * (y1[seg] - py)
+            return (a > b).astype(np.int8) - (a < b).astype(np.int8)
+
+        keep = (
+            (orientation(first, x1[second], y1[second]) * orientation(first, x2[second], y2[second]) <= 0)
+            & (orientation(second, x1[first], y1[first]) * orientation(second, x2[first], y2[first]) <= 0)
+        )
+        first, second = first[keep], second[keep]
+
+        # common endpoints are not intersections
+        keep = ~(
+            _points_equal(x1[first], y1[first], x1[second], y1[second])
+            | _points_equal(x1[first], y1[first], x2[second], y2[second])
+            | _points_equal(x2[first], y2[first], x1[second], y1[second])
+            | _points_equal(x2[first], y2[first], x2[second], y2[second])
+        )
+        first, second = first[keep], second[keep]
+
+        # intersection of the lines is computed in the same way as the sweep line does for the segment below ('lower')
+        # and the segment above, which is (left of the intersection) the one with greater slope
+        is_first_lower = slope[first] > slope[second]
+        lower = np.where(is_first_lower, first, second)
+        upper = np.where(is_first_lower, second, first)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cx = np.where(
+                is_vertical[lower], x1[lower],
+                np.where(
+                    is_vertical[upper], x1[upper],
+                    (y_shift[upper] - y_shift[lower]) / (slope[lower] - slope[upper])
+                )
+            )
+            cy = np.where(
+                is_vertical[lower],
+                slope[upper] * cx + y_shift[upper],
+                slope[lower] * cx + y_shift[lower]
+            )
+
+        # segments starting at a point of the other segment diverge right of the sweep line, it finds no intersection
+        keep = ~(_points_equal(x1[first], y1[first], cx, cy) | _points_equal(x1[second], y1[second], cx, cy))
+        first, second, cx, cy = first[keep], second[keep], cx[keep], cy[keep]
+
+        # intersection is not assigned to the segment, if it is (within the tolerance) one of its endpoints
+        on_first = ~(_points_equal(x1[first], y1[first], cx, cy) | _points_equal(x2[first], y2[first], cx, cy))
+        on_second = ~(_points_equal(x1[second], y1[second], cx, cy) | _points_equal(x2[second], y2[second], cx, cy))
+
+        isects: dict[int, list[tuple[float, float]]] = {}
+        for seg, is_on, x, y in (
+                (first, on_first, cx, cy),
+                (second, on_second, cx, cy)
+        ):
+            for index, point_x, point_y in zip(seg[is_on].tolist(), x[is_on].tolist(), y[is_on].tolist()):
+                isects.setdefault(index, []).append((point_x, point_y))
+
+        intersecting_segments = {}
+        for index in sorted(isects):
+            v1, v2 = origSegList[index]
+            intersecting_segments[origSegList[index]] = SweepIntersector.inorderExtend([v1, v2], v1, v2, isects[index])
+
+        return intersecting_segments
+
+    @staticmethod
+    def _candidate_pairs(
+            x1: np.ndarray,
+            y1: np.ndarray,
+            x2: np.ndarray,
+            y2: np.ndarray
+    ) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """
+        Find pairs of segments with overlapping bounding boxes (extended by the tolerance), using segments sorted by
+        their minimal x-coordinate: candidates of each segment are the following segments starting before its end.
+
+        :return: tuple of arrays of indices (first, second) of the candidate pairs, or None if there are no candidates
+        """
+        min_x, max_x = np.minimum(x1, x2), np.maximum(x1, x2)
+        min_y, max_y = np.minimum(y1, y2), np.maximum(y1, y2)
+
+        order = np.argsort(min_x, kind="stable")
+        sorted_min_x = min_x[order]
+        ends = np.searchsorted(sorted_min_x, max_x[order] + Point.EPS2, side="right")
+        counts = np.maximum(ends - np.arange(1, len(order) + 1), 0)
+        if counts.sum() == 0:
+            return None
+
+        first_positions = np.repeat(np.arange(len(order)), counts)
+        second_positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + first_positions + 1
+        first, second = order[first_positions], order[second_positions]
+
+        is_overlapping = (min_y[first] <= max_y[second] + Point.EPS2) & (min_y[second] <= max_y[first] + Point.EPS2)
+        return first[is_overlapping], second[is_overlapping]
+
+
+def _compare_points(ax: np.ndarray, ay: np.ndarray, bx: np.ndarray, by: np.ndarray) -> np.ndarray:
+    """
+    Lexicographic comparison of points with the tolerance Point.EPS2, same as Point.compare: -1, 0 or 1.
+    """
+    dx, dy = ax - bx, ay - by
+    return np.where(
+        dx > Point.EPS2, 1,
+        np.where(dx < -Point.EPS2, -1, np.where(dy > Point.EPS2, 1, np.where(dy < -Point.EPS2, -1, 0)))
+    )
+
+
+def _points_equal(ax: np.ndarray, ay: np.ndarray, bx: np.ndarray, by: np.ndarray) -> np.ndarray:
+    return (np.abs(ax - bx) <= Point.EPS2) & (np.abs(ay - by) <= Point.EPS2)
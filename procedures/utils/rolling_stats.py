@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def rolling_std(values: np.ndarray, window: int, center: bool = False) -> np.ndarray:
+    """
+    Rolling standard deviation (ddof=0) along the last axis of N-D array, all timeseries at once in O(N) time using
+    cumulative sums of values and of their squares. Semantics are the same as xarray's
+    'rolling(time=window, center=center).std(skipna=False)': windows containing missing values and incomplete windows
+    at the edges result in NaN, centered window of even length has one more value on the left side.
+
+    To preserve precision of the cumulative sums, mean of each timeseries is subtracted from its values first (standard
+    deviation is invariant to the shift).
+
+    :param values: N-D array of values, the last axis is the time axis
+    :param window: length of the window (in samples)
+    :param center: if True, window is centered around its position, otherwise it ends at its position
+    :return: new float array of rolling standard deviations with the same shape as 'values'
+    """
+    values = np.asarray(values, dtype=float)
+    length = values.shape[-1]
+    result = np.full(values.shape, np.nan)
+    if window < 1 or window > length:
+        return result
+
+    values_2d = values.reshape((-1, length))
+    result_2d = result.reshape((-1, length))
+    is_missing = np.isnan(values_2d)
+
+    # shift of the timeseries by their means (of available values, all-NaN timeseries are not shifted)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offsets = np.where(is_missing, 0.0, values_2d).sum(axis=-1) / (~is_missing).sum(axis=-1)
+    offsets[~np.isfinite(offsets)] = 0.0
+    shifted = np.where(is_missing, 0.0, values_2d - offsets[:, np.newaxis])
+
+    def window_sums(array: np.ndarray) -> np.ndarray:
+        cumsum = np.zeros((array.shape[0], length + 1), dtype=array.dtype)
+        np.cumsum(array, axis=-1, out=cumsum[:, 1:])
+        # sums of windows ending at positions window-1 ... length-1
+        return cumsum[:, window:] - cumsum[:, :-window]
+
+    mean = window_sums(shifted) / window
+    variance = window_sums(shifted * shifted) / window - mean * mean
+    # rounding errors can make variance of (nearly) constant windows slightly negative
+    np.maximum(variance, 0.0, out=variance)
+
+    std = np.sqrt(variance)
+    std[window_sums(is_missing.astype(np.int32)) > 0] = np.nan
+
+    # centered window is shifted to the left by half of its length (xarray's convention)
+    shift = (window - 1) // 2 if center else 0
+    result_2d[:, window - 1 - shift:length - shift] = std
+
+    return result
@@ -6,7 +6,9 @@ import sys
 import warnings
 
 # show loading screen before app imports are made
-loading_screen = subprocess.Popen([sys.executable, "app/loading_screen.py"])
+# (worker processes of the calculation are spawned by re-importing this module, they must not start any screens)
+if __name__ == '__main__':
+    loading_screen = subprocess.Popen([sys.executable, "app/loading_screen.py"])
 # suppress deprecation warnings generated by imported libraries (e.g. xarray, pandas)
 warnings.simplefilter(action='ignore', category=FutureWarning)
 # get the logger
@@ -14,15 +16,15 @@ logger = logging.getLogger("telcorain")
 
 # start the main application
 try:
-    from PyQt6.QtGui import QFont, QFontDatabase
-    from PyQt6.QtWidgets import QApplication
-
-    from app.main_window import MainWindow
-    from handlers.http_handler import start_http_server_thread
-    from handlers.logging_handler import setup_file_logging, setup_init_logging
+    # app is imported only in the main process, not in the spawned worker processes
+    if __name__ == '__main__':
+        from PyQt6.QtGui import QFont, QFontDatabase
+        from PyQt6.QtWidgets import QApplication
 
+        from app.main_window import MainWindow
+        from handlers.http_handler import start_http_server_thread
+        from handlers.logging_handler import setup_file_logging, setup_init_logging
 
-    if __name__ == '__main__':
         # init logging
         setup_file_logging()
         init_logger = setup_init_logging()
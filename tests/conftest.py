@@ -0,0 +1,24 @@
+"""Common setup of the tests: modules of the application are imported from the repository root."""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT_DIR))
+
+_original_cwd = os.getcwd()
+_config_dir = tempfile.mkdtemp(prefix="telcorain_tests_")
+
+
+def pytest_configure(config):
+    # config handler reads './config.ini' of the working directory, tests always use the distributed configuration
+    shutil.copyfile(ROOT_DIR / "config.ini.dist", Path(_config_dir) / "config.ini")
+    os.chdir(_config_dir)
+
+
+def pytest_unconfigure(config):
+    os.chdir(_original_cwd)
+    shutil.rmtree(_config_dir, ignore_errors=True)
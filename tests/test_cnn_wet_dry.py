@@ -0,0 +1,45 @@
+"""Equivalence of the batched CNN wet/dry classification with pycomlink's per-link 'cnn_wet_dry'."""
+import numpy as np
+import pytest
+
+# the CNN model needs TensorFlow and pycomlink (git submodule)
+pytest.importorskip("tensorflow")
+cnn = pytest.importorskip("lib.pycomlink.pycomlink.processing.wet_dry.cnn")
+
+from procedures.rain.cnn_wet_dry import cnn_wet_dry_batched  # noqa: E402
+
+THRESHOLD = 0.82
+# 1 minute samples
+LENGTH = 12 * 60
+
+
+def _trsl(cmls_count: int, seed: int) -> np.ndarray:
+    """Random TRSL with rain events, with shape (cml_id, channel_id, time), with missing values in one CML."""
+    rng = np.random.default_rng(seed)
+    shape = (cmls_count, 2, LENGTH)
+
+    trsl = 50 + rng.normal(0, 0.3, shape)
+    # rain events: the same attenuation in both channels, increasing in random periods
+    rain = np.maximum(rng.normal(0, 1, (cmls_count, 1, LENGTH)).cumsum(axis=-1) * 0.3 - 3, 0)
+    trsl += rain * rng.uniform(0.8, 1.2, (cmls_count, 2, 1))
+    trsl[0, 0, 200:230] = np.nan
+    trsl[0, 1, 400] = np.nan
+
+    return trsl
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_batched_matches_per_link_cnn(seed):
+    trsl = _trsl(cmls_count=4, seed=seed)
+
+    result = cnn_wet_dry_batched(trsl, threshold=THRESHOLD)
+
+    assert result.shape == (trsl.shape[0], LENGTH)
+    for cml_trsl, cml_result in zip(trsl, result):
+        expected = cnn.cnn_wet_dry(
+            trsl_channel_1=cml_trsl[0],
+            trsl_channel_2=cml_trsl[1],
+            threshold=THRESHOLD,
+            batch_size=128
+        )
+        np.testing.assert_array_equal(cml_result, np.asarray(expected, dtype=float))
@@ -0,0 +1,74 @@
+"""Tests of building the stacked links dataset from raw units data."""
+import numpy as np
+
+from database.models.mwlink import MwLink
+from database.models.units_data import UnitsData
+from procedures.calculation_signals import CalcSignals
+from procedures.data.data_preprocessing import build_links_dataset
+
+TIMES_COUNT = 12
+
+
+def _link(link_id: int, ip_a: str, ip_b: str, tech: str = "ceragon_ip_20") -> MwLink:
+    return MwLink(
+        link_id=link_id, name=f"link {link_id}", tech=tech, name_a="A", name_b="B", freq_a=18000, freq_b=19000,
+        polarization="V", ip_a=ip_a, ip_b=ip_b, distance=2.5, latitude_a=49.0, longitude_a=14.0, latitude_b=49.1,
+        longitude_b=14.1, dummy_latitude_a=49.0, dummy_longitude_a=14.0, dummy_latitude_b=49.1, dummy_longitude_b=14.1
+    )
+
+
+def _units_data(fields_by_ip: dict[str, list[str]]) -> UnitsData:
+    times = np.datetime64("2024-06-01", "ns").astype(np.int64) + np.arange(TIMES_COUNT) * 600 * 10 ** 9
+    data = UnitsData(times, list(fields_by_ip))
+    for row, (ip, fields) in enumerate(fields_by_ip.items()):
+        # constant values: 10 * row of the unit + order of the field
+        for number, field in enumerate(fields):
+            values = np.full(TIMES_COUNT, row * 10.0 + number)
+            data.set_values(field, np.full(TIMES_COUNT, row), np.arange(TIMES_COUNT), values)
+    return data
+
+
+def test_links_without_both_channels_are_skipped():
+    all_fields = ["rx_power", "tx_power", "temperature"]
+    influx_data = _units_data({
+        "10.0.0.1": all_fields,
+        "10.0.0.2": all_fields,
+        "10.0.0.3": all_fields,
+        # unit without temperature
+        "10.0.0.5": ["rx_power", "tx_power"],
+        # constant Tx power unit without Tx power data
+        "10.0.0.6": ["rx_power", "temperature"],
+        "10.0.0.7": ["rx_power", "temperature"],
+    })
+    links = {
+        1: _link(1, "10.0.0.1", "10.0.0.2"),
+        # data of unit B are missing
+        2: _link(2, "10.0.0.3", "10.0.0.4"),
+        # only one channel is selected
+        3: _link(3, "10.0.0.2", "10.0.0.3"),
+        4: _link(4, "10.0.0.3", "10.0.0.5"),
+        5: _link(5, "10.0.0.6", "10.0.0.7", tech="1s10"),
+        # not selected
+        6: _link(6, "10.0.0.1", "10.0.0.3"),
+    }
+    selected_links = {1: 3, 2: 3, 3: 1, 4: 3, 5: 3, 6: 0}
+
+    dataset = build_links_dataset(CalcSignals(), selected_links, links, influx_data, [], "test")
+
+    assert dataset.cml_id.values.tolist() == [1, 4, 5]
+    assert dict(dataset.sizes) == {"cml_id": 3, "channel_id": 2, "time": TIMES_COUNT}
+
+    # channel A(rx)_B(tx) is received by unit A and transmitted by unit B, its frequency is the one of unit B (in GHz)
+    link_1 = dataset.sel(cml_id=1)
+    np.testing.assert_array_equal(link_1.rsl.values[:, 0], [0.0, 10.0])
+    np.testing.assert_array_equal(link_1.tsl.values[:, 0], [11.0, 1.0])
+    np.testing.assert_array_equal(link_1.temperature_rx.values[:, 0], [2.0, 12.0])
+    np.testing.assert_array_equal(link_1.temperature_tx.values[:, 0], [12.0, 2.0])
+    np.testing.assert_array_equal(link_1.frequency.values, [19.0, 18.0])
+
+    # missing temperature is filled with zeros
+    link_4 = dataset.sel(cml_id=4)
+    np.testing.assert_array_equal(link_4.temperature_rx.values[:, 0], [22.0, 0.0])
+
+    # constant Tx power devices have Tx zeros
+    np.testing.assert_array_equal(dataset.sel(cml_id=5).tsl.values, 0.0)
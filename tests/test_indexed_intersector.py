@@ -0,0 +1,110 @@
+"""Equivalence of IndexedIntersector with the sweep line intersector of the sweep_intersector library."""
+import numpy as np
+import pytest
+
+from lib.sweep_intersector.lib.SweepIntersector import SweepIntersector
+from procedures.utils.indexed_intersector import IndexedIntersector
+
+
+def _random_segments(count: int, seed: int) -> list:
+    """Segments with random endpoints, without any common points."""
+    rng = np.random.default_rng(seed)
+    points = 14.0 + rng.random((count, 2, 2))
+    return [((float(a[0]), float(a[1])), (float(b[0]), float(b[1]))) for a, b in points]
+
+
+def _network(links_count: int, seed: int) -> list:
+    """
+    Network of links between near sites (with coordinates rounded as in the links metadata), so many links share
+    their sites. Includes vertical, horizontal and T-junction links. There are no duplicate links (in any direction).
+    """
+    rng = np.random.default_rng(seed)
+    sites = np.round(np.column_stack([14 + rng.random(links_count // 2), 49 + rng.random(links_count // 2) * 0.5]), 6)
+
+    segments = {}
+    for _ in range(links_count):
+        i = rng.integers(len(sites))
+        distances = np.hypot(*(sites - sites[i]).T)
+        distances[i] = np.inf
+        j = rng.choice(np.argsort(distances)[:8])
+        a, b = sites[i], sites[j]
+        if rng.random() < 0.3:
+            a, b = b, a
+        segment = ((float(a[0]), float(a[1])), (float(b[0]), float(b[1])))
+        # skip duplicates in both directions
+        segments.setdefault(frozenset(segment), segment)
+
+    segments = list(segments.values())
+    segments.append(((14.5, 49.0), (14.5, 49.5)))
+    segments.append(((14.0, 49.25), (15.0, 49.25)))
+    # T-junction: endpoint lying on the horizontal link
+    segments.append(((14.2, 49.1), (14.3, 49.25)))
+    return segments
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_segments_match_sweep(seed):
+    segments = _random_segments(300, seed)
+
+    expected = SweepIntersector().findIntersections(segments)
+    assert len(expected) > 0
+    assert IndexedIntersector().findIntersections(segments) == dict(expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_network_with_shared_sites_matches_sweep(seed):
+    segments = _network(300, seed)
+
+    expected = SweepIntersector().findIntersections(segments)
+    assert len(expected) > 0
+    assert IndexedIntersector().findIntersections(segments) == dict(expected)
+
+
+@pytest.mark.parametrize("touching, is_intersection", [
+    # segment ending on the crossed segment
+    (((0.5, 1.0), (1.0, 0.0)), True),
+    (((1.0, -1.0), (1.0, 0.0)), True),
+    # segment starting on the crossed segment (sweep line does not report it)
+    (((1.0, 0.0), (1.5, 1.0)), False),
+    (((1.0, 1.0), (1.0, 0.0)), False),
+])
+def test_t_junction(touching, is_intersection):
+    horizontal = ((0.0, 0.0), (2.0, 0.0))
+    crossing = ((0.5, -1.0), (0.5, 1.0))
+    segments = [horizontal, touching, crossing]
+
+    result = IndexedIntersector().findIntersections(segments)
+
+    assert result == dict(SweepIntersector().findIntersections(segments))
+    assert ((1.0, 0.0) in result[horizontal]) == is_intersection
+    assert touching not in result
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_duplicate_links(seed):
+    # sweep line cannot process overlapping segments, duplicates (in both directions) are compared to the result of
+    # the network without them: each duplicate must have the same intersections as its original link
+    segments = _network(300, seed)
+    expected = dict(SweepIntersector().findIntersections(segments))
+
+    rng = np.random.default_rng(seed)
+    originals = [segments[i] for i in rng.choice(len(segments), 30, replace=False)]
+    duplicates = [original if k % 2 else original[::-1] for k, original in enumerate(originals)]
+    result = IndexedIntersector().findIntersections(segments + duplicates)
+
+    assert {segment: result[segment] for segment in expected} == expected
+    for original, duplicate in zip(originals, duplicates):
+        if original not in expected:
+            assert duplicate not in result
+        elif duplicate == original:
+            assert result[duplicate] == expected[original]
+        else:
+            assert result[duplicate] == expected[original][::-1]
+    assert set(result) == set(expected) | {d for o, d in zip(originals, duplicates) if o in expected}
+
+
+def test_degenerate_inputs():
+    assert IndexedIntersector().findIntersections([]) == {}
+    # zero-length and parallel segments have no intersections
+    segments = [((0.0, 0.0), (0.0, 0.0)), ((0.0, 0.0), (1.0, 1.0)), ((0.0, 1.0), (1.0, 2.0))]
+    assert IndexedIntersector().findIntersections(segments) == {}
@@ -0,0 +1,72 @@
+"""Regression tests of the intersection algorithm of the links segmentation."""
+import json
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from procedures.rain.links_segmentation import intersection_algorithm
+
+# expected results were recorded with the original nested-scan implementation of the intersection algorithm
+EXPECTED_PATH = Path(__file__).resolve().parent / "data" / "intersection_algorithm.json"
+
+# site ID -> (longitude, latitude)
+SITES = {
+    1: (14.0, 49.0),
+    2: (14.4, 49.4),
+    3: (14.0, 49.4),
+    4: (14.4, 49.0),
+    5: (14.2, 49.5),
+    6: (14.25, 48.9),
+    7: (14.5, 49.2),
+    8: (13.9, 49.2),
+}
+
+# CML ID, site A, site B, rain rate: links share their sites, CMLs 101 and 107 are on the same path, there are equal
+# mean rain rates (101 and 106, 102 and 105) and CML 104 has no rain rate (all NaN), three CMLs cross at one point
+LINKS = [
+    (101, 1, 2, 2.0),
+    (102, 3, 4, 0.0),
+    (103, 5, 6, 1.5),
+    (104, 8, 7, np.nan),
+    (105, 1, 4, 0.0),
+    (106, 2, 3, 2.0),
+    (107, 1, 2, 1.0),
+    (108, 7, 5, 3.0),
+    (109, 6, 8, 0.5),
+]
+
+
+def _network_dataset() -> xr.Dataset:
+    site_a = np.array([SITES[link[1]] for link in LINKS])
+    site_b = np.array([SITES[link[2]] for link in LINKS])
+    # constant rain rates of both channels
+    rain = np.repeat(np.array([link[3] for link in LINKS])[:, np.newaxis, np.newaxis], 2, axis=1)
+
+    return xr.Dataset(
+        data_vars={"R": (("cml_id", "channel_id", "time"), np.repeat(rain, 6, axis=2))},
+        coords={
+            "cml_id": [link[0] for link in LINKS],
+            "site_a_longitude": ("cml_id", site_a[:, 0]),
+            "site_a_latitude": ("cml_id", site_a[:, 1]),
+            "site_b_longitude": ("cml_id", site_b[:, 0]),
+            "site_b_latitude": ("cml_id", site_b[:, 1]),
+        }
+    )
+
+
+def test_intersection_algorithm_matches_nested_scan_implementation():
+    with open(EXPECTED_PATH, encoding="utf-8") as file:
+        expected = json.load(file)
+
+    intersections = {
+        tuple(tuple(point) for point in segment): [tuple(point) for point in points]
+        for segment, points in expected["intersections"]
+    }
+
+    segments = intersection_algorithm(_network_dataset(), intersections)
+
+    assert {str(cml_id): [list(values) for values in points] for cml_id, points in segments.items()} \
+        == expected["segments"]
+    # CMLs on the same path have the same segments
+    assert segments[101] == segments[107]
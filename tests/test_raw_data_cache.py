@@ -0,0 +1,80 @@
+"""Tests of the persistent cache of raw units data."""
+import os
+from datetime import datetime
+
+import numpy as np
+
+from database.models.units_data import UnitsData
+from database.raw_data_cache import RawDataCache
+
+CHUNK_START = datetime(2024, 6, 1)
+
+
+def _units_data(ips: list[str], fields: list[str], seed: int) -> UnitsData:
+    rng = np.random.default_rng(seed)
+    times = np.datetime64("2024-06-01", "ns").astype(np.int64) + np.arange(144) * 600 * 10 ** 9
+
+    data = UnitsData(times, ips)
+    for row, ip in enumerate(ips):
+        data.measurements[ip] = "mw_unit"
+        for field in fields:
+            data.set_values(field, np.full(times.shape, row), np.arange(len(times)), rng.normal(0, 10, times.shape))
+    return data
+
+
+def _cache(tmp_path) -> RawDataCache:
+    cache = RawDataCache()
+    cache.directory = str(tmp_path / "raw_cache")
+    return cache
+
+
+def test_chunk_is_stored_as_one_entry(tmp_path):
+    cache = _cache(tmp_path)
+    data = _units_data(["10.0.0.1", "10.0.0.2"], ["rx_power", "tx_power"], seed=0)
+
+    # unit 10.0.0.3 has no data in the chunk
+    cache.store_chunk("bucket", "mapped", ["10.0.0.1", "10.0.0.2", "10.0.0.3"], 10, CHUNK_START, data)
+
+    files = [name for _, _, names in os.walk(cache.directory) for name in names]
+    assert len(files) == 1
+
+    loaded, missing = cache.load_chunk("bucket", "mapped", ["10.0.0.2", "10.0.0.3", "10.0.0.4"], 10, CHUNK_START)
+
+    assert missing == ["10.0.0.4"]
+    assert loaded.ips == ["10.0.0.2"]
+    np.testing.assert_array_equal(loaded.times, data.times)
+    assert loaded.measurements == {"10.0.0.2": "mw_unit"}
+    assert loaded["10.0.0.2"].keys() == data["10.0.0.2"].keys()
+    for field, values in data["10.0.0.2"].items():
+        np.testing.assert_array_equal(loaded["10.0.0.2"][field], values)
+
+
+def test_units_are_merged_into_chunk_entry(tmp_path):
+    cache = _cache(tmp_path)
+    first = _units_data(["10.0.0.1"], ["rx_power", "tx_power"], seed=0)
+    second = _units_data(["10.0.0.2"], ["rx_power", "temperature"], seed=1)
+
+    cache.store_chunk("bucket", "mapped", ["10.0.0.1"], 10, CHUNK_START, first)
+    cache.store_chunk("bucket", "mapped", ["10.0.0.2"], 10, CHUNK_START, second)
+
+    loaded, missing = cache.load_chunk("bucket", "mapped", ["10.0.0.1", "10.0.0.2"], 10, CHUNK_START)
+
+    assert missing == []
+    assert loaded.ips == ["10.0.0.1", "10.0.0.2"]
+    assert set(loaded["10.0.0.1"]) == {"rx_power", "tx_power"}
+    assert set(loaded["10.0.0.2"]) == {"rx_power", "temperature"}
+    np.testing.assert_array_equal(loaded["10.0.0.1"]["tx_power"], first["10.0.0.1"]["tx_power"])
+    np.testing.assert_array_equal(loaded["10.0.0.2"]["temperature"], second["10.0.0.2"]["temperature"])
+
+    # other chunks, steps and buckets are separate entries
+    assert cache.load_chunk("bucket", "mapped", ["10.0.0.1"], 5, CHUNK_START) == (None, ["10.0.0.1"])
+    assert cache.load_chunk("other", "mapped", ["10.0.0.1"], 10, CHUNK_START) == (None, ["10.0.0.1"])
+
+
+def test_chunk_without_data_is_cached(tmp_path):
+    cache = _cache(tmp_path)
+    empty = UnitsData(np.empty((0,), dtype=np.int64), [])
+
+    cache.store_chunk("bucket", "mapped", ["10.0.0.1"], 10, CHUNK_START, empty)
+
+    assert cache.load_chunk("bucket", "mapped", ["10.0.0.1"], 10, CHUNK_START) == (None, [])
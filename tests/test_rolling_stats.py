@@ -0,0 +1,64 @@
+"""Equivalence of the rolling standard deviation with xarray's rolling window."""
+import numpy as np
+import pytest
+import xarray as xr
+
+from procedures.utils.rolling_stats import rolling_std
+
+LENGTH = 120
+
+
+def _timeseries(seed: int) -> xr.DataArray:
+    """
+    Random TRSL-like timeseries with dimensions (cml_id, channel_id, time), with missing values, whole missing
+    timeseries and constant timeseries.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (6, 2, LENGTH)
+
+    values = 50 + rng.normal(0, 0.5, shape).cumsum(axis=-1) + rng.normal(0, 1, shape)
+    values[rng.random(shape) < 0.03] = np.nan
+    values[1, 0] = np.nan
+    values[2, 1] = 47.3
+
+    return xr.DataArray(values, dims=("cml_id", "channel_id", "time"))
+
+
+@pytest.mark.parametrize("center", [False, True])
+@pytest.mark.parametrize("window", [1, 2, 3, 4, 5, 10, 11, LENGTH - 1, LENGTH, LENGTH + 1])
+@pytest.mark.parametrize("seed", range(2))
+def test_rolling_std_matches_xarray(seed, window, center):
+    values = _timeseries(seed)
+
+    expected = values.rolling(time=window, center=center).std(skipna=False).values
+    result = rolling_std(values.values, window=window, center=center)
+
+    # missing values (incomplete windows and windows with NaNs) must be at the same positions
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    # cumulative sums differ from the direct computation only by rounding errors, in the order of sqrt(eps) for zero
+    # standard deviations
+    np.testing.assert_allclose(result, expected, rtol=1e-7, atol=1e-6)
+
+
+@pytest.mark.parametrize("center, valid_positions", [
+    # trailing window of position i is [i - 3, i]
+    (False, [3, 4, 9]),
+    # centered window of even length has one more value on the left side: [i - 2, i + 1]
+    (True, [2, 3, 8]),
+])
+def test_rolling_std_nan_propagation(center, valid_positions):
+    values = np.arange(10, dtype=float) ** 2
+    values[5] = np.nan
+
+    result = rolling_std(values, window=4, center=center)
+
+    np.testing.assert_array_equal(np.flatnonzero(~np.isnan(result)), valid_positions)
+    expected = [np.std(values[position - 3 + center:position + 1 + center]) for position in valid_positions]
+    np.testing.assert_allclose(result[valid_positions], expected)
+
+
+def test_rolling_std_keeps_shape_of_any_dimension():
+    values = np.random.default_rng(0).normal(0, 1, (3, 4, 5, 30))
+
+    assert rolling_std(values, window=5).shape == values.shape
+    assert rolling_std(values[0, 0, 0], window=5).shape == (30,)
@@ -0,0 +1,70 @@
+"""Equivalence of the compiled wet antenna attenuation kernel with pycomlink's implementation."""
+import numpy as np
+import pytest
+import xarray as xr
+
+from procedures.rain import wet_antenna
+
+# pycomlink is a git submodule, the reference implementation is not available without it
+pycmlp = pytest.importorskip("lib.pycomlink.pycomlink.processing")
+
+WAA_MAX = 2.3
+DELTA_T = 60 / ((60 / 1) * 60)
+TAU = 15
+
+
+def _links_data(cmls_count: int, length: int, seed: int) -> tuple[xr.DataArray, xr.DataArray, xr.DataArray]:
+    """
+    Random TRSL, baseline and wet/dry states of links with dimensions (cml_id, channel_id, time). Data contain
+    missing values (in TRSL, baseline and wet/dry states), all-dry and all-wet timeseries.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (cmls_count, 2, length)
+
+    trsl = rng.normal(50, 3, shape)
+    baseline = np.repeat(rng.normal(48, 1, shape[:2])[..., np.newaxis], length, axis=-1)
+    wet = (rng.random(shape) < 0.4).astype(float)
+
+    trsl[rng.random(shape) < 0.05] = np.nan
+    baseline[rng.random(shape) < 0.02] = np.nan
+    wet[rng.random(shape) < 0.05] = np.nan
+    # whole missing timeseries
+    trsl[0, 1] = np.nan
+    # all-dry and all-wet timeseries
+    wet[1] = 0.0
+    wet[2, 0] = 1.0
+
+    dims = ("cml_id", "channel_id", "time")
+    coords = {"cml_id": np.arange(cmls_count), "channel_id": ["A(rx)_B(tx)", "B(rx)_A(tx)"], "time": np.arange(length)}
+    return (
+        xr.DataArray(trsl, dims=dims, coords=coords),
+        xr.DataArray(baseline, dims=dims, coords=coords),
+        xr.DataArray(wet, dims=dims, coords=coords)
+    )
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_kernel_matches_pycomlink(seed):
+    trsl, baseline, wet = _links_data(cmls_count=20, length=300, seed=seed)
+
+    expected = pycmlp.wet_antenna.waa_schleiss_2013(
+        rsl=trsl, baseline=baseline, wet=wet, waa_max=WAA_MAX, delta_t=DELTA_T, tau=TAU
+    )
+    waa = wet_antenna.waa_schleiss_2013(
+        A=(trsl - baseline).values, wet=wet.values, waa_max=WAA_MAX, delta_t=DELTA_T, tau=TAU
+    )
+
+    np.testing.assert_array_equal(waa, expected.transpose(*trsl.dims).values)
+
+
+def test_dry_waa_is_attenuation_limited_by_maximum():
+    trsl, baseline, wet = _links_data(cmls_count=5, length=100, seed=0)
+    attenuation = (trsl - baseline).values
+
+    waa = wet_antenna.waa_schleiss_2013(
+        A=attenuation, wet=np.zeros_like(attenuation), waa_max=WAA_MAX, delta_t=DELTA_T, tau=TAU
+    )
+
+    # first value is always zero, dry values are min(A, waa_max) with NaN kept only where A is missing
+    assert (waa[..., 0] == 0).all()
+    np.testing.assert_array_equal(waa[..., 1:], np.where(attenuation > WAA_MAX, WAA_MAX, attenuation)[..., 1:])